@@ -1,12 +1,9 @@
-import csv
-
 from django.contrib import admin
-from django.http import HttpResponse
 from leaflet.admin import LeafletGeoAdmin
 
 from . import models
 
-from myvoice.core.utils import extract_qset_data
+from myvoice.core.admin import CSVExportMixin
 
 
 class ClinicStaffInline(admin.TabularInline):
@@ -47,13 +44,16 @@ class PatientAdmin(admin.ModelAdmin):
     search_fields = ['name', 'mobile']
 
 
-class VisitAdmin(admin.ModelAdmin):
+class VisitAdmin(CSVExportMixin, admin.ModelAdmin):
     date_hierarchy = 'visit_time'
     list_display = ['patient_serial', 'mobile', 'clinic', 'service',
                     'visit_time', 'welcome_sent', 'survey_sent']
     list_filter = ['patient__clinic', 'service']
     list_select_related = True
-    actions = ['export_to_csv']
+    actions = ['export_to_csv', 'export_in_background']
+    export_name = 'visit_data'
+    export_fields = ['patient.serial', 'patient.clinic', 'service', 'staff',
+                     'visit_time', 'welcome_sent', 'survey_sent', 'mobile']
 
     def clinic(self, obj):
         return obj.patient.clinic
@@ -61,16 +61,10 @@ class VisitAdmin(admin.ModelAdmin):
     def patient_serial(self, obj):
         return obj.patient.serial
 
-    def export_to_csv(self, request, queryset):
-        headers = ['patient.serial', 'patient.clinic', 'service', 'staff',
-                   'visit_time', 'welcome_sent', 'survey_sent', 'mobile']
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename=visit_data.csv'
-        data = extract_qset_data(queryset, headers)
-        writer = csv.writer(response)
-        for line in data:
-            writer.writerow(line)
-        return response
+    def get_export_queryset(self, queryset):
+        # ClinicStaff are shown using their user's name.
+        queryset = super(VisitAdmin, self).get_export_queryset(queryset)
+        return queryset.select_related('staff__user')
 
     def has_change_permission(self, request, obj=None):
         if request.user.is_superuser:
@@ -7,6 +7,7 @@ from datetime import timedelta
 import logging
 
 from . import models
+from .utils import clinics_by_code, services_by_code
 
 from myvoice.survey import utils as survey_utils
 
@@ -39,6 +40,15 @@ class VisitForm(forms.Form):
     serial_max = 6
     min_wait_time = 1800  # Minimum time between visits by same patient in seconds
 
+    def __init__(self, *args, **kwargs):
+        # The registry keeps track of errors and earlier visits; see
+        # myvoice.clinics.registration.
+        self.registry = kwargs.pop('registry', None)
+        if self.registry is None:
+            from .registration import DatabaseRegistry
+            self.registry = DatabaseRegistry()
+        super(VisitForm, self).__init__(*args, **kwargs)
+
     def replace_alpha(self, text):
         """Convert 'o' and 'O' to '0', and 'i', 'I' to '1'."""
         return text.replace('o', '0').replace('O', '0').replace('i', '1').replace(
@@ -64,7 +74,7 @@ class VisitForm(forms.Form):
 
         # Check if clinic is valid
         try:
-            clinic = models.Clinic.objects.get(code=clnc)
+            clinic = clinics_by_code.get(clnc)
         except (models.Clinic.DoesNotExist, ValueError):
             error_list.append('clinic')
             clinic = None
@@ -76,7 +86,7 @@ class VisitForm(forms.Form):
 
         # Check if Service is valid
         try:
-            service = models.Service.objects.get(code=srvc)
+            service = services_by_code.get(srvc)
         except models.Service.DoesNotExist:
             error_list.append('service')
             service = None
@@ -87,35 +97,25 @@ class VisitForm(forms.Form):
         if len(error_list) > 0:
             fld_list = ', '.join(error_list).upper()
             logger.debug("The errors in error_list are {}".format(fld_list))
-            if models.VisitRegistrationError.objects.filter(
-                    sender=sender).count() >= 2 and 'mobile' not in error_list:
+            if self.registry.error_count(sender) >= 2 and 'mobile' not in error_list:
                 # Save error log
-                models.VisitRegistrationErrorLog.objects.create(
-                    sender=sender,
-                    error_type=fld_list,
-                    message=self.cleaned_data['text'])
+                self.registry.log_error(sender, fld_list, self.cleaned_data['text'])
                 # Clear Current Error state
-                models.VisitRegistrationError.objects.filter(
-                    sender=sender).delete()
+                self.registry.clear_errors(sender)
             else:
                 # Save error state
-                models.VisitRegistrationError.objects.create(sender=sender)
+                self.registry.add_error(sender)
                 error_msg = 'Error for serial {0}. There was a mistake in entering '\
                     '{1}. Please check and enter the whole registration '\
                     'code again.'.format(serial, fld_list)
                 raise forms.ValidationError(error_msg)
         else:
             # Clear Current Error state
-            models.VisitRegistrationError.objects.filter(
-                sender=sender).delete()
+            self.registry.clear_errors(sender)
             # Check if a duplicate in 30 mins
             min_wait_time = timezone.now() - timedelta(
                 seconds=self.min_wait_time)
-            if models.Visit.objects.filter(
-                    mobile=mobile,
-                    patient__serial=serial,
-                    patient__clinic=clinic,
-                    visit_time__gt=min_wait_time).count():
+            if self.registry.is_duplicate(mobile, serial, clinic, min_wait_time):
                 raise forms.ValidationError("Registration for patient with serial {} was"
                                             " received before. Thank you.".format(serial))
 
@@ -146,9 +146,8 @@ class FeedbackForm(forms.Form):
 
     def clean_phone(self):
         """Validate that phone is not in blocked list."""
-        blocked = models.Visit.objects.exclude(sender='').values_list('sender', flat=True)
         phone = survey_utils.convert_to_local_format(self.cleaned_data['phone'])
-        if phone in blocked:
+        if phone and models.BlockedSender.objects.filter(sender=phone).exists():
             raise forms.ValidationError('The phone is not allowed')
         return self.cleaned_data['phone']
 
@@ -171,7 +170,7 @@ class FeedbackForm(forms.Form):
             elif label == 'general feedback':
                 message = value
             elif label == 'clinic':
-                clinic = models.Clinic.objects.get(code=category)
+                clinic = clinics_by_code.get(category)
             elif label == 'which clinic':
                 clinic_text = value
 
@@ -0,0 +1,184 @@
+import random
+import time
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from south.db import db
+
+from myvoice.clinics.models import Clinic, Patient, Service, Visit
+from myvoice.survey.models import Survey, SurveyQuestion, SurveyQuestionResponse
+
+
+# The indexes added for the report and importer queries, as
+# (table, columns) or the name of an index created with raw SQL.
+INDEXES = [
+    ('clinics_visit', ['visit_time']),
+    ('clinics_visit', ['sender']),
+    ('clinics_visit', ['mobile', 'visit_time']),
+    ('clinics_visit', ['patient_id', 'visit_time']),
+    'clinics_visit_new',
+    ('survey_surveyquestionresponse', ['clinic_id', 'question_id', 'datetime']),
+    ('survey_surveyquestionresponse', ['visit_time']),
+    ('survey_surveyquestionresponse', ['clinic_id', 'visit_time']),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Show the query plans and timings of the hot report and importer queries, "
+            "with and without their indexes. Everything is rolled back afterwards, but "
+            "the tables are locked while it runs, so use a copy of the database. "
+            "Requires PostgreSQL.")
+    option_list = BaseCommand.option_list + (
+        make_option('--visits', dest='visits', type='int', default=0,
+                    help="Number of visits, with responses, to generate before "
+                         "benchmarking. Defaults to using the existing data."),
+        make_option('--clinics', dest='clinics', type='int', default=20,
+                    help="Number of clinics to spread generated visits over."),
+        make_option('--repeat', dest='repeat', type='int', default=5,
+                    help="Number of times to run each query."),
+        make_option('--plans', dest='plans', action='store_true', default=False,
+                    help="Print the EXPLAIN ANALYZE output of each query."),
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The benchmark uses PostgreSQL's EXPLAIN ANALYZE.")
+        try:
+            with transaction.atomic():
+                if options['visits']:
+                    self.generate(options['visits'], options['clinics'])
+                cursor = connection.cursor()
+                cursor.execute('ANALYZE')
+                after = self.benchmark(options['repeat'], options['plans'], 'with indexes')
+                self.drop_indexes()
+                cursor.execute('ANALYZE')
+                before = self.benchmark(options['repeat'], options['plans'], 'without indexes')
+                raise Rollback()
+        except Rollback:
+            pass
+
+        self.stdout.write('\n{0:<28} {1:>16} {2:>16}'.format(
+            'Query (ms)', 'without indexes', 'with indexes'))
+        for (name, without), (_, with_) in zip(before, after):
+            self.stdout.write('{0:<28} {1:>16.2f} {2:>16.2f}'.format(name, without, with_))
+
+    def generate(self, num_visits, num_clinics):
+        """Generate visits and responses spread over clinics, services and a year."""
+        self.stdout.write('Generating {0} visits...'.format(num_visits))
+        now = timezone.now()
+        code = (Clinic.objects.aggregate(code=Max('code'))['code'] or 0) + 1
+        clinics = []
+        for n in range(num_clinics):
+            clinics.append(Clinic(
+                name='Benchmark Clinic {0}'.format(n), slug='benchmark-clinic-{0}'.format(n),
+                town='Benchmark', ward='Benchmark', code=code + n))
+        Clinic.objects.bulk_create(clinics)
+        clinics = list(Clinic.objects.filter(name__startswith='Benchmark Clinic '))
+
+        code = (Service.objects.aggregate(code=Max('code'))['code'] or 0) + 1
+        Service.objects.bulk_create([
+            Service(name='Benchmark Service {0}'.format(n), slug='benchmark-service-{0}'.format(n),
+                    code=code + n)
+            for n in range(5)])
+        services = list(Service.objects.filter(name__startswith='Benchmark Service '))
+
+        flow_id = (Survey.objects.aggregate(flow_id=Max('flow_id'))['flow_id'] or 0) + 1
+        survey = Survey.objects.create(flow_id=flow_id, name='Benchmark')
+        SurveyQuestion.objects.bulk_create([
+            SurveyQuestion(survey=survey, label='Benchmark {0}'.format(n),
+                           question_id='benchmark-{0}'.format(n), categories='Yes\nNo',
+                           report_order=n,
+                           question_type=SurveyQuestion.MULTIPLE_CHOICE)
+            for n in range(5)])
+        questions = list(survey.surveyquestion_set.all())
+
+        # Patients visit a few times each.
+        Patient.objects.bulk_create([
+            Patient(clinic=random.choice(clinics), serial=str(n),
+                    mobile='080{0:08d}'.format(n))
+            for n in range(num_visits // 3 + 1)], batch_size=1000)
+        patients = list(Patient.objects.filter(clinic__in=clinics))
+
+        visits = []
+        for n in range(num_visits):
+            patient = random.choice(patients)
+            visit_time = now - timedelta(minutes=random.randint(0, 365 * 24 * 60))
+            visits.append(Visit(
+                patient=patient, service=random.choice(services), visit_time=visit_time,
+                mobile=patient.mobile, sender='070{0:08d}'.format(random.randint(0, 500)),
+                welcome_sent=None if random.random() < 0.01 else visit_time,
+                survey_sent=visit_time + timedelta(hours=1)))
+        Visit.objects.bulk_create(visits, batch_size=1000)
+
+        responses = []
+        for visit_pk, clinic_pk, service_pk, visit_time in Visit.objects.filter(
+                patient__clinic__in=clinics).values_list(
+                'pk', 'patient__clinic', 'service', 'visit_time'):
+            if random.random() < 0.5:
+                for question in questions:
+                    responses.append(SurveyQuestionResponse(
+                        question=question, visit_id=visit_pk, clinic_id=clinic_pk,
+                        service_id=service_pk, visit_time=visit_time,
+                        response=random.choice(['Yes', 'No']),
+                        datetime=visit_time + timedelta(hours=2)))
+        SurveyQuestionResponse.objects.bulk_create(responses, batch_size=1000)
+        self.stdout.write('Generated {0} visits and {1} responses.'.format(
+            len(visits), len(responses)))
+
+    def get_queries(self):
+        """The queries to benchmark, as (name, queryset)."""
+        now = timezone.now()
+        week_ago = now - timedelta(7)
+        visit = Visit.objects.order_by('-visit_time').select_related('patient').first()
+        response = SurveyQuestionResponse.objects.exclude(clinic=None).first()
+        mobiles = list(Visit.objects.order_by('-visit_time').values_list(
+            'mobile', flat=True)[:100])
+        return [
+            ('visits by mobile', Visit.objects.filter(
+                mobile__in=mobiles, visit_time__lt=now)),
+            ('clinic visits', Visit.objects.filter(
+                patient__clinic=visit.patient.clinic_id if visit else None,
+                survey_sent__isnull=False, visit_time__range=(week_ago, now))),
+            ('visits by sender', Visit.objects.filter(sender=visit.sender if visit else '')),
+            ('new visits', Visit.objects.filter(welcome_sent__isnull=True)),
+            ('clinic responses', SurveyQuestionResponse.objects.filter(
+                clinic=response.clinic_id if response else None,
+                question=response.question_id if response else None,
+                datetime__range=(week_ago, now))),
+            ('responses by visit time', SurveyQuestionResponse.objects.filter(
+                visit_time__range=(week_ago, now))),
+        ]
+
+    def benchmark(self, repeat, plans, label):
+        """Run each query repeat times, returning the mean times in ms as (name, ms)."""
+        self.stdout.write('\nRunning queries {0}...'.format(label))
+        cursor = connection.cursor()
+        timings = []
+        for name, queryset in self.get_queries():
+            sql, params = queryset.query.sql_with_params()
+            if plans:
+                cursor.execute('EXPLAIN ANALYZE ' + sql, params)
+                self.stdout.write('\n{0}:'.format(name))
+                for row in cursor.fetchall():
+                    self.stdout.write('    {0}'.format(row[0]))
+            start = time.time()
+            for i in range(repeat):
+                cursor.execute(sql, params)
+                cursor.fetchall()
+            timings.append((name, (time.time() - start) * 1000 / repeat))
+        return timings
+
+    def drop_indexes(self):
+        for index in INDEXES:
+            if isinstance(index, tuple):
+                index = db.create_index_name(*index)
+            db.execute('DROP INDEX IF EXISTS {0}'.format(index))
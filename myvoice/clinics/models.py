@@ -1,9 +1,13 @@
 from datetime import date
 
+from django.conf import settings
 from django.contrib.gis.db import models as gis
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
+from myvoice.core.storage import private_storage
 from myvoice.core.validators import validate_year
 
 
@@ -161,15 +165,16 @@ class Visit(models.Model):
     patient = models.ForeignKey('Patient')
     service = models.ForeignKey('Service', blank=True, null=True)
     staff = models.ForeignKey('ClinicStaff', blank=True, null=True)
-    visit_time = models.DateTimeField(default=timezone.now)
+    visit_time = models.DateTimeField(default=timezone.now, db_index=True)
 
     # welcome_sent is used to signify that a message is new (value is null).
     # Welcome messages are no longer sent.
     # See issue: https://github.com/myvoice-nigeria/myvoice/issues/207
+    # New visits are found with a partial index created in migration 0057.
     welcome_sent = models.DateTimeField(blank=True, null=True)
     survey_sent = models.DateTimeField(blank=True, null=True)
     mobile = models.CharField(max_length=11, blank=True)
-    sender = models.CharField(max_length=11, blank=True)
+    sender = models.CharField(max_length=11, blank=True, db_index=True)
 
     # The following fields denormalize to help reporting
     # so questions are more flexible.
@@ -184,6 +189,67 @@ class Visit(models.Model):
         permissions = (
             ('readonly', 'Can Only Read Visits'),
         )
+        index_together = [
+            # Matching responses and registrations to recent visits by phone.
+            ('mobile', 'visit_time'),
+            # Reports on a clinic's visits over a period.
+            ('patient', 'visit_time'),
+        ]
+
+
+class BlockedSender(models.Model):
+    """A phone number which has registered a Visit.
+
+    Numbers used by clinic staff to register visits do not receive surveys
+    and may not send feedback. This table is kept in step with Visit.sender
+    (see the signal handlers below), so that checking whether a number is
+    blocked is a single indexed lookup."""
+    sender = models.CharField(max_length=11, unique=True)
+
+    def __unicode__(self):
+        return self.sender
+
+    @classmethod
+    def add(cls, senders):
+        """Block each of the given senders which isn't already blocked."""
+        senders = set(s for s in senders if s)
+        if senders:
+            existing = cls.objects.filter(sender__in=senders).values_list('sender', flat=True)
+            new_senders = senders.difference(existing)
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create([cls(sender=s) for s in new_senders])
+            except IntegrityError:
+                # Another process blocked one of them in the meantime.
+                for s in new_senders:
+                    cls.objects.get_or_create(sender=s)
+
+    @classmethod
+    def remove_unused(cls, sender):
+        """Unblock the sender if no Visit is registered by it any more."""
+        if sender and not Visit.objects.filter(sender=sender).exists():
+            cls.objects.filter(sender=sender).delete()
+
+
+@receiver(post_init, sender=Visit)
+def remember_visit_sender(sender, instance, **kwargs):
+    instance._original_sender = instance.sender
+
+
+@receiver(post_save, sender=Visit)
+def block_visit_sender(sender, instance, created, **kwargs):
+    original = getattr(instance, '_original_sender', None)
+    if created or instance.sender != original:
+        if instance.sender:
+            BlockedSender.objects.get_or_create(sender=instance.sender)
+        if not created:
+            BlockedSender.remove_unused(original)
+        instance._original_sender = instance.sender
+
+
+@receiver(post_delete, sender=Visit)
+def unblock_visit_sender(sender, instance, **kwargs):
+    BlockedSender.remove_unused(getattr(instance, '_original_sender', instance.sender))
 
 
 class VisitRegistrationError(models.Model):
@@ -265,3 +331,76 @@ class ClinicScore(models.Model):
 
     def __unicode__(self):
         return unicode(self.clinic)
+
+
+class ReportJobManager(models.Manager):
+
+    def get_current(self, lga, start_date, end_date, data_version):
+        """
+        The latest job for the given parameters and version of the LGA's
+        data which has not failed, if any.
+
+        Jobs which are still pending or running REPORT_JOB_TIMEOUT seconds
+        after they were submitted are assumed to have been lost, and are
+        marked as failed so that a new one is submitted.
+        """
+        jobs = self.filter(
+            lga=lga, start_date=start_date, end_date=end_date, data_version=data_version)
+        cutoff = timezone.now() - timezone.timedelta(seconds=settings.REPORT_JOB_TIMEOUT)
+        jobs.filter(status__in=[ReportJob.PENDING, ReportJob.RUNNING], created__lt=cutoff).update(
+            status=ReportJob.FAILED, error='Timed out.', completed=timezone.now())
+        return jobs.exclude(status=ReportJob.FAILED).order_by('-created').first()
+
+    def purge(self, current_versions):
+        """
+        Delete the jobs, and their PDFs, which were submitted more than
+        REPORT_JOB_EXPIRY seconds ago, and the finished jobs which are
+        superseded because the data of their LGA has changed since.
+        current_versions maps LGA ids to the current versions of their data.
+        Returns the number of jobs deleted.
+        """
+        cutoff = timezone.now() - timezone.timedelta(seconds=settings.REPORT_JOB_EXPIRY)
+        finished = (ReportJob.DONE, ReportJob.FAILED)
+        expired = []
+        for job in self.all():
+            superseded = job.data_version < current_versions.get(job.lga_id, 0)
+            if job.created < cutoff or (superseded and job.status in finished):
+                expired.append(job)
+        for job in expired:
+            if job.pdf:
+                job.pdf.delete(save=False)
+            job.delete()
+        return len(expired)
+
+
+class ReportJob(models.Model):
+    """A PDF of the reports of every clinic in an LGA, generated by a Celery task."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    lga = models.ForeignKey('LGA')
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(
+        null=True, blank=True, help_text="The last day included in the report.")
+    data_version = models.PositiveIntegerField(
+        default=0, help_text="The version of the LGA's data when the job was submitted.")
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    # The PDFs have predictable names, so they are kept out of the public
+    # media and only served by ReportJobDownload.
+    pdf = models.FileField(upload_to='reports', storage=private_storage, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    completed = models.DateTimeField(null=True, blank=True)
+
+    objects = ReportJobManager()
+
+    def __unicode__(self):
+        return u'{0} report {1}'.format(self.lga, self.pk)
@@ -13,6 +13,8 @@ from reportlab.platypus.doctemplate import SimpleDocTemplate
 from itertools import groupby
 import os
 
+from myvoice.core.instrumentation import instrument
+
 fontPath = os.path.join(settings.PROJECT_ROOT,
                         'myvoice/static/lib/bootstrap-3.2.0/fonts/glyphicons-halflings-regular.ttf')
 pdfmetrics.registerFont(TTFont('Glyphicons Halflings', fontPath))
@@ -312,6 +314,7 @@ class ReportPdfRenderer(object):
             flowables.append(tbl)
         return flowables
 
+    @instrument('pdf.render_to_list')
     def render_to_list(self, ctx):
         """Renders all report sections, returning them as a list of flowables."""
         elements = []
@@ -328,6 +331,7 @@ class ReportPdfRenderer(object):
         elements.append(page_break())
         return elements
 
+    @instrument('pdf.render_to_response')
     def render_to_response(self, flowables, outfile):
         """Renders a list of flowables as a PDF to the specified `outfile`."""
         doc = SimpleDocTemplate(outfile)
@@ -0,0 +1,220 @@
+"""
+Registration of patient visits from SMSes sent by clinic staff.
+
+Each registration is validated by VisitForm, which keeps track of the
+mistakes made by each sender and rejects repeated registrations. The state it
+reads and writes is held by a registry: DatabaseRegistry reads and writes the
+database as each message is handled, while BatchRegistry loads the state for
+a whole batch of messages up front and saves the results in a few statements
+once every message has been handled. Both give the same replies.
+"""
+from collections import defaultdict
+import logging
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from myvoice.statistics.models import DailyStatistic
+from myvoice.survey import utils as survey_utils
+
+from . import forms
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+
+SUCCESS_MSG = "Entry received for patient with serial number {}. Thank you."
+
+
+class DatabaseRegistry(object):
+    """Registration state read from and written to the database immediately."""
+
+    def error_count(self, sender):
+        """Number of consecutive registration errors made by the sender."""
+        return models.VisitRegistrationError.objects.filter(sender=sender).count()
+
+    def add_error(self, sender):
+        models.VisitRegistrationError.objects.create(sender=sender)
+
+    def clear_errors(self, sender):
+        models.VisitRegistrationError.objects.filter(sender=sender).delete()
+
+    def log_error(self, sender, error_type, message):
+        models.VisitRegistrationErrorLog.objects.create(
+            sender=sender, error_type=error_type, message=message)
+
+    def is_duplicate(self, mobile, serial, clinic, since):
+        """Whether the patient has been registered at the clinic since the given time."""
+        return models.Visit.objects.filter(
+            mobile=mobile,
+            patient__serial=serial,
+            patient__clinic=clinic,
+            visit_time__gt=since).exists()
+
+    def get_patient(self, clinic, serial, mobile):
+        try:
+            return models.Patient.objects.get(clinic=clinic, serial=serial)
+        except models.Patient.DoesNotExist:
+            return models.Patient.objects.create(clinic=clinic, serial=serial, mobile=mobile)
+
+    def add_visit(self, patient, service, mobile, sender):
+        models.Visit.objects.create(patient=patient, service=service, mobile=mobile, sender=sender)
+
+
+class BatchRegistry(DatabaseRegistry):
+    """
+    Registration state for a batch of messages, loaded with one query per
+    table and saved by save().
+    """
+
+    def __init__(self, messages):
+        super(BatchRegistry, self).__init__()
+        self.now = timezone.now()
+        senders, mobiles, serials = set(), set(), set()
+        parser = forms.VisitForm()
+        for message in messages:
+            senders.add(message.get('phone'))
+            text = message.get('text')
+            parts = []
+            if isinstance(text, basestring):
+                parts = parser.replace_alpha(text.strip()).split()
+            if len(parts) == 4:
+                mobiles.add(parts[1])
+                serials.add(parts[2])
+
+        # Consecutive errors by sender, and whether existing errors were cleared.
+        errors = models.VisitRegistrationError.objects.filter(sender__in=senders)
+        errors = errors.values_list('sender').annotate(count=Count('id'))
+        self.initial_errors = dict(errors)
+        self.errors = dict(self.initial_errors)
+        self.cleared = set()
+        self.error_logs = []
+
+        # (mobile, serial, clinic_id) of recent visits, for the duplicate check.
+        since = self.now - timezone.timedelta(seconds=forms.VisitForm.min_wait_time)
+        recent = models.Visit.objects.filter(mobile__in=mobiles, visit_time__gt=since)
+        self.recent_visits = defaultdict(list)
+        for mobile, serial, clinic_id, visit_time in recent.values_list(
+                'mobile', 'patient__serial', 'patient__clinic', 'visit_time'):
+            self.recent_visits[(mobile, serial, clinic_id)].append(visit_time)
+
+        self.patients = {}
+        for patient in models.Patient.objects.filter(serial__in=serials).order_by('pk'):
+            self.patients[(patient.clinic_id, patient.serial)] = patient
+        self.new_patients = []
+        self.visits = []
+
+    def error_count(self, sender):
+        return self.errors.get(sender, 0)
+
+    def add_error(self, sender):
+        self.errors[sender] = self.errors.get(sender, 0) + 1
+
+    def clear_errors(self, sender):
+        self.errors[sender] = 0
+        self.cleared.add(sender)
+
+    def log_error(self, sender, error_type, message):
+        self.error_logs.append(models.VisitRegistrationErrorLog(
+            sender=sender, error_type=error_type, message=message))
+
+    def is_duplicate(self, mobile, serial, clinic, since):
+        key = (mobile, serial, clinic.pk if clinic else None)
+        return any(visit_time > since for visit_time in self.recent_visits.get(key, []))
+
+    def get_patient(self, clinic, serial, mobile):
+        key = (clinic.pk if clinic else None, serial)
+        if key not in self.patients:
+            patient = models.Patient(clinic=clinic, serial=serial, mobile=mobile)
+            self.patients[key] = patient
+            self.new_patients.append(patient)
+        return self.patients[key]
+
+    def add_visit(self, patient, service, mobile, sender):
+        # The patient may not have been saved yet, so the Visit is only
+        # created once it has.
+        visit_time = timezone.now()
+        self.visits.append((patient, service, mobile, sender, visit_time))
+        key = (mobile, patient.serial, patient.clinic_id)
+        self.recent_visits[key].append(visit_time)
+
+    def save(self):
+        """Save the changes made while registering the batch."""
+        with transaction.atomic():
+            if self.cleared:
+                models.VisitRegistrationError.objects.filter(sender__in=self.cleared).delete()
+            new_errors = []
+            for sender, count in self.errors.items():
+                if sender not in self.cleared:
+                    count -= self.initial_errors.get(sender, 0)
+                new_errors.extend(models.VisitRegistrationError(sender=sender)
+                                  for i in range(count))
+            models.VisitRegistrationError.objects.bulk_create(new_errors)
+            models.VisitRegistrationErrorLog.objects.bulk_create(self.error_logs)
+
+            if self.new_patients:
+                models.Patient.objects.bulk_create(self.new_patients)
+                # bulk_create does not set primary keys, so look them up.
+                serials = set(p.serial for p in self.new_patients)
+                pks = {}
+                patients = models.Patient.objects.filter(serial__in=serials).order_by('pk')
+                for pk, clinic_id, serial in patients.values_list('pk', 'clinic', 'serial'):
+                    pks[(clinic_id, serial)] = pk
+                for patient in self.new_patients:
+                    patient.pk = pks[(patient.clinic_id, patient.serial)]
+
+            models.Visit.objects.bulk_create([
+                models.Visit(patient=patient, service=service, mobile=mobile,
+                             sender=sender, visit_time=visit_time)
+                for patient, service, mobile, sender, visit_time in self.visits])
+            # bulk_create skips the signals which block visit senders and
+            # update the report statistics.
+            models.BlockedSender.add(sender for _, _, _, sender, _ in self.visits)
+            DailyStatistic.objects.refresh(
+                (patient.clinic_id, visit_time) for patient, _, _, _, visit_time in self.visits)
+
+
+def register_visit(data, registry=None):
+    """
+    Register the visit described by a registration SMS, with 'phone' and
+    'text' keys. Returns the reply to send to the sender.
+    """
+    registry = registry or DatabaseRegistry()
+    form = forms.VisitForm(data, registry=registry)
+    if form.is_valid():
+        clnc, mobile, serial, serv, txt = form.cleaned_data['text']
+        logger.debug("visit form text is {}".format(txt))
+
+        sender = survey_utils.convert_to_local_format(form.cleaned_data['phone'])
+        if not sender:
+            sender = form.cleaned_data['phone']
+        patient = registry.get_patient(clnc, serial, mobile)
+
+        output_msg = SUCCESS_MSG.format(serial)
+        logger.debug("Output message for serial {0} is {1}".format(serial, output_msg))
+
+        registry.add_visit(patient, serv, mobile, sender)
+        return output_msg
+    else:
+        return get_error_msg(form)
+
+
+def register_visits(messages):
+    """
+    Register a batch of registration SMSes, in order. Returns the replies,
+    which are the same as if each message had been sent to register_visit.
+    """
+    with transaction.atomic():
+        registry = BatchRegistry(messages)
+        replies = [register_visit(message, registry) for message in messages]
+        registry.save()
+    return replies
+
+
+def get_error_msg(form):
+    """Extract the first error message from the form's 'text' field."""
+    msgs = ", ".join(form.errors['text'])
+    logger.debug("visit form error messages are {}".format(msgs))
+    return form.errors['text'][0]
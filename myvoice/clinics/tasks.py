@@ -0,0 +1,61 @@
+import datetime
+import io
+import logging
+import traceback
+
+from celery.task import task
+
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from myvoice.core.utils import get_date
+from myvoice.statistics.models import DataVersion
+
+from .models import ReportJob
+
+
+logger = logging.getLogger(__name__)
+
+
+@task
+def generate_report(job_pk):
+    """Render the all-facilities PDF for a ReportJob and store it."""
+    # Only one worker may take the job, should it be delivered twice.
+    pending = ReportJob.objects.filter(pk=job_pk, status=ReportJob.PENDING)
+    if not pending.update(status=ReportJob.RUNNING):
+        logger.info('Report job {0} is not pending.'.format(job_pk))
+        return
+    job = ReportJob.objects.get(pk=job_pk)
+
+    # The report takes the start of the first day and the start of the day
+    # after the last, as LGAClinicsReport.get does.
+    start_date = end_date = None
+    if job.start_date and job.end_date:
+        start_date = get_date(datetime.datetime.combine(job.start_date, datetime.time()))
+        end_date = get_date(datetime.datetime.combine(job.end_date, datetime.time()))
+        end_date += datetime.timedelta(1)
+
+    # The views submit the jobs, so they are imported here to avoid a cycle.
+    from .views import LGAClinicsReport
+    report = LGAClinicsReport(kwargs={'pk': job.lga_id})
+    out = io.BytesIO()
+    try:
+        report.render_facility_reports(start_date, end_date, out)
+    except Exception:
+        logger.exception('Failed to generate report job {0}.'.format(job_pk))
+        job.status = ReportJob.FAILED
+        job.error = traceback.format_exc()
+    else:
+        filename = '{0}.pdf'.format(report.get_filename(start_date, end_date))
+        job.pdf.save(filename, ContentFile(out.getvalue()), save=False)
+        job.status = ReportJob.DONE
+    job.completed = timezone.now()
+    job.save()
+
+
+@task
+def purge_report_jobs():
+    """Delete the expired and superseded report jobs, and their PDFs."""
+    current_versions = dict(DataVersion.objects.values_list('lga', 'version'))
+    deleted = ReportJob.objects.purge(current_versions)
+    logger.info('Deleted {0} report jobs.'.format(deleted))
@@ -7,6 +7,7 @@ from datetime import timedelta
 from myvoice.core.tests import factories
 
 from .. import forms
+from ..utils import clinics_by_code, services_by_code
 
 
 class TestFeedbackForm(TestCase):
@@ -22,6 +23,7 @@ class TestFeedbackForm(TestCase):
     """
 
     def setUp(self):
+        clinics_by_code.invalidate()
         self.clinic = factories.Clinic.create(name='test', code=1)
         self.phone = "+12065551212"
         self.values = [
@@ -88,6 +90,8 @@ class TestFeedbackForm(TestCase):
 class TestVisitForm(TestCase):
 
     def setUp(self):
+        clinics_by_code.invalidate()
+        services_by_code.invalidate()
         self.service = factories.Service.create(code=5)
         self.clinic = factories.Clinic.create(code=1)
         self.error_msg = 'Error for serial {}. There was a mistake in entering '\
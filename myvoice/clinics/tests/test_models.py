@@ -1,4 +1,6 @@
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
 
 from myvoice.core.tests import factories
 
@@ -68,6 +70,42 @@ class TestVisit(TestCase):
         self.assertEqual(str(obj), '5 at Hello')
 
 
+class TestBlockedSender(TestCase):
+
+    def get_blocked(self):
+        return sorted(models.BlockedSender.objects.values_list('sender', flat=True))
+
+    def test_new_visit(self):
+        """The sender of a new visit should be blocked."""
+        factories.Visit(sender='08011111111')
+        factories.Visit(sender='08011111111')
+        factories.Visit(sender='')
+        self.assertEqual(self.get_blocked(), ['08011111111'])
+
+    def test_change_sender(self):
+        """Changing the sender of a visit should unblock the old one if unused."""
+        visit = factories.Visit(sender='08011111111')
+        factories.Visit(sender='08022222222')
+        visit.sender = '08022222222'
+        visit.save()
+        self.assertEqual(self.get_blocked(), ['08022222222'])
+
+    def test_delete_visit(self):
+        """Deleting the last visit from a sender should unblock it."""
+        visit1 = factories.Visit(sender='08011111111')
+        visit2 = factories.Visit(sender='08011111111')
+        visit1.delete()
+        self.assertEqual(self.get_blocked(), ['08011111111'])
+        models.Visit.objects.get(pk=visit2.pk).delete()
+        self.assertEqual(self.get_blocked(), [])
+
+    def test_add(self):
+        """Senders added in bulk should be blocked once each."""
+        factories.Visit(sender='08011111111')
+        models.BlockedSender.add(['08011111111', '08022222222', '08022222222', ''])
+        self.assertEqual(self.get_blocked(), ['08011111111', '08022222222'])
+
+
 class TestManualRegistration(TestCase):
 
     Model = models.ManualRegistration
@@ -102,3 +140,28 @@ class TestClinicScore(TestCase):
         obj = self.Factory.create(
             clinic=factories.Clinic.create(name='test_clinic'))
         self.assertEqual(str(obj), 'test_clinic')
+
+
+@override_settings(REPORT_JOB_TIMEOUT=60 * 60)
+class TestReportJob(TestCase):
+
+    def setUp(self):
+        self.lga = factories.LGA.create(name='Wamba')
+
+    def test_get_current(self):
+        """The latest job which has not failed should be returned."""
+        job = models.ReportJob.objects.create(lga=self.lga, status=models.ReportJob.DONE)
+        models.ReportJob.objects.create(lga=self.lga, status=models.ReportJob.FAILED)
+        self.assertEqual(job, models.ReportJob.objects.get_current(self.lga, None, None, 0))
+        self.assertIsNone(models.ReportJob.objects.get_current(self.lga, None, None, 1))
+
+    def test_get_current_timed_out(self):
+        """Jobs which have been pending or running too long should be failed."""
+        for status in (models.ReportJob.PENDING, models.ReportJob.RUNNING):
+            job = models.ReportJob.objects.create(lga=self.lga, status=status)
+            self.assertEqual(job, models.ReportJob.objects.get_current(self.lga, None, None, 0))
+            models.ReportJob.objects.filter(pk=job.pk).update(
+                created=timezone.now() - timezone.timedelta(hours=2))
+            self.assertIsNone(models.ReportJob.objects.get_current(self.lga, None, None, 0))
+            job = models.ReportJob.objects.get(pk=job.pk)
+            self.assertEqual(models.ReportJob.FAILED, job.status)
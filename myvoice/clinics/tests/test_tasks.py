@@ -0,0 +1,99 @@
+import datetime
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from myvoice.core.tests import factories
+from myvoice.statistics.models import DataVersion
+from myvoice.survey import models as survey_models
+
+from .. import models
+from .. import tasks
+
+
+@override_settings(PDF_REPORT_WORKERS=1)
+class TestGenerateReport(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp(prefix='reports')
+        self.settings = override_settings(PRIVATE_MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.lga = factories.LGA.create(name='Wamba')
+        self.clinic = factories.Clinic.create(lga=self.lga, name='Clinic One')
+        survey = factories.Survey.create(role=survey_models.Survey.PATIENT_FEEDBACK)
+        factories.SurveyQuestion.create(
+            label='Wait Time',
+            survey=survey, categories='<1 hour\n1-2 hours\n2-4 hours\n>4 hours',
+            question_type=survey_models.SurveyQuestion.MULTIPLE_CHOICE)
+        factories.Visit.create(
+            patient__clinic=self.clinic, visit_time=timezone.now(), survey_sent=timezone.now())
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_generate(self):
+        """The PDF should be stored and the job marked as done."""
+        job = models.ReportJob.objects.create(
+            lga=self.lga, start_date=datetime.date(2014, 7, 1),
+            end_date=datetime.date(2014, 7, 31))
+        tasks.generate_report(job.pk)
+        job = models.ReportJob.objects.get(pk=job.pk)
+        self.assertEqual(models.ReportJob.DONE, job.status)
+        self.assertIsNotNone(job.completed)
+        self.assertIn('01-Jul-2014_to_31-Jul-2014', job.pdf.name)
+        # The PDF should only be served by ReportJobDownload.
+        self.assertTrue(job.pdf.path.startswith(self.media_root))
+        self.assertRaises(ValueError, lambda: job.pdf.url)
+        job.pdf.open('rb')
+        self.assertTrue(job.pdf.read().startswith('%PDF'))
+
+    def test_not_pending(self):
+        """Jobs which have already been taken should not be generated again."""
+        job = models.ReportJob.objects.create(lga=self.lga, status=models.ReportJob.RUNNING)
+        tasks.generate_report(job.pk)
+        job = models.ReportJob.objects.get(pk=job.pk)
+        self.assertEqual(models.ReportJob.RUNNING, job.status)
+        self.assertFalse(job.pdf)
+
+
+@override_settings(REPORT_JOB_EXPIRY=7 * 24 * 60 * 60)
+class TestPurgeReportJobs(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp(prefix='reports')
+        self.settings = override_settings(PRIVATE_MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.lga = factories.LGA.create(name='Wamba')
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def make_job(self, data_version=0, status=models.ReportJob.DONE, days=0):
+        job = models.ReportJob.objects.create(
+            lga=self.lga, data_version=data_version, status=status)
+        job.pdf.save('report.pdf', ContentFile('%PDF'))
+        models.ReportJob.objects.filter(pk=job.pk).update(
+            created=timezone.now() - timezone.timedelta(days=days))
+        return job
+
+    def test_purge(self):
+        """Expired and superseded jobs should be deleted with their PDFs."""
+        DataVersion.objects.create(lga=self.lga, version=2)
+        current = self.make_job(data_version=2)
+        expired = self.make_job(data_version=2, days=8)
+        superseded = self.make_job(data_version=1)
+        running = self.make_job(data_version=1, status=models.ReportJob.RUNNING)
+        tasks.purge_report_jobs()
+        self.assertEqual(
+            set([current.pk, running.pk]),
+            set(models.ReportJob.objects.values_list('pk', flat=True)))
+        for job in (expired, superseded):
+            self.assertFalse(os.path.exists(job.pdf.path))
+        self.assertTrue(os.path.exists(current.pdf.path))
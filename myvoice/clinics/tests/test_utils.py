@@ -0,0 +1,60 @@
+from django.test import TestCase
+
+from myvoice.core.tests import factories
+
+from .. import models
+from ..utils import CodeCache
+
+
+class TestCodeCache(TestCase):
+
+    def setUp(self):
+        self.clinic = factories.Clinic(code=1)
+        self.cache = CodeCache(models.Clinic)
+
+    def test_get(self):
+        """Objects should be looked up by code without further queries."""
+        self.assertEqual(self.cache.get('1'), self.clinic)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get(1), self.clinic)
+
+    def test_invalid_code(self):
+        """Codes which aren't numbers should raise ValueError."""
+        self.assertRaises(ValueError, self.cache.get, 'abc')
+
+    def test_does_not_exist(self):
+        """Unknown codes should raise DoesNotExist without reloading."""
+        self.cache.get(1)
+        with self.assertNumQueries(0):
+            self.assertRaises(models.Clinic.DoesNotExist, self.cache.get, 2)
+            self.assertRaises(models.Clinic.DoesNotExist, self.cache.get, 2)
+
+    def test_added_elsewhere(self):
+        """Objects added without signals, as by another process, should be
+        found once the cache times out."""
+        self.assertRaises(models.Clinic.DoesNotExist, self.cache.get, 2)
+        models.Clinic.objects.filter(pk=self.clinic.pk).update(code=2)
+        self.assertRaises(models.Clinic.DoesNotExist, self.cache.get, 2)
+        with self.settings(CODE_CACHE_TIMEOUT=-1):
+            self.assertEqual(self.cache.get(2), self.clinic)
+
+    def test_invalidate_on_save(self):
+        """Saving an object should refresh the cache."""
+        self.cache.get(1)
+        self.clinic.code = 2
+        self.clinic.save()
+        self.assertEqual(self.cache.get(2), self.clinic)
+        self.assertRaises(models.Clinic.DoesNotExist, self.cache.get, 1)
+
+    def test_invalidate_on_delete(self):
+        """Deleting an object should refresh the cache."""
+        self.cache.get(1)
+        self.clinic.delete()
+        self.assertRaises(models.Clinic.DoesNotExist, self.cache.get, 1)
+
+    def test_timeout(self):
+        """The cache should be reloaded once it is older than the timeout."""
+        self.cache.get(1)
+        with self.settings(CODE_CACHE_TIMEOUT=-1):
+            with self.assertNumQueries(1):
+                self.cache.get(1)
@@ -1,9 +1,13 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
 
 import json
 import datetime
+import mock
 import pytz
 import decimal
 
@@ -11,12 +15,15 @@ from myvoice.core.tests import factories
 
 from myvoice.clinics import views as clinics
 from myvoice.clinics import models
+from myvoice.clinics.utils import clinics_by_code, services_by_code
 from myvoice.survey import models as survey_models
 
 
 class TestVisitView(TestCase):
 
     def setUp(self):
+        clinics_by_code.invalidate()
+        services_by_code.invalidate()
         self.factory = RequestFactory()
         self.clinic = factories.Clinic.create(code=1)
         self.service = factories.Service.create(code=5)
@@ -361,9 +368,110 @@ class TestVisitView(TestCase):
         self.assertEqual(1, models.Visit.objects.count())
 
 
+class TestBulkVisitView(TestCase):
+
+    class Rollback(Exception):
+        pass
+
+    def setUp(self):
+        clinics_by_code.invalidate()
+        services_by_code.invalidate()
+        self.factory = RequestFactory()
+        self.clinic = factories.Clinic.create(code=1)
+        self.service = factories.Service.create(code=5)
+        self.patient = factories.Patient.create(serial='1111', clinic=self.clinic)
+        self.messages = [
+            {'text': '1 08122233301 4001 5', 'phone': '+2348022112211'},
+            # Duplicate registration.
+            {'text': '1 08122233301 4001 5', 'phone': '+2348022112211'},
+            # Existing patient.
+            {'text': '1 08122233302 1111 5', 'phone': '+2348022112211'},
+            # Wrong clinic, which is accepted the third time.
+            {'text': '2 08122233303 4002 5', 'phone': '+2348022112212'},
+            {'text': '2 08122233303 4002 5', 'phone': '+2348022112212'},
+            {'text': '2 08122233303 4002 5', 'phone': '+2348022112212'},
+            # Wrong mobile.
+            {'text': '1 0812223330 4003 5', 'phone': '+2348022112213'},
+            # Missing parts.
+            {'text': '1 08122233304 5', 'phone': '+2348022112213'},
+        ]
+
+    def get_state(self):
+        """The registration state in the database, for comparison."""
+        visits = models.Visit.objects.values_list(
+            'patient__clinic', 'patient__serial', 'patient__mobile', 'service', 'mobile', 'sender')
+        return {
+            'visits': sorted(visits),
+            'errors': sorted(models.VisitRegistrationError.objects.values_list('sender')),
+            'error_logs': sorted(models.VisitRegistrationErrorLog.objects.values_list(
+                'sender', 'error_type', 'message')),
+            'blocked': sorted(models.BlockedSender.objects.values_list('sender')),
+        }
+
+    def make_request(self, messages):
+        request = self.factory.post('/clinics/visit/bulk/', data=json.dumps(messages),
+                                    content_type='application/json')
+        return clinics.BulkVisitView.as_view()(request)
+
+    def register_individually(self, messages):
+        """Replies and resulting state from registering each message on its own."""
+        replies = []
+        try:
+            with transaction.atomic():
+                for message in messages:
+                    request = self.factory.post('/clinics/visit/', data=message)
+                    response = clinics.VisitView.as_view()(request)
+                    replies.append(json.loads(response.content))
+                state = self.get_state()
+                raise self.Rollback()
+        except self.Rollback:
+            pass
+        return replies, state
+
+    def test_same_as_individual(self):
+        """Replies and saved data should match registering each message on its own."""
+        expected_replies, expected_state = self.register_individually(self.messages)
+        response = self.make_request(self.messages)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), expected_replies)
+        self.assertEqual(self.get_state(), expected_state)
+
+    def test_pending_errors(self):
+        """Errors saved by earlier requests should be taken into account."""
+        messages = self.messages[3:6]
+        self.make_request(messages[:1])
+        expected_replies, expected_state = self.register_individually(messages[1:])
+        response = self.make_request(messages[1:])
+        self.assertEqual(json.loads(response.content), expected_replies)
+        self.assertEqual(self.get_state(), expected_state)
+
+    def test_queries(self):
+        """The number of queries should not grow with the number of messages."""
+        def count_queries(messages):
+            with CaptureQueriesContext(connection) as queries:
+                self.make_request(messages)
+            return len(queries)
+
+        messages = [{'text': '1 0812223331{0} 500{0} 5'.format(i), 'phone': '+2348022112211'}
+                    for i in range(10)]
+        # Warm the clinic and service code cache.
+        self.make_request([{'text': '1 08122233320 6000 5', 'phone': '+2348022112211'}])
+        self.assertEqual(count_queries(messages[:2]), count_queries(messages[2:]))
+        self.assertEqual(models.Visit.objects.count(), 11)
+
+    def test_bad_request(self):
+        """Bodies which aren't a JSON list of messages should be rejected."""
+        request = self.factory.post('/clinics/visit/bulk/', data='nonsense',
+                                    content_type='application/json')
+        response = clinics.BulkVisitView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.make_request({'text': ''}).status_code, 400)
+
+
 class TestFeedbackView(TestCase):
 
     def setUp(self):
+        clinics_by_code.invalidate()
         self.factory = RequestFactory()
         self.clinic = factories.Clinic.create(code=1)
         self.phone = '+12065551212'
@@ -543,6 +651,40 @@ class TestReportMixin(TestCase):
                     timezone.datetime(2014, 9, 19, 23, 59, 59, 999999), timezone.utc)),
             week_ranges[2])
 
+    def test_get_report_weeks(self):
+        """The weeks since the first response in the LGA should be cached."""
+        cache.clear()
+        clinic = factories.Clinic.create()
+        visit = factories.Visit.create(
+            patient__clinic=clinic,
+            visit_time=timezone.make_aware(timezone.datetime(2014, 9, 3, 10), timezone.utc))
+        factories.SurveyQuestionResponse.create(question=self.q3, visit=visit, response='No')
+
+        mixin = clinics.ReportMixin()
+        min_date, weeks = mixin.get_report_weeks(clinic.lga)
+        monday = timezone.make_aware(timezone.datetime(2014, 9, 1), timezone.utc)
+        self.assertEqual(monday, min_date)
+        self.assertEqual((monday, monday + datetime.timedelta(6)), weeks[0])
+        self.assertEqual(weeks[0][1] + datetime.timedelta(1), weeks[1][0])
+        with self.assertNumQueries(1):
+            self.assertEqual((min_date, weeks), mixin.get_report_weeks(clinic.lga))
+        self.assertEqual((None, []), mixin.get_report_weeks(factories.LGA.create()))
+
+    def test_get_report_weeks_without_lga(self):
+        """The weeks of a clinic without an LGA should not be cached, since
+        nothing tracks changes to its data."""
+        cache.clear()
+        clinic = factories.Clinic.create(lga=None)
+        mixin = clinics.ReportMixin()
+        self.assertEqual((None, []), mixin.get_report_weeks(None, clinic))
+        visit = factories.Visit.create(
+            patient__clinic=clinic,
+            visit_time=timezone.make_aware(timezone.datetime(2014, 9, 3, 10), timezone.utc))
+        factories.SurveyQuestionResponse.create(question=self.q3, visit=visit, response='No')
+        min_date, weeks = mixin.get_report_weeks(None, clinic)
+        self.assertEqual(
+            timezone.make_aware(timezone.datetime(2014, 9, 1), timezone.utc), min_date)
+
     def test_get_survey_questions(self):
         """Test that get_survey_questions returns correct questions.
 
@@ -986,6 +1128,14 @@ class TestClinicReportView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(bool(response.render()))
 
+    def test_clinic_without_lga(self):
+        """The report of a clinic without an LGA should load."""
+        self.clinic.lga = None
+        self.clinic.save()
+        response = self.make_request()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(bool(response.render()))
+
     def test_get_detailed_comments(self):
         """Test that generic feedback is combined with open-ended survey responses."""
         visit1 = factories.Visit.create(
@@ -1073,9 +1223,188 @@ class TestClinicReportView(TestCase):
         self.assertEqual(comments[1]['response'], 'Hello2')
 
 
+@override_settings(PDF_REPORT_WORKERS=1)
+class TestLGAClinicsReport(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.lga = factories.LGA.create(name='Wamba')
+        self.clinics = [
+            factories.Clinic.create(lga=self.lga, name='Clinic One'),
+            factories.Clinic.create(lga=self.lga, name='Clinic Two'),
+        ]
+        self.survey = factories.Survey.create(role=survey_models.Survey.PATIENT_FEEDBACK)
+        self.question = factories.SurveyQuestion.create(
+            label='Open Facility',
+            survey=self.survey,
+            categories='Open\nClosed',
+            question_type=survey_models.SurveyQuestion.MULTIPLE_CHOICE)
+        factories.SurveyQuestion.create(
+            label='Wait Time',
+            survey=self.survey, categories='<1 hour\n1-2 hours\n2-4 hours\n>4 hours',
+            question_type=survey_models.SurveyQuestion.MULTIPLE_CHOICE)
+        for clinic in self.clinics:
+            factories.SurveyQuestionResponse.create(
+                question=self.question, response='Open',
+                visit=factories.Visit.create(
+                    patient__clinic=clinic, visit_time=timezone.now(),
+                    survey_sent=timezone.now()))
+
+    def make_request(self):
+        request = self.factory.get('/clinics/all-facilities/')
+        return clinics.LGAClinicsReport.as_view()(request, pk=self.lga.pk)
+
+    def test_pdf(self):
+        """The reports of every clinic should be rendered into one PDF."""
+        response = self.make_request()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/pdf', response['Content-Type'])
+        self.assertTrue(response.content.startswith('%PDF'))
+
+    def test_lga_data_shared(self):
+        """The LGA-wide statistics should only be gathered once."""
+        with mock.patch.object(
+                clinics.ClinicReport, 'get_lga_data', autospec=True,
+                side_effect=clinics.ClinicReport.get_lga_data) as get_lga_data:
+            self.make_request()
+        self.assertEqual(1, get_lga_data.call_count)
+
+    def test_response_statistics(self):
+        """Each clinic should be compared with the others from the shared data."""
+        report = clinics.ClinicReport(kwargs={'pk': self.clinics[0].pk})
+        report.object = report.get_object()
+        lga_data = report.get_lga_data(report.lga_clinics, report.questions)
+        self.assertEqual(
+            [(1, 100), (1, 100)],
+            [report.sum_response_counts(lga_data['response_counts'], [self.question], include)[0]
+             for include in (lambda pk: pk == self.clinics[0].pk,
+                             lambda pk: pk != self.clinics[0].pk)])
+
+
+class TestLGAClinicsReportWorkers(TransactionTestCase):
+    """The facilities gathered in threads should be laid out as if gathered
+    one by one. The threads use their own connections, so the test data
+    must be committed."""
+
+    def setUp(self):
+        self.lga = factories.LGA.create(name='Wamba')
+        survey = factories.Survey.create(role=survey_models.Survey.PATIENT_FEEDBACK)
+        question = factories.SurveyQuestion.create(
+            label='Open Facility', survey=survey, categories='Open\nClosed',
+            question_type=survey_models.SurveyQuestion.MULTIPLE_CHOICE)
+        factories.SurveyQuestion.create(
+            label='Wait Time',
+            survey=survey, categories='<1 hour\n1-2 hours\n2-4 hours\n>4 hours',
+            question_type=survey_models.SurveyQuestion.MULTIPLE_CHOICE)
+        for index in range(5):
+            clinic = factories.Clinic.create(lga=self.lga, name='Clinic {0}'.format(index))
+            for response in ['Open', 'Closed'][:index % 2 + 1]:
+                factories.SurveyQuestionResponse.create(
+                    question=question, response=response,
+                    visit=factories.Visit.create(
+                        patient__clinic=clinic, visit_time=timezone.now(),
+                        survey_sent=timezone.now()))
+
+    def render(self):
+        """Describe the flowables laid out in the PDF."""
+        report = clinics.LGAClinicsReport(kwargs={'pk': self.lga.pk})
+        with mock.patch.object(
+                clinics.pdf.ReportPdfRenderer, 'render_to_response',
+                autospec=True) as render_to_response:
+            report.render_facility_reports(None, None, None)
+        elements = render_to_response.call_args[0][1]
+        return [(type(element).__name__, getattr(element, 'title', None),
+                 getattr(element, 'text', None)) for element in elements]
+
+    def test_workers(self):
+        """Rendering with several workers should match rendering serially."""
+        with override_settings(PDF_REPORT_WORKERS=1):
+            serial = self.render()
+        with override_settings(PDF_REPORT_WORKERS=3):
+            parallel = self.render()
+        self.assertEqual(serial, parallel)
+        bookmarks = [title for kind, title, _ in parallel if kind == 'Bookmark']
+        self.assertEqual(['Clinic {0}'.format(index) for index in range(5)], bookmarks)
+
+
+@mock.patch.object(clinics.tasks.generate_report, 'delay')
+class TestReportJobView(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.lga = factories.LGA.create(name='Wamba')
+        self.clinic = factories.Clinic.create(lga=self.lga)
+
+    def submit(self, **data):
+        data.setdefault('lga', self.lga.pk)
+        request = self.factory.post('/reports/jobs/', data)
+        return json.loads(clinics.ReportJobView.as_view()(request).content)
+
+    def test_submit(self, delay):
+        """Submitting a report should queue a job for it."""
+        data = self.submit(start_date='2014-07-01', end_date='2014-07-31')
+        job = models.ReportJob.objects.get()
+        self.assertEqual(datetime.date(2014, 7, 1), job.start_date)
+        self.assertEqual(datetime.date(2014, 7, 31), job.end_date)
+        self.assertEqual((job.pk, 'pending'), (data['id'], data['status']))
+        self.assertNotIn('download_url', data)
+        delay.assert_called_once_with(job.pk)
+
+    def test_duplicate(self, delay):
+        """Identical reports should be served by the same job."""
+        first = self.submit(start_date='2014-07-01', end_date='2014-07-31')
+        second = self.submit(start_date='2014-07-01', end_date='2014-07-31')
+        self.assertEqual(first['id'], second['id'])
+        self.submit(start_date='2014-07-01', end_date='2014-07-30')
+        self.assertEqual(2, models.ReportJob.objects.count())
+        self.assertEqual(2, delay.call_count)
+
+    def test_data_changed(self, delay):
+        """A new job should be submitted once the LGA's data has changed."""
+        first = self.submit()
+        factories.Visit.create(patient__clinic=self.clinic)
+        second = self.submit()
+        self.assertNotEqual(first['id'], second['id'])
+
+    def test_failed(self, delay):
+        """Failed jobs should be submitted again."""
+        first = self.submit()
+        models.ReportJob.objects.update(status=models.ReportJob.FAILED)
+        second = self.submit()
+        self.assertNotEqual(first['id'], second['id'])
+
+    def test_invalid(self, delay):
+        """Unknown LGAs and invalid dates should be rejected."""
+        request = self.factory.post('/reports/jobs/', {'lga': 'x'})
+        self.assertEqual(400, clinics.ReportJobView.as_view()(request).status_code)
+        request = self.factory.post(
+            '/reports/jobs/', {'lga': self.lga.pk, 'start_date': 'x', 'end_date': 'y'})
+        self.assertEqual(400, clinics.ReportJobView.as_view()(request).status_code)
+        self.assertFalse(delay.called)
+
+    def test_status(self, delay):
+        """Finished jobs should link to the PDF."""
+        job = models.ReportJob.objects.create(lga=self.lga, status=models.ReportJob.DONE)
+        request = self.factory.get('/reports/jobs/{0}/'.format(job.pk))
+        response = clinics.ReportJobStatus.as_view()(request, pk=job.pk)
+        data = json.loads(response.content)
+        self.assertEqual('done', data['status'])
+        self.assertEqual('/reports/jobs/{0}/download/'.format(job.pk), data['download_url'])
+
+    def test_methods(self, delay):
+        """Jobs should only be submitted to the list, and read from the detail."""
+        job = models.ReportJob.objects.create(lga=self.lga)
+        request = self.factory.post('/reports/jobs/{0}/'.format(job.pk), {'lga': self.lga.pk})
+        self.assertEqual(405, clinics.ReportJobStatus.as_view()(request, pk=job.pk).status_code)
+        request = self.factory.get('/reports/jobs/')
+        self.assertEqual(405, clinics.ReportJobView.as_view()(request).status_code)
+        self.assertFalse(delay.called)
+
+
 class TestClinicReportFilterByWeek(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.factory = RequestFactory()
         self.survey = factories.Survey.create(role=survey_models.Survey.PATIENT_FEEDBACK)
         self.clinic = factories.Clinic.create(code=1)
@@ -1120,6 +1449,51 @@ class TestClinicReportFilterByWeek(TestCase):
         response = self.make_request(data)
         self.assertEqual(response.status_code, 200)
 
+    def test_cached(self):
+        """Reports should be cached until the data about the LGA changes."""
+        data = {
+            'start_date': 'August 01, 2014',
+            'end_date': 'August 08, 2014',
+            'clinic_id': self.clinic.id}
+        first = json.loads(self.make_request(data).content)
+        self.assertEqual(0, first['num_registered'])
+        with self.assertNumQueries(2):
+            self.assertEqual(first, json.loads(self.make_request(data).content))
+        factories.Visit.create(
+            patient=self.patient, survey_sent=timezone.now(),
+            visit_time=timezone.make_aware(timezone.datetime(2014, 8, 4), timezone.utc))
+        self.assertEqual(1, json.loads(self.make_request(data).content)['num_registered'])
+
+    def test_not_cached_without_lga(self):
+        """Reports of a clinic without an LGA should not be cached, since
+        nothing tracks changes to its data."""
+        self.clinic.lga = None
+        self.clinic.save()
+        data = {
+            'start_date': 'August 01, 2014',
+            'end_date': 'August 08, 2014',
+            'clinic_id': self.clinic.id}
+        self.assertEqual(0, json.loads(self.make_request(data).content)['num_registered'])
+        factories.Visit.create(
+            patient=self.patient, survey_sent=timezone.now(),
+            visit_time=timezone.make_aware(timezone.datetime(2014, 8, 4), timezone.utc))
+        self.assertEqual(1, json.loads(self.make_request(data).content)['num_registered'])
+
+    def test_week_boundary(self):
+        """Visits on the Monday after the week should not be counted."""
+        data = {
+            'start_date': 'July 28, 2014',
+            'end_date': 'August 03, 2014',
+            'clinic_id': self.clinic.id}
+        factories.Visit.create(
+            patient=self.patient, survey_sent=timezone.now(),
+            visit_time=timezone.make_aware(timezone.datetime(2014, 8, 4, 9), timezone.utc))
+        self.assertEqual(0, json.loads(self.make_request(data).content)['num_registered'])
+        factories.Visit.create(
+            patient=self.patient, survey_sent=timezone.now(),
+            visit_time=timezone.make_aware(timezone.datetime(2014, 8, 3, 21), timezone.utc))
+        self.assertEqual(1, json.loads(self.make_request(data).content)['num_registered'])
+
 
 class TestParticipationAnalysisView(TestCase):
 
@@ -1525,6 +1899,21 @@ class TestLGAReportView(TestCase):
         request = self.factory.get(url, data=data)
         return clinics.LGAReport.as_view()(request, pk=1)
 
+    def test_exclusive_end(self):
+        """Responses about visits at midnight at the end of the range should
+        not be included."""
+        end_date = timezone.make_aware(timezone.datetime(2014, 8, 4), timezone.utc)
+        self.v1.visit_time = end_date
+        self.v1.save()
+        self.v2.visit_time = end_date - datetime.timedelta(hours=1)
+        self.v2.save()
+        report = clinics.LGAReport(
+            kwargs={'pk': self.lga.pk}, start_date=end_date - datetime.timedelta(7),
+            end_date=end_date)
+        report.get_object()
+        self.assertEqual(
+            set([self.v2.pk]), set(report.responses.values_list('visit', flat=True)))
+
     def test_lga_report_page_loads(self):
         """Smoke test to make sure page loads and returns some context."""
         response = self.make_request()
@@ -1713,6 +2102,39 @@ class TestLGAReportView(TestCase):
         self.assertEqual(('Clean Hospital Materials', 50, 1), indices[2])
         self.assertEqual(('Charged Fairly', 0, 0), indices[3])
 
+    def test_get_indices_by_clinic(self):
+        """Test that indices for every clinic are counted in one query."""
+        clinic = factories.Clinic.create(lga=self.lga)
+        visit = factories.Visit.create(
+            service=self.service,
+            visit_time=timezone.now(),
+            survey_sent=timezone.now(),
+            patient=factories.Patient.create(clinic=clinic, serial=331))
+        factories.SurveyQuestionResponse.create(
+            question=self.clean,
+            datetime=timezone.now(),
+            visit=self.v1,
+            clinic=self.clinic, response='Clean')
+        factories.SurveyQuestionResponse.create(
+            question=self.clean,
+            datetime=timezone.now(),
+            visit=visit,
+            clinic=clinic, response='Not Clean')
+
+        report = clinics.LGAReport(kwargs={'pk': self.lga.pk})
+        report.get_object()
+        responses = survey_models.SurveyQuestionResponse.objects.all()
+        target_questions = survey_models.SurveyQuestion.objects.filter(
+            pk__in=[self.clean.id, self.fair.id])
+        with self.assertNumQueries(2):
+            indices = report.get_indices_by(target_questions, responses, 'clinic')
+            first = list(indices(self.clinic.pk))
+            second = list(indices(clinic.pk))
+        self.assertEqual(
+            [('Clean Hospital Materials', 100, 1), ('Charged Fairly', 0, 0)], first)
+        self.assertEqual(
+            [('Clean Hospital Materials', 0, 0), ('Charged Fairly', 0, 0)], second)
+
     def test_get_wait_time_mode(self):
         """Get the most frequent wait time."""
         v3 = factories.Visit.create(
@@ -1739,6 +2161,44 @@ class TestLGAReportView(TestCase):
         self.assertEqual('<1 hour', mode)
         self.assertEqual(2, mode_len)
 
+    def test_get_wait_time_distribution(self):
+        """Get the number of wait time responses in each category."""
+        factories.SurveyQuestionResponse.create(
+            question=self.wait,
+            datetime=timezone.now(),
+            visit=self.v1,
+            clinic=self.clinic, response='2-3 hours')
+        report = clinics.LGAReport(kwargs={'pk': self.lga.pk})
+        report.get_object()
+        responses = survey_models.SurveyQuestionResponse.objects.all()
+        distribution = report.get_wait_distribution(responses)
+        self.assertEqual(
+            [('<1 hour', 1), ('1-2 hours', 0), ('2-3 hours', 1), ('4+ hours', 0)],
+            distribution)
+
+    def test_get_wait_modes_by_clinic(self):
+        """Get the wait time mode of every clinic in one query."""
+        clinic = factories.Clinic.create(lga=self.lga)
+        visit = factories.Visit.create(
+            service=self.service,
+            visit_time=timezone.now(),
+            survey_sent=timezone.now(),
+            patient=factories.Patient.create(clinic=clinic, serial=331))
+        factories.SurveyQuestionResponse.create(
+            question=self.wait,
+            datetime=timezone.now(),
+            visit=visit,
+            clinic=clinic, response='4+ hours')
+        report = clinics.LGAReport(kwargs={'pk': self.lga.pk})
+        report.get_object()
+        report.get_wait_categories()
+        responses = survey_models.SurveyQuestionResponse.objects.all()
+        with self.assertNumQueries(1):
+            wait_modes = report.get_wait_modes_by(responses, 'clinic')
+        self.assertEqual(('<1 hour', 1), wait_modes(self.clinic.pk))
+        self.assertEqual(('4+ hours', 1), wait_modes(clinic.pk))
+        self.assertEqual((None, 0), wait_modes(0))
+
     def test_get_clinic_score(self):
         """Test that we can get quality and quantity scores."""
         factories.ClinicScore.create(
@@ -1882,6 +2342,7 @@ class TestLGAReportView(TestCase):
 class TestLGAReportAjax(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.factory = RequestFactory()
         self.survey = factories.Survey.create(role=survey_models.Survey.PATIENT_FEEDBACK)
         self.lga = factories.LGA.create(name='test_lga')
@@ -1972,6 +2433,21 @@ class TestLGAReportAjax(TestCase):
         response = self.make_request(data)
         self.assertEqual(200, response.status_code)
 
+    def test_cached(self):
+        """Reports should be cached until the data about the LGA changes."""
+        data = {
+            'start_date': 'August 01, 2014',
+            'end_date': 'August 08, 2014',
+            'lga': self.lga.pk
+        }
+        first = self.make_request(data).content
+        with self.assertNumQueries(2):
+            self.assertEqual(first, self.make_request(data).content)
+        factories.GenericFeedback.create(clinic=self.clinic1)
+        with CaptureQueriesContext(connection) as queries:
+            self.make_request(data)
+        self.assertTrue(len(queries) > 2)
+
     def test_incomplete_params(self):
         data = {}
         response = self.make_request(data)
@@ -1992,7 +2468,7 @@ class TestLGAReportAjax(TestCase):
         report = clinics.LGAReportAjax()
         data = report.get_data(start_date, end_date, self.lga)
 
-        self.assertEqual(7, len(data))
+        self.assertEqual(8, len(data))
         self.assertTrue('facilities_html' in data)
         self.assertTrue('services_html' in data)
         self.assertTrue('feedback_stats' in data)
@@ -2000,6 +2476,7 @@ class TestLGAReportAjax(TestCase):
         self.assertTrue('response_stats' in data)
         self.assertTrue('question_labels' in data)
         self.assertTrue('max_chart_value' in data)
+        self.assertTrue('wait_time_distribution' in data)
 
     def _test_get_feedback_data(self):
         start_date = timezone.make_aware(timezone.datetime(2014, 8, 1), timezone.utc)
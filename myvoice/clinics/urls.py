@@ -10,6 +10,15 @@ urlpatterns = [
     url(r'^reports/region/(?P<pk>\d+)/pdf/$',
         login_required(views.LGAClinicsReport.as_view()),
         name='all_facilities_pdf'),
+    url(r'^reports/jobs/$',
+        login_required(views.ReportJobView.as_view()),
+        name='report_jobs'),
+    url(r'^reports/jobs/(?P<pk>\d+)/$',
+        login_required(views.ReportJobStatus.as_view()),
+        name='report_job'),
+    url(r'^reports/jobs/(?P<pk>\d+)/download/$',
+        login_required(views.ReportJobDownload.as_view()),
+        name='report_job_download'),
     url(r'^reports/region/(?P<pk>\d+)/$',
         login_required(views.LGAReport.as_view()),
         name='region_report'),
@@ -35,6 +44,7 @@ urlpatterns = [
     url(r'^report_filter_feedback_by_week/$',
         views.ClinicReportFilterByWeek.as_view(), name='report_filter'),
     url(r'^visit/$', views.VisitView.as_view(), name='visit'),
+    url(r'^visit/bulk/$', views.BulkVisitView.as_view(), name='bulk_visit'),
     url(r'^feedback/$', views.FeedbackView.as_view(), name='visit'),
     url(r'^lga_async/$', views.LGAReportAjax.as_view(), name='async_lga'),
 ]
@@ -1,4 +1,9 @@
-from myvoice.clinics.models import Visit
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+from myvoice.clinics.models import Clinic, Service, Visit
 from itertools import groupby
 
 
@@ -28,3 +33,49 @@ def get_triggered_count(a_clinic="", service="", start_date="", end_date=""):
     if service:
         st_query = st_query.filter(service__name=service)
     return st_query.count()
+
+
+class CodeCache(object):
+    """
+    In-process map of code to object for a reference table, such as Clinic,
+    whose objects are looked up by code for every incoming SMS.
+
+    The map is loaded with a single query and reloaded after
+    settings.CODE_CACHE_TIMEOUT seconds, or as soon as an object in the
+    table is saved or deleted in this process. Objects added by another
+    process are only found once the map is reloaded, so unknown codes, which
+    come with every mistyped SMS, do not each cost a query.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.objects = None
+        self.loaded = None
+        post_save.connect(self.invalidate, sender=model, weak=False)
+        post_delete.connect(self.invalidate, sender=model, weak=False)
+
+    def invalidate(self, **kwargs):
+        self.objects = None
+
+    def load(self):
+        self.objects = dict((obj.code, obj) for obj in self.model.objects.all())
+        self.loaded = time.time()
+
+    def get(self, code):
+        """
+        Returns the object with the given code. As with objects.get(code=code),
+        raises ValueError if the code is not a number and DoesNotExist if no
+        object has the code.
+        """
+        code = int(code)
+        if self.objects is None or time.time() - self.loaded > settings.CODE_CACHE_TIMEOUT:
+            self.load()
+        try:
+            return self.objects[code]
+        except KeyError:
+            raise self.model.DoesNotExist(
+                "{0} with code {1} does not exist.".format(self.model.__name__, code))
+
+
+clinics_by_code = CodeCache(Clinic)
+services_by_code = CodeCache(Service)
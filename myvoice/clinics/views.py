@@ -1,28 +1,40 @@
+import hashlib
 import json
 from dateutil.parser import parse
 import logging
-from datetime import timedelta
-from collections import Counter
-
-from django.http import HttpResponse, HttpResponseBadRequest
-from django.shortcuts import redirect
+import os
+from datetime import datetime, time, timedelta
+from collections import Counter, defaultdict
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import DetailView, View, FormView, TemplateView
 from django.utils import timezone
-from django.db.models.aggregates import Min, Sum
+from django.db.models.aggregates import Count, Min, Sum
 from django.template.loader import get_template
 from django.template import Context
 from django.core.serializers.json import DjangoJSONEncoder
 
+from myvoice.core.aggregates import CountIf
+from myvoice.core.instrumentation import instrument
 from myvoice.core.utils import get_week_start, get_week_end, make_percentage
 from myvoice.core.utils import get_date, hour_to_hr, compress_list
 from myvoice.survey import utils as survey_utils
 from myvoice.survey.models import Survey, SurveyQuestion, SurveyQuestionResponse
 from myvoice.clinics.models import Clinic, Service, GenericFeedback
+from myvoice.statistics.models import DailyStatistic, DataVersion
 
 from . import forms
 from . import models
 from . import pdf
+from . import registration
+from . import tasks
 
 
 logger = logging.getLogger(__name__)
@@ -35,44 +47,40 @@ class VisitView(View):
         return super(VisitView, self).dispatch(*args, **kwargs)
 
     def post(self, request):
-        success_msg = "Entry received for patient with serial number {}. Thank you."
         logger.debug("post data is %s" % request.POST)
-        form = forms.VisitForm(request.POST)
-        if form.is_valid():
-
-            clnc, mobile, serial, serv, txt = form.cleaned_data['text']
-            logger.debug("visit form text is {}".format(txt))
-
-            sender = survey_utils.convert_to_local_format(form.cleaned_data['phone'])
-            if not sender:
-                sender = form.cleaned_data['phone']
-            try:
-                patient = models.Patient.objects.get(clinic=clnc, serial=serial)
-            except models.Patient.DoesNotExist:
-                patient = models.Patient.objects.create(
-                    clinic=clnc,
-                    serial=serial,
-                    mobile=mobile)
-
-            output_msg = success_msg.format(serial)
-            logger.debug("Output message for serial {0} is {1}".format(serial, output_msg))
-
-            models.Visit.objects.create(patient=patient, service=serv, mobile=mobile, sender=sender)
-            data = json.dumps({'text': output_msg})
-        else:
-            data = json.dumps({'text': self.get_error_msg(form)})
-
+        data = json.dumps({'text': registration.register_visit(request.POST)})
         response = HttpResponse(data, content_type='text/json')
 
         # This is to test webhooks from localhost
         # response['Access-Control-Allow-Origin'] = '*'
         return response
 
-    def get_error_msg(self, form):
-        """Extract the first error message from the form's 'text' field."""
-        msgs = ", ".join(form.errors['text'])
-        logger.debug("visit form error messages are {}".format(msgs))
-        return form.errors['text'][0]
+
+class BulkVisitView(View):
+    """
+    Registers a batch of visit SMSes, such as those replayed after an outage.
+
+    The request body is a JSON list of objects with 'phone' and 'text' keys,
+    and the response is a list of the replies to each, in the same form as
+    the replies from VisitView.
+    """
+
+    @csrf_exempt
+    def dispatch(self, *args, **kwargs):
+        return super(BulkVisitView, self).dispatch(*args, **kwargs)
+
+    def post(self, request):
+        try:
+            messages = json.loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest('Request body must be JSON.')
+        if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+            return HttpResponseBadRequest('Request body must be a list of messages.')
+
+        logger.debug("Registering {} visits in bulk.".format(len(messages)))
+        replies = registration.register_visits(messages)
+        data = json.dumps([{'text': reply} for reply in replies])
+        return HttpResponse(data, content_type='text/json')
 
 
 class ClinicReportSelectClinic(FormView):
@@ -84,8 +92,37 @@ class ClinicReportSelectClinic(FormView):
         return redirect('clinic_report', slug=clinic.slug)
 
 
+def get_cached_report(name, lga_id, params, compute):
+    """
+    Return the JSON of the report data returned by compute(), from the cache
+    if it has already been computed for the same params since the data
+    about the LGA's clinics last changed.
+
+    Nothing tracks changes to the data of clinics without an LGA, so their
+    reports (with no lga_id) are always computed.
+    """
+    if lga_id is None:
+        return json.dumps(compute(), cls=DjangoJSONEncoder)
+    version = DataVersion.objects.get_version(lga_id)
+    digest = hashlib.md5(repr(params)).hexdigest()
+    key = 'report-{0}-{1}-{2}-{3}'.format(name, lga_id, version, digest)
+    data = cache.get(key)
+    if data is None:
+        data = json.dumps(compute(), cls=DjangoJSONEncoder)
+        cache.set(key, data, settings.REPORT_CACHE_TIMEOUT)
+    return data
+
+
 class ReportMixin(object):
 
+    # Counts of visits which have reached each stage of the feedback survey,
+    # summed from the daily statistics.
+    PARTICIPATION_COUNTS = {
+        'sent': Sum('sent'),
+        'started': Sum('started'),
+        'completed': Sum('completed'),
+    }
+
     def start_day(self, dt):
         """Change time to midnight."""
         return dt.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -122,6 +159,43 @@ class ReportMixin(object):
 
             start_date = week_end + timezone.timedelta(microseconds=1)
 
+    @instrument()
+    def get_report_weeks(self, lga, clinic=None):
+        """
+        Get the start of the first week with responses from the clinics in
+        the LGA, or from the given clinic, and the weeks from then until now
+        as a list of (start, end) pairs for the week filter.
+
+        The first day is taken from the daily statistics, and the result is
+        cached until the LGA's data changes or the day ends. Nothing tracks
+        changes to the data of a clinic without an LGA, so its weeks are not
+        cached.
+        """
+        if lga is None:
+            return self._get_report_weeks(lga, clinic)
+        key = 'report-weeks-{0}-{1}-{2}-{3}'.format(
+            lga.pk, clinic.pk if clinic else '', DataVersion.objects.get_version(lga),
+            timezone.now().date())
+        weeks = cache.get(key)
+        if weeks is None:
+            weeks = self._get_report_weeks(lga, clinic)
+            cache.set(key, weeks, settings.REPORT_CACHE_TIMEOUT)
+        return weeks
+
+    def _get_report_weeks(self, lga, clinic=None):
+        if clinic:
+            stats = DailyStatistic.objects.for_responses(clinic=clinic)
+        else:
+            stats = DailyStatistic.objects.for_responses(clinic__lga=lga)
+        first = stats.aggregate(first=Min('date'))['first']
+        if first is None:
+            return (None, [])
+        min_date = get_week_start(get_date(datetime.combine(first, time())))
+        return (min_date, [
+            (self.start_day(start), self.start_day(end)) for start, end in
+            self.get_week_ranges(min_date, timezone.now())])
+
+    @instrument()
     def get_survey_questions(self, start_date=None, end_date=None):
         if not start_date:
             start_date = get_week_start(timezone.now())
@@ -145,24 +219,99 @@ class ReportMixin(object):
         self.survey = Survey.objects.get(role=Survey.PATIENT_FEEDBACK)
         self.questions = self.get_survey_questions()
 
+    def get_wait_categories(self):
+        """The answers to the wait time question, looked up once per report."""
+        if not hasattr(self, '_wait_categories'):
+            self._wait_categories = SurveyQuestion.objects.get(
+                label='Wait Time').get_categories()
+        return self._wait_categories
+
+    @instrument()
+    def get_wait_distribution(self, responses, field=None):
+        """Count the responses to the wait time question for each category.
+
+        Returns a list of (category, count) in the order of the question's
+        categories, or a dict of such lists keyed by the value of field if
+        field is given. The counts are made in one query."""
+        categories = self.get_wait_categories()
+        fields = [field, 'response'] if field else ['response']
+        counts = responses.filter(
+            question__label='Wait Time', response__in=categories).order_by().values(
+            *fields).annotate(count=Count('id'))
+        by_group = defaultdict(dict)
+        for row in counts:
+            by_group[row[field] if field else None][row['response']] = row['count']
+        distributions = dict(
+            (group, [(category, group_counts.get(category, 0)) for category in categories])
+            for group, group_counts in by_group.items())
+        if field:
+            return distributions
+        return distributions.get(None, [(category, 0) for category in categories])
+
+    @instrument()
     def get_wait_mode(self, responses):
         """Get most frequent wait time and the count for that wait time."""
-        responses = responses.filter(
-            question__label='Wait Time').values_list('response', flat=True)
-        categories = SurveyQuestion.objects.get(label='Wait Time').get_categories()
-        mode = survey_utils.get_mode(responses, categories)
-        len_mode = len([i for i in responses if i == mode])
+        return self._get_mode(self.get_wait_distribution(responses))
+
+    @instrument()
+    def get_wait_modes_by(self, responses, field):
+        """Get the wait time mode for the responses grouped by the value of
+        field. Returns a function of the field value which returns what
+        get_wait_mode would for that group's responses."""
+        distributions = self.get_wait_distribution(responses, field)
+
+        def wait_mode(value):
+            return self._get_mode(distributions.get(value, []))
+        return wait_mode
+
+    def _get_mode(self, distribution):
+        mode, len_mode = None, 0
+        for category, count in distribution:
+            if count > len_mode:
+                mode, len_mode = category, count
         return mode, len_mode
 
+    @instrument()
+    def count_positive(self, target_questions, responses, field=None):
+        """Count the positive and total responses to each question in one query.
+
+        Returns a dict of (positive, total) keyed by question id, or by
+        (value of field, question id) if field is given."""
+        fields = [field, 'question'] if field else ['question']
+        counts = responses.filter(question__in=target_questions).order_by().values(
+            *fields).annotate(
+            total=Count('id'), positive=CountIf('positive_response', condition='= TRUE'))
+        return dict(
+            ((row[field], row['question']) if field else row['question'],
+             (row['positive'], row['total']))
+            for row in counts)
+
     def get_indices(self, target_questions, responses):
         """Get % and count of positive responses per question."""
+        counts = self.count_positive(target_questions, responses)
+        return self._make_indices(target_questions, counts)
+
+    def get_indices_by(self, target_questions, responses, field):
+        """Get the indices for the responses grouped by the value of field,
+        e.g. 'clinic' or 'service'. Returns a function of the field value
+        which yields what get_indices would for that group's responses."""
+        counts = self.count_positive(target_questions, responses, field)
+        target_questions = list(target_questions)
+
+        def indices(value):
+            value_counts = dict(
+                (question.pk, counts[(value, question.pk)])
+                for question in target_questions if (value, question.pk) in counts)
+            return self._make_indices(target_questions, value_counts)
+        return indices
+
+    def _make_indices(self, target_questions, counts):
         for question in target_questions:
-            question_responses = [r for r in responses if r.question_id == question.pk]
-            total_resp = len(question_responses)
-            positive = len([r for r in question_responses if r.positive_response])
+            positive, total_resp = counts.get(question.pk, (0, 0))
             perc = make_percentage(positive, total_resp) if total_resp else 0
             yield (question.question_label, perc, positive)
 
+    @instrument()
     def get_satisfaction_counts(self, responses):
         """Return satisfaction percentage and total of survey participants."""
         responses = responses.filter(question__for_satisfaction=True)
@@ -174,6 +323,7 @@ class ReportMixin(object):
 
         return 100 - make_percentage(unsatisfied, total), total-unsatisfied
 
+    @instrument()
     def get_feedback_participation(self, visits):
         """Return % of surveys responded to total visits."""
         survey_started = visits.filter(survey_started=True).count()
@@ -185,42 +335,66 @@ class ReportMixin(object):
             survey_percent = None
         return survey_percent, survey_started
 
+    @instrument()
     def get_feedback_statistics(self, clinics, **kwargs):
         """Return dict of surveys_sent, surveys_started and surveys_completed.
 
         kwargs are service, start_date, end_date."""
-        visits = models.Visit.objects.filter(patient__clinic__in=clinics)
         if kwargs.get('start_date') and kwargs.get('end_date'):
-            end_date = kwargs['end_date'] + timedelta(1)
-            visits = visits.filter(
-                visit_time__gte=kwargs['start_date'],
-                visit_time__lt=end_date)
+            stats = DailyStatistic.objects.for_visits(
+                kwargs['start_date'], kwargs['end_date'], clinic__in=clinics)
+        else:
+            stats = DailyStatistic.objects.for_visits(clinic__in=clinics)
         if 'service' in kwargs:
-            visits = visits.filter(service=kwargs['service'])
-
-        sent = list(visits.filter(survey_sent__isnull=False).values_list(
-            'patient__clinic', flat=True))
-        started = list(visits.filter(survey_started=True).values_list(
-            'patient__clinic', flat=True))
-        completed = list(visits.filter(survey_completed=True).values_list(
-            'patient__clinic', flat=True))
-
-        _sent = [sent.count(clinic.pk) for clinic in clinics]
-        _started = [started.count(clinic.pk) for clinic in clinics]
-        _completed = [completed.count(clinic.pk) for clinic in clinics]
-        return {
-            'sent': _sent,
-            'started': _started,
-            'completed': _completed,
-            }
+            stats = stats.filter(service=kwargs['service'])
+
+        counts = stats.order_by().values('clinic').annotate(**self.PARTICIPATION_COUNTS)
+        counts = dict((row['clinic'], row) for row in counts)
+        empty = dict((key, 0) for key in self.PARTICIPATION_COUNTS)
+
+        return dict(
+            (key, [counts.get(clinic.pk, empty)[key] for clinic in clinics])
+            for key in self.PARTICIPATION_COUNTS)
 
+    @instrument()
+    def get_response_counts(self, clinics, questions, start_date=None, end_date=None):
+        """Get the +ve and total responses to questions in clinics, as a dict
+        of (positive, total) keyed by (clinic id, question id)."""
+        if start_date and end_date:
+            stats = DailyStatistic.objects.for_responses(
+                start_date, end_date, clinic__in=clinics, question__in=questions)
+        else:
+            stats = DailyStatistic.objects.for_responses(
+                clinic__in=clinics, question__in=questions)
+        counts = stats.order_by().values('clinic', 'question').annotate(
+            total=Sum('total'), positive=Sum('positive'))
+        return dict(
+            ((row['clinic'], row['question']), (row['positive'], row['total']))
+            for row in counts)
+
+    def sum_response_counts(self, counts, questions, include=None):
+        """Get total and %ge of +ve responses to questions from the counts
+        returned by get_response_counts, for the clinic ids for which
+        include returns True, or all clinics."""
+        positives, totals = defaultdict(int), defaultdict(int)
+        for (clinic_id, question_id), (positive, total) in counts.items():
+            if include is None or include(clinic_id):
+                positives[question_id] += positive
+                totals[question_id] += total
+
+        data = []
+        for question in questions:
+            total, positive = totals[question.pk], positives[question.pk]
+            data.append((positive, make_percentage(positive, total) if total else 0))
+        return data
+
+    @instrument()
     def get_response_statistics(self, clinics, questions, start_date=None, end_date=None):
         """Get total and %ge of +ve responses to questions in clinics."""
-        responses = SurveyQuestionResponse.objects.filter(clinic__in=clinics)
-        if start_date and end_date:
-            responses = responses.filter(visit__visit_time__range=(start_date, end_date))
-        return [(i[2], i[1]) for i in self.get_indices(questions, responses)]
+        counts = self.get_response_counts(clinics, questions, start_date, end_date)
+        return self.sum_response_counts(counts, questions)
 
+    @instrument()
     def get_feedback_by_service(self):
         """Return analyzed feedback by service then question."""
         data = []
@@ -229,16 +403,17 @@ class ReportMixin(object):
         target_questions = self.questions.exclude(label='Wait Time')
 
         services = models.Service.objects.all()
+        service_indices = self.get_indices_by(target_questions, responses, 'service')
+        service_wait_modes = self.get_wait_modes_by(responses, 'service')
         for service in services:
             service_data = []
-            service_responses = responses.filter(service=service)
-            for label, perc, val in self.get_indices(target_questions, service_responses):
+            for label, perc, val in service_indices(service.pk):
                 if perc or perc == 0:
                     perc = '{}%'.format(perc)
                 service_data.append((label, val, perc))
 
             # Wait Time
-            mode, mode_len = self.get_wait_mode(service_responses)
+            mode, mode_len = service_wait_modes(service.pk)
             if mode:
                 mode = hour_to_hr(mode)
             service_data.append(('Wait Time', mode, mode_len))
@@ -246,25 +421,30 @@ class ReportMixin(object):
             data.append((service, service_data))
         return data
 
+    @instrument()
     def get_feedback_by_clinic(self, clinics, start_date=None, end_date=None):
         """Return analyzed feedback by clinic then question."""
         data = []
 
         responses = self.responses.filter(question__in=self.questions)
-        visits = models.Visit.objects.filter(
-            survey_sent__isnull=False, patient__clinic__in=clinics)
-
         if start_date and end_date:
-            responses = responses.filter(
-                visit__visit_time__range=(start_date, end_date))
-            visits = visits.filter(visit_time__range=(start_date, end_date))
+            responses = responses.filter(visit_time__gte=start_date, visit_time__lt=end_date)
+            stats = DailyStatistic.objects.for_visits(start_date, end_date, clinic__in=clinics)
+        else:
+            stats = DailyStatistic.objects.for_visits(clinic__in=clinics)
+        participation = stats.order_by().values('clinic').annotate(**self.PARTICIPATION_COUNTS)
+        participation = dict((row['clinic'], row) for row in participation)
+        target_questions = self.questions.exclude(label='Wait Time')
+        clinic_indices = self.get_indices_by(target_questions, responses, 'clinic')
+        clinic_wait_modes = self.get_wait_modes_by(responses, 'clinic')
 
         for clinic in clinics:
             clinic_data = []
-            clinic_responses = responses.filter(clinic=clinic)
-            clinic_visits = visits.filter(patient__clinic=clinic)
             # Get feedback participation
-            part_percent, part_total = self.get_feedback_participation(clinic_visits)
+            part_total, part_percent = 0, None
+            if participation.get(clinic.pk, {}).get('sent'):
+                part_total = participation[clinic.pk]['started']
+                part_percent = make_percentage(part_total, participation[clinic.pk]['sent'])
             if part_percent is not None:
                 part_percent = '{}%'.format(part_percent)
             clinic_data.append(
@@ -281,14 +461,13 @@ class ReportMixin(object):
                 clinic_data.append(("Quantity", "{}".format(score.quantity), ""))
 
             # Indices for each question
-            target_questions = self.questions.exclude(label='Wait Time')
-            for label, perc, val in self.get_indices(target_questions, clinic_responses):
+            for label, perc, val in clinic_indices(clinic.pk):
                 if perc or perc == 0:
                     perc = '{}%'.format(perc)
                 clinic_data.append((label, val, perc))
 
             # Wait Time
-            mode, mode_len = self.get_wait_mode(clinic_responses)
+            mode, mode_len = clinic_wait_modes(clinic.pk)
             if mode:
                 mode = hour_to_hr(mode)
             clinic_data.append(('Wait Time', mode, mode_len))
@@ -297,6 +476,7 @@ class ReportMixin(object):
 
         return data
 
+    @instrument()
     def get_clinic_score(self, clinic, ref_date=None):
         """Return quality and quantity scores for the clinic and quarter in which
         ref_date is in."""
@@ -310,6 +490,7 @@ class ReportMixin(object):
         else:
             return score
 
+    @instrument()
     def get_main_comments(self, clinics):
         """Get generic comments marked to show on summary pages."""
         comments = [
@@ -330,6 +511,7 @@ class ReportMixin(object):
         """Replaces space with newline."""
         return ['\n'.join(str(x).split()) for x in labels]
 
+    @instrument()
     def get_manual_registrations(self, clinics, **kwargs):
         """Get the total of manual registrations by clinics between date range."""
         manual_regs = models.ManualRegistration.objects.filter(clinic__in=clinics)
@@ -351,6 +533,9 @@ class ClinicReport(ReportMixin, DetailView):
         super(ClinicReport, self).__init__(*args, **kwargs)
         self.start_date = None
         self.end_date = None
+        # Statistics about all the clinics in the LGA, from get_lga_data,
+        # which may be shared by the reports of every clinic in the LGA.
+        self.lga_data = None
 
     def get_object(self, queryset=None):
         obj = super(ClinicReport, self).get_object(queryset)
@@ -358,7 +543,7 @@ class ClinicReport(ReportMixin, DetailView):
         self.visits = models.Visit.objects.filter(patient__clinic=obj, survey_sent__isnull=False)
         if self.start_date and self.end_date:
             self.responses = self.responses.filter(
-                datetime__gte=self.start_date, datetime__lte=self.end_date)
+                visit_time__gte=self.start_date, visit_time__lt=self.end_date)
             self.visits = self.visits.filter(
                 visit_time__gte=self.start_date, visit_time__lt=self.end_date)
         self.responses = self.responses.select_related('question', 'service', 'visit')
@@ -368,6 +553,7 @@ class ClinicReport(ReportMixin, DetailView):
         self.lga_clinics = self.model.objects.filter(lga=obj.lga)
         return obj
 
+    @instrument()
     def get_detailed_comments(self, start_date=None, end_date=None):
         """Combine open-ended survey comments with General Feedback."""
         open_ended_responses = self.responses.filter(
@@ -399,40 +585,48 @@ class ClinicReport(ReportMixin, DetailView):
 
         return sorted(comments, key=lambda item: (item['question'], item['datetime']))
 
+    @instrument('ClinicReport.get_context_data')
     def get_context_data(self, **kwargs):
         kwargs['responses'] = self.responses
         kwargs['detailed_comments'] = self.get_detailed_comments()
         kwargs['feedback_by_service'] = self.get_feedback_by_service()
         kwargs['question_labels'] = [q.question_label for q in self.questions]
 
-        if not (self.start_date and self.end_date) and self.responses:
-            min_date = self.responses.aggregate(Min('datetime'))['datetime__min']
-            kwargs['min_date'] = get_week_start(min_date)
+        min_date, kwargs['week_ranges'] = self.get_report_weeks(self.object.lga, self.object)
+        if not (self.start_date and self.end_date) and min_date:
+            kwargs['min_date'] = min_date
             kwargs['max_date'] = timezone.now()
         else:
             kwargs['min_date'] = self.start_date
             kwargs['max_date'] = (self.end_date - timedelta(1)) if self.end_date else None
 
+        lga_data = self.lga_data or self.get_lga_data(
+            self.lga_clinics, self.questions, self.start_date, self.end_date)
+
         # Feedback stats for chart
-        feedback_stats = self.get_feedback_statistics(
-            self.lga_clinics, start_date=self.start_date, end_date=self.end_date)
-        kwargs['feedback_stats'] = feedback_stats
-        kwargs['max_chart_value'] = max(feedback_stats['sent'])
-        kwargs['feedback_clinics'] = self.format_chart_labels(self.lga_clinics)
+        kwargs['feedback_stats'] = lga_data['feedback_stats']
+        kwargs['max_chart_value'] = max(lga_data['feedback_stats']['sent'])
+        kwargs['feedback_clinics'] = lga_data['feedback_clinics']
 
         # Patient feedback responses
-        other_clinics = self.lga_clinics.exclude(pk=self.object.pk)
-        current_clinic_stats = self.get_response_statistics(
-            (self.object,), self.questions, self.start_date, self.end_date)
-        other_stats = self.get_response_statistics(
-            other_clinics, self.questions, self.start_date, self.end_date)
+        response_counts = lga_data['response_counts']
+        current_clinic_stats = self.sum_response_counts(
+            response_counts, self.questions, lambda pk: pk == self.object.pk)
+        other_stats = self.sum_response_counts(
+            response_counts, self.questions, lambda pk: pk != self.object.pk)
         margins = [(x[1] - y[1]) for x, y
                    in zip(current_clinic_stats, other_stats)]
         kwargs['response_stats'] = zip(self.questions, current_clinic_stats, other_stats, margins)
 
-        num_registered = self.visits.count()
-        num_started = self.visits.filter(survey_started=True).count()
-        num_completed = self.visits.filter(survey_completed=True).count()
+        if self.start_date and self.end_date:
+            stats = DailyStatistic.objects.for_visits(
+                self.start_date, self.end_date, clinic=self.object)
+        else:
+            stats = DailyStatistic.objects.for_visits(clinic=self.object)
+        counts = stats.aggregate(**self.PARTICIPATION_COUNTS)
+        num_registered = counts['sent'] or 0
+        num_started = counts['started'] or 0
+        num_completed = counts['completed'] or 0
 
         if num_registered:
             percent_started = make_percentage(num_started, num_registered)
@@ -450,6 +644,18 @@ class ClinicReport(ReportMixin, DetailView):
         # TODO - participation rank amongst other clinics.
         return super(ClinicReport, self).get_context_data(**kwargs)
 
+    @instrument()
+    def get_lga_data(self, lga_clinics, questions, start_date=None, end_date=None):
+        """Get the statistics about all clinics in the LGA used by the
+        report of each of them."""
+        return {
+            'feedback_stats': self.get_feedback_statistics(
+                lga_clinics, start_date=start_date, end_date=end_date),
+            'feedback_clinics': self.format_chart_labels(lga_clinics),
+            'response_counts': self.get_response_counts(
+                lga_clinics, questions, start_date, end_date),
+        }
+
 
 class AnalystSummary(TemplateView, ReportMixin):
     template_name = 'analysts/analysts.html'
@@ -460,11 +666,16 @@ class AnalystSummary(TemplateView, ReportMixin):
         response['allow'] = ','.join([self.allowed_methods])
         return response
 
+    @instrument()
     def get_facility_participation(self, clinics, **kwargs):
         """Get the sent, started and completed survey counts for
         clinics, service, dates.
 
         kwargs = start_date, end_date, service"""
+        # The dates picked by analysts are inclusive, so use dates not datetimes.
+        for key in ('start_date', 'end_date'):
+            if isinstance(kwargs.get(key), timezone.datetime):
+                kwargs[key] = kwargs[key].date()
         stats = self.get_feedback_statistics(clinics, **kwargs)
         sent, started, completed = stats['sent'], stats['started'], stats['completed']
         manual_reg = self.get_manual_registrations(clinics, **kwargs)
@@ -503,6 +714,7 @@ class AnalystSummary(TemplateView, ReportMixin):
         counted = Counter(tm.date() for tm in qset.values_list(datetime_fld, flat=True))
         return [counted.get(dt, 0) for dt in dates]
 
+    @instrument()
     def get_feedback_by_date(self, max_length=10, **kwargs):
         """Returns dict of surveys sent, surveys started, generic feedback by date.
 
@@ -525,26 +737,23 @@ class AnalystSummary(TemplateView, ReportMixin):
         # Add 1 to end_date so it captures visits of today
         end_plus = end_date + timedelta(1)
 
-        visits = models.Visit.objects.filter(survey_sent__isnull=False)
+        stats = DailyStatistic.objects.for_visits(start_date, end_date)
         generic_feedback = models.GenericFeedback.objects.filter(
             message_date__gte=start_date, message_date__lt=end_plus)
         if 'clinic' in kwargs:
-            visits = visits.filter(patient__clinic__name=kwargs['clinic'])
+            stats = stats.filter(clinic__name=kwargs['clinic'])
             generic_feedback = generic_feedback.filter(clinic__name=kwargs['clinic'])
         if 'service' in kwargs:
-            visits = visits.filter(service__name=kwargs['service'])
-
-        visits = visits.filter(visit_time__gte=start_date, visit_time__lt=end_plus)
-        # generic_feedback = generic_feedback.filter(
-        #    message_date__gte=start_date, message_date__lt=end_plus)
-        started_visits = visits.filter(survey_started=True)
+            stats = stats.filter(service__name=kwargs['service'])
+        counts = stats.order_by().values('date').annotate(sent=Sum('sent'), started=Sum('started'))
+        counts = dict((row['date'], row) for row in counts)
 
         _dates = compress_list(
             [dt.strftime('%d %b') for dt in date_range], max_length)
         _sent = compress_list(
-            self.count_by_date(visits, date_range, 'visit_time'), max_length)
+            [counts[dt]['sent'] if dt in counts else 0 for dt in date_range], max_length)
         _started = compress_list(
-            self.count_by_date(started_visits, date_range, 'visit_time'), max_length)
+            [counts[dt]['started'] if dt in counts else 0 for dt in date_range], max_length)
         _generic = compress_list(
             self.count_by_date(generic_feedback, date_range, 'message_date'), max_length)
         return {
@@ -630,6 +839,7 @@ class ParticipationCharts(View):
 
 class ClinicReportFilterByWeek(View):
 
+    @instrument()
     def get_feedback_data(self, start_date, end_date, clinic_id):
         report = ClinicReport()
         report.start_date = start_date
@@ -758,16 +968,15 @@ class ClinicReportFilterByWeek(View):
         end_date = (get_date(request.GET['end_date']) + timedelta(1)
                     ) if 'end_date' in request.GET else None
         clinic_id = request.GET.get('clinic_id')
+        clinic = get_object_or_404(models.Clinic, pk=clinic_id)
 
-        # Create an instance of a ClinicReport
-        # clinic = models.Clinic.objects.get(id=clinic_id)
-
-        # Collect the Comments filtered by the weeks
-        # clinic_data = self.get_feedback_data(start_date, end_date, clinic)
-        clinic_data = self.get_feedback_data(start_date, end_date, clinic_id)
+        # Collect the Comments filtered by the weeks. The report compares the
+        # clinic with the rest of its LGA, so it is cached by the LGA's data.
+        json_data = get_cached_report(
+            'clinic-week', clinic.lga_id, (clinic.pk, start_date, end_date),
+            lambda: self.get_feedback_data(start_date, end_date, clinic.pk))
 
-        return HttpResponse(
-            json.dumps(clinic_data, cls=DjangoJSONEncoder), content_type='text/json')
+        return HttpResponse(json_data, content_type='text/json')
 
 
 class LGAClinicsReport(DetailView):
@@ -782,20 +991,56 @@ class LGAClinicsReport(DetailView):
                 (end_date - timedelta(1)).strftime('%d-%b-%Y'))
         return filename
 
+    @instrument()
+    def render_facility(self, clinic, start_date, end_date, lga_data):
+        """Get the flowables of the report of one clinic."""
+        report = ClinicReport()
+        report.start_date = start_date
+        report.end_date = end_date
+        report.lga_data = lga_data
+        report.kwargs = {'pk': clinic.pk}
+        report.object = report.get_object()
+        context = report.get_context_data()
+        return pdf.ReportPdfRenderer().render_to_list(context)
+
+    @instrument()
     def render_facility_reports(self, start_date, end_date, out):
-        elements = []
-        renderer = pdf.ReportPdfRenderer()
         lga = self.get_object()
-        # TODO: Please make me better Stan...PLEASE.
-        for clinic in lga.clinic_set.all():
-            report = ClinicReport()
-            report.start_date = start_date
-            report.end_date = end_date
-            report.kwargs = {'pk': clinic.pk}
-            report.object = report.get_object()
-            context = report.get_context_data()
-            elements.extend(renderer.render_to_list(context))
-        renderer.render_to_response(elements, out)
+        clinics = list(lga.clinic_set.all())
+        if not clinics:
+            return pdf.ReportPdfRenderer().render_to_response([], out)
+
+        # The statistics comparing each clinic with the rest of the LGA are
+        # only gathered once.
+        report = ClinicReport()
+        questions = report.get_survey_questions(start_date, end_date)
+        lga_data = report.get_lga_data(
+            models.Clinic.objects.filter(lga=lga), questions, start_date, end_date)
+
+        def render(clinic):
+            try:
+                return self.render_facility(clinic, start_date, end_date, lga_data)
+            finally:
+                # Each thread opens its own database connection.
+                connection.close()
+
+        # Each clinic's report is mostly spent waiting for the database, so
+        # the reports are gathered in threads. The pages are laid out in a
+        # single document so that the page numbers and bookmarks run on.
+        workers = min(settings.PDF_REPORT_WORKERS, len(clinics))
+        if workers > 1:
+            pool = ThreadPool(workers)
+            try:
+                facilities = pool.map(render, clinics)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            facilities = [
+                self.render_facility(clinic, start_date, end_date, lga_data)
+                for clinic in clinics]
+        elements = [element for facility in facilities for element in facility]
+        pdf.ReportPdfRenderer().render_to_response(elements, out)
 
     def get(self, request, *args, **kwargs):
         start_date = get_date(request.GET['start_date']) if 'start_date' in request.GET else None
@@ -808,6 +1053,72 @@ class LGAClinicsReport(DetailView):
         return response
 
 
+class ReportJobMixin(object):
+
+    def get_job_data(self, job):
+        data = {
+            'id': job.pk,
+            'status': job.status,
+            'url': reverse('report_job', kwargs={'pk': job.pk}),
+        }
+        if job.status == models.ReportJob.DONE:
+            data['download_url'] = reverse('report_job_download', kwargs={'pk': job.pk})
+        return HttpResponse(json.dumps(data), content_type='text/json')
+
+
+class ReportJobView(ReportJobMixin, View):
+    """
+    Submits jobs to generate the all-facilities PDF of an LGA in the
+    background.
+
+    A POST with 'lga' and optionally 'start_date' and 'end_date' submits a
+    job, unless one has already been submitted for the same parameters
+    since the LGA's data last changed, in which case that job is returned.
+    """
+
+    def post(self, request):
+        try:
+            lga = models.LGA.objects.get(pk=int(request.POST.get('lga', '')))
+        except (ValueError, models.LGA.DoesNotExist):
+            return HttpResponseBadRequest('A valid lga is required.')
+        try:
+            start_date = parse(request.POST['start_date']).date()
+            end_date = parse(request.POST['end_date']).date()
+        except KeyError:
+            start_date = end_date = None
+        except ValueError:
+            return HttpResponseBadRequest('start_date and end_date must be dates.')
+
+        data_version = DataVersion.objects.get_version(lga)
+        job = models.ReportJob.objects.get_current(lga, start_date, end_date, data_version)
+        if job is None:
+            job = models.ReportJob.objects.create(
+                lga=lga, start_date=start_date, end_date=end_date, data_version=data_version)
+            tasks.generate_report.delay(job.pk)
+        return self.get_job_data(job)
+
+
+class ReportJobStatus(ReportJobMixin, View):
+    """The status of a report job, including the URL from which to download
+    the PDF once it is done."""
+
+    def get(self, request, pk):
+        job = get_object_or_404(models.ReportJob, pk=pk)
+        return self.get_job_data(job)
+
+
+class ReportJobDownload(View):
+    """Downloads the PDF generated by a finished report job."""
+
+    def get(self, request, pk):
+        job = get_object_or_404(models.ReportJob, pk=pk, status=models.ReportJob.DONE)
+        job.pdf.open('rb')
+        response = StreamingHttpResponse(job.pdf.chunks(), content_type='application/pdf')
+        response['Content-Disposition'] = 'attachment; filename=%s' % (
+            os.path.basename(job.pdf.name))
+        return response
+
+
 class LGAReport(ReportMixin, DetailView):
     template_name = 'clinics/summary.html'
     model = models.LGA
@@ -830,30 +1141,27 @@ class LGAReport(ReportMixin, DetailView):
         self.responses = SurveyQuestionResponse.objects.filter(clinic__lga=obj)
         if self.start_date and self.end_date:
             self.responses = self.responses.filter(
-                visit__visit_time__range=(self.start_date, self.end_date))
+                visit_time__gte=self.start_date, visit_time__lt=self.end_date)
         self.responses = self.responses.select_related('question', 'service', 'visit')
         self.initialize_data()
         return obj
 
+    @instrument('LGAReport.get_context_data')
     def get_context_data(self, **kwargs):
         kwargs['responses'] = self.responses
 
         clinics = models.Clinic.objects.filter(lga=self.lga)
         kwargs['feedback_by_service'] = self.get_feedback_by_service()
         kwargs['feedback_by_clinic'] = self.get_feedback_by_clinic(clinics)
+        kwargs['wait_time_distribution'] = self.get_wait_distribution(self.responses)
         kwargs['service_labels'] = [i.question_label for i in self.questions]
         kwargs['clinic_labels'] = self.get_clinic_labels()
         kwargs['question_labels'] = self.format_chart_labels(
             [qtn.question_label for qtn in self.questions])
         kwargs['lga'] = self.lga
 
-        if self.responses:
-            min_date = self.responses.aggregate(Min('datetime'))['datetime__min']
-            kwargs['min_date'] = get_week_start(min_date)
-            kwargs['max_date'] = timezone.now()
-        else:
-            kwargs['min_date'] = None
-            kwargs['max_date'] = None
+        kwargs['min_date'], kwargs['week_ranges'] = self.get_report_weeks(self.lga)
+        kwargs['max_date'] = timezone.now() if kwargs['min_date'] else None
 
         # Patient feedback responses
         clinic_stats = self.get_response_statistics(
@@ -869,9 +1177,6 @@ class LGAReport(ReportMixin, DetailView):
         kwargs['max_chart_value'] = max(feedback_stats['sent'])
         kwargs['feedback_clinics'] = self.format_chart_labels([cl.name for cl in clinics])
 
-        kwargs['week_ranges'] = [
-            (self.start_day(start), self.start_day(end)) for start, end in
-            self.get_week_ranges(kwargs['min_date'], kwargs['max_date'])]
         kwargs['week_start'], kwargs['week_end'] = self.get_current_week()
         data = super(LGAReport, self).get_context_data(**kwargs)
         return data
@@ -879,12 +1184,12 @@ class LGAReport(ReportMixin, DetailView):
 
 class LGAReportAjax(View):
 
+    @instrument('LGAReportAjax.get_data')
     def get_data(self, start_date, end_date, lga):
         clinics = models.Clinic.objects.filter(lga=lga)
         report = ReportMixin()
         report.responses = SurveyQuestionResponse.objects.filter(
-            visit__visit_time__range=(start_date, end_date),
-            clinic__in=clinics)
+            visit_time__gte=start_date, visit_time__lt=end_date, clinic__in=clinics)
         report.initialize_data()
         report.questions = report.get_survey_questions(start_date, end_date)
 
@@ -898,7 +1203,7 @@ class LGAReportAjax(View):
             'feedback_by_service': service_feedback,
             'feedback_by_clinic': clinic_feedback,
             'min_date': start_date,
-            'max_date': end_date,
+            'max_date': end_date - timedelta(1),
             'service_labels': question_labels,
             'clinic_labels': report.get_clinic_labels(),
         }
@@ -926,6 +1231,7 @@ class LGAReportAjax(View):
             'response_stats': [i[1] for i in response_stats],
             'question_labels': report.format_chart_labels(question_labels, async=True),
             'max_chart_value': max_chart_value,
+            'wait_time_distribution': report.get_wait_distribution(report.responses),
         }
 
     def get(self, request, *args, **kwargs):
@@ -938,14 +1244,16 @@ class LGAReportAjax(View):
             return HttpResponseBadRequest('')
 
         start_date = get_date(_start_date)
-        end_date = get_date(_end_date)
+        # The report includes the end date, up to midnight after it.
+        end_date = get_date(_end_date) + timedelta(1)
         try:
             lga = models.LGA.objects.get(pk=_lga)
         except models.LGA.DoesNotExist:
             return HttpResponseBadRequest('Wrong LGA')
 
-        data = self.get_data(start_date, end_date, lga)
-        json_data = json.dumps(data, cls=DjangoJSONEncoder)
+        json_data = get_cached_report(
+            'lga-week', lga.pk, (start_date, end_date),
+            lambda: self.get_data(start_date, end_date, lga))
 
         return HttpResponse(json_data, content_type='text/json')
 
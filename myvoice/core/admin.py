@@ -0,0 +1,52 @@
+from django.contrib import admin
+from django.core.urlresolvers import reverse
+from django.utils.html import format_html
+
+from . import models
+from . import tasks
+from .utils import csv_response, iter_qset_data, iterate_in_chunks, prepare_export_qset
+
+
+class CSVExportMixin(object):
+    """
+    Admin actions which export the export_fields of the selected objects to
+    a CSV file named after export_name. export_to_csv streams the file in
+    the response, while export_in_background writes it in a Celery task for
+    selections which are too large to export during a request.
+    """
+    export_name = 'data'
+    export_fields = []
+
+    def get_export_queryset(self, queryset):
+        return prepare_export_qset(queryset, self.export_fields)
+
+    def export_to_csv(self, request, queryset):
+        queryset = self.get_export_queryset(queryset)
+        data = iter_qset_data(iterate_in_chunks(queryset), self.export_fields)
+        return csv_response(data, '{0}.csv'.format(self.export_name))
+
+    def export_in_background(self, request, queryset):
+        job = models.ExportJob.from_queryset(
+            self.get_export_queryset(queryset), self.export_fields,
+            user=request.user, name=self.export_name)
+        job.save()
+        url = reverse('export_job', kwargs={'pk': job.pk})
+        tasks.export_csv.delay(job.pk, request.build_absolute_uri(url))
+        self.message_user(request, format_html(
+            'The export has been queued. <a href="{0}">Follow its progress</a>; you '
+            'will also be emailed when it is ready.', url))
+    export_in_background.short_description = "Export selected to CSV in the background"
+
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'user', 'status', 'rows', 'total', 'created', 'completed']
+    list_filter = ['status', 'name']
+    readonly_fields = ['user', 'name', 'content_type', 'query', 'fields', 'status', 'rows',
+                       'total', 'file', 'error', 'created', 'completed']
+
+    def has_add_permission(self, request, obj=None):
+        """Jobs are added by the export actions of other admins."""
+        return False
+
+
+admin.site.register(models.ExportJob, ExportJobAdmin)
@@ -0,0 +1,31 @@
+from django.db.models import Aggregate
+from django.db.models.sql.aggregates import Aggregate as SQLAggregate
+
+
+class SQLCountIf(SQLAggregate):
+    is_ordinal = True
+    sql_function = 'COUNT'
+    sql_template = '%(function)s(CASE WHEN %(field)s %(condition)s THEN 1 ELSE NULL END)'
+
+
+class CountIf(Aggregate):
+    """Counts the rows for which the field matches an SQL condition.
+
+    This lets several counts over a queryset be computed in a single query,
+    e.g.:
+
+        Visit.objects.values('patient__clinic').annotate(
+            sent=CountIf('survey_sent', condition='IS NOT NULL'),
+            started=CountIf('survey_started', condition='= TRUE'))
+
+    condition is included in the SQL as it is, so it must never contain
+    user input.
+    """
+    name = 'CountIf'
+
+    def __init__(self, lookup, condition, **extra):
+        super(CountIf, self).__init__(lookup, condition=condition, **extra)
+
+    def add_to_query(self, query, alias, col, source, is_summary):
+        aggregate = SQLCountIf(col, source=source, is_summary=is_summary, **self.extra)
+        query.aggregates[alias] = aggregate
@@ -0,0 +1,173 @@
+"""
+Opt-in timing of requests, and of named blocks of code run during them.
+
+When settings.INSTRUMENTATION is True, InstrumentationMiddleware records the
+number of SQL queries, the time spent in SQL and the time spent in Python
+for each request and for each block wrapped with instrument() or
+timed_block(), as well as the time spent rendering the template. The
+timings of each request are logged as a line of JSON to the
+myvoice.core.instrumentation logger and, when DEBUG is True, summarised in
+the X-Instrumentation response header.
+
+Only the queries made on the default connection by the request's own thread
+are counted. Blocks run in other threads, such as the facility reports of
+the all-facilities PDF, are only timed as part of the block waiting for them.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+class Timing(object):
+    """The totals of the runs of a request or block."""
+
+    def __init__(self):
+        self.calls = 0
+        self.queries = 0
+        self.sql = 0.0
+        self.total = 0.0
+
+    def as_dict(self):
+        return OrderedDict([
+            ('calls', self.calls),
+            ('queries', self.queries),
+            ('sql_ms', _ms(self.sql)),
+            ('python_ms', _ms(self.total - self.sql)),
+            ('total_ms', _ms(self.total)),
+        ])
+
+
+class Profile(object):
+    """The timings of a request and of the blocks run during it."""
+
+    def __init__(self):
+        self.request = Timing()
+        self.render = Timing()
+        self.blocks = OrderedDict()
+        self.start = self.mark()
+
+    def mark(self):
+        """The current time and query, to be passed to add() once a run ends."""
+        return time.time(), len(connection.queries)
+
+    def add(self, timing, mark):
+        """Add a run which started at mark to timing."""
+        start, first_query = mark
+        queries = connection.queries[first_query:]
+        timing.calls += 1
+        timing.queries += len(queries)
+        timing.sql += sum(float(query['time']) for query in queries)
+        timing.total += time.time() - start
+
+    def get_block(self, name):
+        return self.blocks.setdefault(name, Timing())
+
+    def as_dict(self):
+        data = OrderedDict([('request', self.request.as_dict())])
+        if self.render.calls:
+            data['render'] = self.render.as_dict()
+        data['blocks'] = OrderedDict(
+            (name, timing.as_dict()) for name, timing in self.blocks.items())
+        return data
+
+    def get_header(self):
+        timings = [('request', self.request)]
+        if self.render.calls:
+            timings.append(('render', self.render))
+        timings.extend(self.blocks.items())
+        return ', '.join(
+            '{0} {1}'.format(name, ' '.join(
+                '{0}={1}'.format(key, value) for key, value in timing.as_dict().items()))
+            for name, timing in timings)
+
+
+def get_profile():
+    """The profile of the current request, if it is being instrumented."""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def timed_block(name):
+    """Record the timings of the enclosed code under name."""
+    profile = get_profile()
+    if profile is None:
+        yield
+        return
+    mark = profile.mark()
+    try:
+        yield
+    finally:
+        profile.add(profile.get_block(name), mark)
+
+
+def instrument(name=None):
+    """Decorator recording the timings of each call under name, which
+    defaults to the name of the function."""
+    def decorator(func):
+        block_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if get_profile() is None:
+                return func(*args, **kwargs)
+            with timed_block(block_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InstrumentationMiddleware(object):
+    """
+    Records the timings of each request when settings.INSTRUMENTATION is
+    True. It should be the first middleware, so that the others are timed too.
+    """
+
+    def process_request(self, request):
+        if not settings.INSTRUMENTATION:
+            return
+        # Queries are only recorded by the debug cursor.
+        request._instrumentation_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        _local.profile = Profile()
+
+    def process_template_response(self, request, response):
+        profile = get_profile()
+        if profile is not None:
+            mark = profile.mark()
+            response.add_post_render_callback(lambda r: profile.add(profile.render, mark))
+        return response
+
+    def process_response(self, request, response):
+        profile = get_profile()
+        if profile is None:
+            return response
+        del _local.profile
+        profile.add(profile.request, profile.start)
+        connection.use_debug_cursor = getattr(request, '_instrumentation_debug_cursor', None)
+
+        data = OrderedDict([
+            ('method', request.method),
+            ('path', request.path),
+            ('status', response.status_code),
+        ])
+        data.update(profile.as_dict())
+        logger.info(json.dumps(data))
+        if settings.DEBUG:
+            response['X-Instrumentation'] = profile.get_header()
+        return response
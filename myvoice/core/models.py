@@ -0,0 +1,84 @@
+import base64
+import cPickle as pickle
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.utils import timezone
+
+from .storage import private_storage
+
+
+class ExportJobManager(models.Manager):
+
+    def purge(self):
+        """
+        Delete the jobs, and their files, which were submitted more than
+        EXPORT_JOB_EXPIRY seconds ago. Returns the number of jobs deleted.
+        """
+        cutoff = timezone.now() - timezone.timedelta(seconds=settings.EXPORT_JOB_EXPIRY)
+        expired = list(self.filter(created__lt=cutoff))
+        for job in expired:
+            if job.file:
+                job.file.delete(save=False)
+            job.delete()
+        return len(expired)
+
+
+class ExportJob(models.Model):
+    """A CSV export of the objects selected in the admin, written by a Celery task."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    user = models.ForeignKey('auth.User')
+    name = models.CharField(max_length=255, help_text="Name of the exported file.")
+    content_type = models.ForeignKey(ContentType)
+    query = models.TextField(help_text="The pickled query of the objects to export.")
+    fields = models.TextField(help_text="The dotted names of the exported fields, one per line.")
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    rows = models.PositiveIntegerField(default=0, help_text="Number of rows written so far.")
+    total = models.PositiveIntegerField(null=True, blank=True)
+    # The exports include phone numbers, so they are kept out of the public
+    # media and only served by ExportJobDownload.
+    file = models.FileField(upload_to='exports', storage=private_storage, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    completed = models.DateTimeField(null=True, blank=True)
+
+    objects = ExportJobManager()
+
+    def __unicode__(self):
+        return u'{0} export {1}'.format(self.name, self.pk)
+
+    @classmethod
+    def from_queryset(cls, queryset, fields, **kwargs):
+        """An unsaved job exporting the fields of the objects in queryset,
+        which should already select the related objects which are used."""
+        return cls(
+            content_type=ContentType.objects.get_for_model(queryset.model),
+            query=base64.b64encode(pickle.dumps(queryset.query, pickle.HIGHEST_PROTOCOL)),
+            fields='\n'.join(fields), **kwargs)
+
+    def get_queryset(self):
+        queryset = self.content_type.model_class()._default_manager.all()
+        queryset.query = pickle.loads(base64.b64decode(self.query))
+        return queryset
+
+    def get_fields(self):
+        return self.fields.splitlines()
+
+    def get_progress(self):
+        """Percentage of the rows which have been written, if known."""
+        if self.status == self.DONE:
+            return 100
+        if not self.total:
+            return 0
+        return min(100, self.rows * 100 / self.total)
@@ -0,0 +1,25 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils._os import safe_join
+
+
+class PrivateStorage(FileSystemStorage):
+    """
+    Stores files under PRIVATE_MEDIA_ROOT, which is outside of the public
+    tree served by the web server, so that they can only be downloaded
+    through views which check who is asking for them.
+
+    The location is read from the settings on each use, so that it can be
+    overridden in tests.
+    """
+
+    def path(self, name):
+        return safe_join(os.path.abspath(settings.PRIVATE_MEDIA_ROOT), name)
+
+    def url(self, name):
+        raise ValueError("Private files are not accessible via a URL.")
+
+
+private_storage = PrivateStorage()
@@ -0,0 +1,76 @@
+import csv
+import gzip
+import logging
+import tempfile
+import traceback
+
+from celery.task import task
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from .models import ExportJob
+from .utils import encode_row, iter_qset_data, iterate_in_chunks
+
+
+logger = logging.getLogger(__name__)
+
+
+@task
+def export_csv(job_pk, status_url=None):
+    """
+    Write the gzipped CSV of an ExportJob, one chunk of rows at a time, and
+    email its status_url to the user who submitted it.
+    """
+    # Only one worker may take the job, should it be delivered twice.
+    pending = ExportJob.objects.filter(pk=job_pk, status=ExportJob.PENDING)
+    if not pending.update(status=ExportJob.RUNNING):
+        logger.info('Export job {0} is not pending.'.format(job_pk))
+        return
+    job = ExportJob.objects.get(pk=job_pk)
+
+    try:
+        fields = job.get_fields()
+        queryset = job.get_queryset()
+        job.total = queryset.count()
+        ExportJob.objects.filter(pk=job.pk).update(total=job.total)
+        rows = iter_qset_data(iterate_in_chunks(queryset), fields)
+        with tempfile.TemporaryFile() as out:
+            # Closing the GzipFile writes its trailer but leaves out open.
+            gz = gzip.GzipFile(filename='{0}.csv'.format(job.name), mode='wb', fileobj=out)
+            writer = csv.writer(gz)
+            writer.writerow(encode_row(next(rows)))
+            for count, row in enumerate(rows, 1):
+                writer.writerow(encode_row(row))
+                if count % settings.EXPORT_PROGRESS_ROWS == 0:
+                    ExportJob.objects.filter(pk=job.pk).update(rows=count)
+                job.rows = count
+            gz.close()
+            out.seek(0)
+            job.file.save('{0}.csv.gz'.format(job.name), File(out), save=False)
+    except Exception:
+        logger.exception('Failed to export job {0}.'.format(job_pk))
+        job.status = ExportJob.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = ExportJob.DONE
+    job.completed = timezone.now()
+    job.save()
+
+    if status_url and job.user.email:
+        if job.status == ExportJob.DONE:
+            subject = 'Your export of {0} is ready'.format(job.name)
+            message = 'The {0} exported rows can be downloaded from {1}'.format(
+                job.rows, status_url)
+        else:
+            subject = 'Your export of {0} failed'.format(job.name)
+            message = 'See {0} for details.'.format(status_url)
+        job.user.email_user(subject, message)
+
+
+@task
+def purge_export_jobs():
+    """Delete the expired export jobs, and their files."""
+    deleted = ExportJob.objects.purge()
+    logger.info('Deleted {0} export jobs.'.format(deleted))
@@ -0,0 +1,38 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from myvoice.clinics.models import Visit
+
+from . import factories
+from ..aggregates import CountIf
+
+
+class TestCountIf(TestCase):
+
+    def setUp(self):
+        self.clinic1 = factories.Clinic()
+        self.clinic2 = factories.Clinic()
+        now = timezone.now()
+        factories.Visit(patient__clinic=self.clinic1, survey_sent=now, survey_started=True)
+        factories.Visit(patient__clinic=self.clinic1, survey_sent=now)
+        factories.Visit(patient__clinic=self.clinic1)
+        factories.Visit(patient__clinic=self.clinic2, survey_sent=now, survey_started=True)
+
+    def test_aggregate(self):
+        """Rows matching each condition should be counted."""
+        counts = Visit.objects.aggregate(
+            sent=CountIf('survey_sent', condition='IS NOT NULL'),
+            started=CountIf('survey_started', condition='= TRUE'))
+        self.assertEqual(counts, {'sent': 3, 'started': 2})
+
+    def test_annotate(self):
+        """Counts should be grouped in a single query."""
+        with self.assertNumQueries(1):
+            counts = list(Visit.objects.order_by('patient__clinic').values(
+                'patient__clinic').annotate(
+                sent=CountIf('survey_sent', condition='IS NOT NULL'),
+                started=CountIf('survey_started', condition='= TRUE')))
+        self.assertEqual(counts, [
+            {'patient__clinic': self.clinic1.pk, 'sent': 2, 'started': 1},
+            {'patient__clinic': self.clinic2.pk, 'sent': 1, 'started': 1},
+        ])
@@ -0,0 +1,81 @@
+import json
+
+import mock
+
+from django.http import HttpResponse
+from django.template import Template
+from django.template.response import SimpleTemplateResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from myvoice.clinics.models import Visit
+
+from .. import instrumentation
+from . import factories
+
+
+@instrumentation.instrument()
+def count_visits():
+    return Visit.objects.count()
+
+
+@override_settings(INSTRUMENTATION=True, DEBUG=True)
+class TestInstrumentationMiddleware(TestCase):
+
+    def setUp(self):
+        self.middleware = instrumentation.InstrumentationMiddleware()
+        self.request = RequestFactory().get('/reports/')
+        factories.Visit.create()
+
+    def run_request(self, view):
+        self.middleware.process_request(self.request)
+        response = view()
+        if hasattr(response, 'render'):
+            response = self.middleware.process_template_response(self.request, response)
+            response.render()
+        with mock.patch.object(instrumentation, 'logger') as logger:
+            response = self.middleware.process_response(self.request, response)
+        return response, json.loads(logger.info.call_args[0][0])
+
+    def test_blocks(self):
+        """Queries made in instrumented blocks should be recorded under their names."""
+        def view():
+            count_visits()
+            count_visits()
+            with instrumentation.timed_block('listing'):
+                list(Visit.objects.all())
+            return HttpResponse()
+        response, data = self.run_request(view)
+        self.assertEqual('/reports/', data['path'])
+        self.assertEqual(3, data['request']['queries'])
+        self.assertEqual((2, 2), (data['blocks']['count_visits']['calls'],
+                                  data['blocks']['count_visits']['queries']))
+        self.assertEqual(1, data['blocks']['listing']['queries'])
+        self.assertIn('count_visits calls=2 queries=2', response['X-Instrumentation'])
+        self.assertIsNone(instrumentation.get_profile())
+
+    def test_render(self):
+        """Queries made while rendering templates should be recorded."""
+        def view():
+            return SimpleTemplateResponse(
+                Template('{{ visits.count }}'), {'visits': Visit.objects.all()})
+        response, data = self.run_request(view)
+        self.assertEqual('1', response.content)
+        self.assertEqual((1, 1), (data['render']['calls'], data['render']['queries']))
+
+    @override_settings(DEBUG=False)
+    def test_no_header(self):
+        """The timings should only be logged when not debugging."""
+        response, data = self.run_request(HttpResponse)
+        self.assertNotIn('X-Instrumentation', response)
+        self.assertEqual(0, data['request']['queries'])
+
+    @override_settings(INSTRUMENTATION=False)
+    def test_disabled(self):
+        """Nothing should be recorded unless instrumentation is enabled."""
+        self.middleware.process_request(self.request)
+        self.assertIsNone(instrumentation.get_profile())
+        self.assertEqual(1, count_visits())
+        response = self.middleware.process_response(self.request, HttpResponse())
+        self.assertNotIn('X-Instrumentation', response)
@@ -0,0 +1,101 @@
+import csv
+import gzip
+import os
+import shutil
+import tempfile
+
+from django.core import mail
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from myvoice.clinics.models import Visit
+
+from .. import models
+from .. import tasks
+from ..utils import prepare_export_qset
+from . import factories
+
+
+class TestExportCSV(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp(prefix='exports')
+        self.settings = override_settings(PRIVATE_MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.user = factories.User.create()
+        self.fields = ['patient.serial', 'patient.clinic', 'mobile']
+        self.visits = [factories.Visit.create(mobile='0803000000{0}'.format(i))
+                       for i in range(3)]
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def make_job(self, queryset, **kwargs):
+        job = models.ExportJob.from_queryset(
+            prepare_export_qset(queryset, self.fields), self.fields,
+            user=self.user, name='visit_data', **kwargs)
+        job.save()
+        return job
+
+    def test_export(self):
+        """The selected objects should be written to a gzipped CSV."""
+        job = self.make_job(Visit.objects.exclude(pk=self.visits[1].pk))
+        tasks.export_csv(job.pk)
+        job = models.ExportJob.objects.get(pk=job.pk)
+        self.assertEqual(models.ExportJob.DONE, job.status)
+        self.assertEqual((2, 2), (job.rows, job.total))
+        self.assertIsNotNone(job.completed)
+        self.assertTrue(job.file.name.endswith('.csv.gz'))
+        # The file holds phone numbers, so it should not be public.
+        self.assertTrue(job.file.path.startswith(self.media_root))
+        self.assertRaises(ValueError, lambda: job.file.url)
+        job.file.open('rb')
+        rows = list(csv.reader(gzip.GzipFile(fileobj=job.file)))
+        self.assertEqual(['patient serial', 'patient clinic', 'mobile'], rows[0])
+        self.assertEqual(
+            [[v.patient.serial, v.patient.clinic.name, v.mobile]
+             for v in (self.visits[0], self.visits[2])],
+            rows[1:])
+
+    def test_get_progress(self):
+        """Progress should be the percentage of the rows written."""
+        job = self.make_job(Visit.objects.all())
+        self.assertEqual(0, job.get_progress())
+        job.rows, job.total = 1, 3
+        self.assertEqual(33, job.get_progress())
+        job.status = models.ExportJob.DONE
+        self.assertEqual(100, job.get_progress())
+
+    def test_notify(self):
+        """The user should be emailed the status page."""
+        job = self.make_job(Visit.objects.all())
+        tasks.export_csv(job.pk, 'http://example.com/exports/1/')
+        self.assertEqual(1, len(mail.outbox))
+        self.assertEqual([self.user.email], mail.outbox[0].to)
+        self.assertIn('http://example.com/exports/1/', mail.outbox[0].body)
+
+    def test_not_pending(self):
+        """Jobs which have already been taken should not be run again."""
+        job = self.make_job(Visit.objects.all(), status=models.ExportJob.RUNNING)
+        tasks.export_csv(job.pk)
+        job = models.ExportJob.objects.get(pk=job.pk)
+        self.assertEqual(models.ExportJob.RUNNING, job.status)
+        self.assertFalse(job.file)
+
+    @override_settings(EXPORT_JOB_EXPIRY=7 * 24 * 60 * 60)
+    def test_purge(self):
+        """Expired jobs should be deleted with their files."""
+        current = self.make_job(Visit.objects.all())
+        expired = self.make_job(Visit.objects.all())
+        for job in (current, expired):
+            tasks.export_csv(job.pk)
+        models.ExportJob.objects.filter(pk=expired.pk).update(
+            created=timezone.now() - timezone.timedelta(days=8))
+        expired = models.ExportJob.objects.get(pk=expired.pk)
+        current = models.ExportJob.objects.get(pk=current.pk)
+        tasks.purge_export_jobs()
+        self.assertEqual([current.pk], list(models.ExportJob.objects.values_list('pk', flat=True)))
+        self.assertFalse(os.path.exists(expired.file.path))
+        self.assertTrue(os.path.exists(current.file.path))
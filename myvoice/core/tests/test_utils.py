@@ -4,7 +4,10 @@ import mock
 from django.test import TestCase
 from django.utils import timezone
 
+from myvoice.clinics.models import Patient, Service, Visit
+
 from .. import utils
+from . import factories
 
 
 class TestUtils(TestCase):
@@ -151,6 +154,68 @@ class TestCSVExport(TestCase):
         self.assertEqual(['name', 'address', 'counter', 'parent name'], data[0])
 
 
+class TestStreamingCSVExport(TestCase):
+
+    def test_iterate_in_chunks(self):
+        """All objects should be returned in order, a chunk per query."""
+        visits = [factories.Visit.create() for i in range(5)]
+        qset = Visit.objects.select_related('patient__clinic')
+        with self.assertNumQueries(3):
+            objs = list(utils.iterate_in_chunks(qset, chunk_size=2))
+            # The related objects were loaded with each chunk.
+            [obj.patient.clinic for obj in objs]
+        self.assertEqual([v.pk for v in visits], [obj.pk for obj in objs])
+
+    def test_iterate_empty(self):
+        """An empty queryset should give no objects."""
+        self.assertEqual([], list(utils.iterate_in_chunks(Visit.objects.all())))
+
+    def test_csv_response(self):
+        """Rows should be streamed as UTF-8 encoded CSV."""
+        rows = iter([['name', 'place'], [u'caf\xe9', 'here, there']])
+        response = utils.csv_response(rows, 'data.csv')
+        self.assertTrue(response.streaming)
+        self.assertEqual('attachment; filename=data.csv', response['Content-Disposition'])
+        self.assertEqual(
+            'name,place\r\ncaf\xc3\xa9,"here, there"\r\n',
+            ''.join(response.streaming_content))
+
+    def test_get_query_fields(self):
+        """Related objects on the paths should be selected, and only the
+        fields used should be loaded."""
+        related, only = utils.get_query_fields(
+            Visit, ['patient.serial', 'service', 'mobile', 'mobile.upper'])
+        self.assertEqual(['patient', 'service'], related)
+        service_fields = ['service__{0}'.format(f.name)
+                          for f in Service._meta.concrete_fields]
+        self.assertEqual(
+            sorted(['mobile', 'patient', 'patient__serial', 'service'] + service_fields),
+            only)
+
+    def test_get_query_fields_method(self):
+        """Every field should be loaded for an object whose method is used."""
+        related, only = utils.get_query_fields(Visit, ['patient.get_foo', 'visit_time'])
+        self.assertEqual(['patient'], related)
+        patient_fields = ['patient__{0}'.format(f.name)
+                          for f in Patient._meta.concrete_fields]
+        self.assertEqual(sorted(['patient', 'visit_time'] + patient_fields), only)
+
+    def test_export_single_query(self):
+        """A chunk of rows should be exported without further queries."""
+        for i in range(3):
+            factories.Visit.create()
+        headers = ['patient.serial', 'patient.clinic', 'service', 'visit_time', 'mobile']
+        qset = utils.prepare_export_qset(Visit.objects.all(), headers)
+        with self.assertNumQueries(1):
+            data = utils.extract_qset_data(qset, headers)
+        self.assertEqual(4, len(data))
+        visit = Visit.objects.order_by('pk')[0]
+        self.assertEqual(
+            [visit.patient.serial, visit.patient.clinic.name, visit.service.name,
+             unicode(visit.visit_time), visit.mobile],
+            data[1])
+
+
 class TestGetDate(TestCase):
 
     def setUp(self):
@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from myvoice.clinics.models import Visit
+
+from .. import models
+from . import factories
+
+
+class TestExportJobView(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp(prefix='exports')
+        self.settings = override_settings(PRIVATE_MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.user = factories.User.create(username='owner')
+        self.user.set_password('password')
+        self.user.save()
+        self.job = models.ExportJob.from_queryset(
+            Visit.objects.all(), ['mobile'], user=self.user, name='visit_data')
+        self.job.save()
+        self.client.login(username='owner', password='password')
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_status(self):
+        """The status page should show the progress of the job."""
+        self.job.rows, self.job.total = 5, 10
+        self.job.save()
+        response = self.client.get(reverse('export_job', kwargs={'pk': self.job.pk}))
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, '5 of 10')
+        self.assertNotContains(response, reverse(
+            'export_job_download', kwargs={'pk': self.job.pk}))
+
+    def test_other_user(self):
+        """Users should not see the jobs of other users."""
+        other = factories.User.create(username='other')
+        other.set_password('password')
+        other.save()
+        self.client.login(username='other', password='password')
+        response = self.client.get(reverse('export_job', kwargs={'pk': self.job.pk}))
+        self.assertEqual(404, response.status_code)
+
+    def test_download(self):
+        """The file of a finished job should be downloadable."""
+        self.job.file.save('visit_data.csv.gz', ContentFile('data'), save=False)
+        self.job.status = models.ExportJob.DONE
+        self.job.save()
+        url = reverse('export_job_download', kwargs={'pk': self.job.pk})
+        response = self.client.get(reverse('export_job', kwargs={'pk': self.job.pk}))
+        self.assertContains(response, url)
+        response = self.client.get(url)
+        self.assertEqual('data', ''.join(response.streaming_content))
+        self.assertIn('visit_data', response['Content-Disposition'])
@@ -7,6 +7,12 @@ from . import views
 
 urlpatterns = [
     url(r'^$', login_required(views.Home.as_view()), name='home'),
+    url(r'^exports/(?P<pk>\d+)/$',
+        login_required(views.ExportJobView.as_view()),
+        name='export_job'),
+    url(r'^exports/(?P<pk>\d+)/download/$',
+        login_required(views.ExportJobDownload.as_view()),
+        name='export_job_download'),
 
     # TODO - implement "Remember Me" functionality
     url(r'^accounts/login/$',
@@ -1,5 +1,9 @@
+import csv
 import datetime
 from dateutil.parser import parse
+from django.db import models
+from django.db.models.fields import FieldDoesNotExist
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 
 
@@ -48,28 +52,137 @@ def make_percentage(numerator, denominator, places=0):
 
 
 def extract_attr(obj, name):
-    parts = name.split('.')
-    # Not likely
+    return compile_extractor(name)(obj)
+
+
+def compile_extractor(name):
+    """Return a function which gets the attribute at the dotted path name
+    from an object, calling any callable attributes along the way."""
     if not name:
-        return None
-    if len(parts) == 1:
-        attr = getattr(obj, name)
-        return attr() if callable(attr) else attr
-    else:
-        newobj = getattr(obj, parts[0])
-        if callable(newobj):
-            newobj = newobj()
-        return extract_attr(newobj, '.'.join(parts[1:]))
+        return lambda obj: None
+    parts = name.split('.')
+
+    def extract(obj):
+        for part in parts:
+            obj = getattr(obj, part)
+            if callable(obj):
+                obj = obj()
+        return obj
+    return extract
+
+
+def to_text(value):
+    """Convert a value to unicode, decoding byte strings as UTF-8."""
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8', 'ignore')
+    return unicode(value)
+
+
+def compile_row(fld_names):
+    """Return a function which gets the text of the fields in fld_names
+    from an object, parsing each dotted field name only once."""
+    extractors = [compile_extractor(fld_name) for fld_name in fld_names]
+    return lambda obj: [to_text(extract(obj)) for extract in extractors]
+
+
+def get_query_fields(model, fld_names):
+    """Return the select_related() and only() arguments needed to get the
+    dotted fld_names from objects of model without further queries.
+
+    Every field is loaded for a related object which is extracted itself,
+    or which has a method or property extracted, since those may use any
+    of its fields."""
+    related, only = set(), set()
+    for fld_name in fld_names:
+        opts, path = model._meta, []
+        for part in fld_name.split('.'):
+            try:
+                field = opts.get_field(part)
+            except FieldDoesNotExist:
+                field = None
+            if field is None or isinstance(field, models.ManyToManyField):
+                only.update(_all_fields(opts, path))
+                break
+            path.append(part)
+            only.add('__'.join(path))
+            if not isinstance(field, models.ForeignKey):
+                break
+            related.add('__'.join(path))
+            opts = field.rel.to._meta
+        else:
+            only.update(_all_fields(opts, path))
+    return sorted(related), sorted(only)
+
+
+def _all_fields(opts, path):
+    return ['__'.join(path + [field.name]) for field in opts.concrete_fields]
+
+
+def prepare_export_qset(qset, fld_names):
+    """Return qset with only the columns and related objects needed to get
+    the dotted fld_names from its objects."""
+    related, only = get_query_fields(qset.model, fld_names)
+    if related:
+        qset = qset.select_related(*related)
+    if only:
+        qset = qset.only(*only)
+    return qset
+
+
+def iter_qset_data(qset, fld_names):
+    """Yield the headers, then the data of fields in fld_names for each
+    object in qset."""
+    yield [header.replace('.', ' ') for header in fld_names]
+    get_row = compile_row(fld_names)
+    for obj in qset:
+        yield get_row(obj)
 
 
 def extract_qset_data(qset, fld_names):
     """Extract data of fields in fld_names from queryset to a list."""
-    out = [[header.replace('.', ' ') for header in fld_names]]
-    for obj in qset:
-        line = [str(extract_attr(obj, fld_name)).decode('utf-8', 'ignore')
-                for fld_name in fld_names]
-        out.append(line)
-    return out
+    return list(iter_qset_data(qset, fld_names))
+
+
+def iterate_in_chunks(qset, chunk_size=1000):
+    """Yield the objects of a queryset in order of primary key, fetching
+    chunk_size of them at a time so that the whole result is never held in
+    memory. select_related() and other options of the queryset are kept."""
+    qset = qset.order_by('pk')
+    chunk = list(qset[:chunk_size])
+    while chunk:
+        for obj in chunk:
+            yield obj
+        if len(chunk) < chunk_size:
+            break
+        chunk = list(qset.filter(pk__gt=chunk[-1].pk)[:chunk_size])
+
+
+def encode_row(row):
+    """Encode the values of a row as UTF-8, since the csv module cannot
+    write unicode."""
+    return [unicode(value).encode('utf-8') for value in row]
+
+
+class Echo(object):
+    """A file-like object which returns what is written to it, so that
+    csv.writer can be used to produce the lines of a streaming response."""
+
+    def write(self, value):
+        return value
+
+
+def csv_response(rows, filename):
+    """Stream rows, such as those from iter_qset_data, as a CSV download.
+
+    Rows are written as they are consumed, so an iterator of rows is never
+    held in memory."""
+    writer = csv.writer(Echo())
+    lines = (writer.writerow(encode_row(row)) for row in rows)
+    response = StreamingHttpResponse(lines, content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename={0}'.format(filename)
+    return response
 
 
 def daterange(start_date, end_date):
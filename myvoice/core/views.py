@@ -1,35 +1,52 @@
-from django.db.models import Count
-from django.views.generic import TemplateView
-from myvoice.clinics.models import Clinic, Patient, Visit
-from collections import Counter
+import os
+
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.generic import DetailView, TemplateView, View
+from myvoice.statistics.models import ProgressToDate
+
+from .models import ExportJob
 
 
 class Home(TemplateView):
     template_name = 'core/home.html'
 
-    def get_facility_counts(self):
-        """Returns the total count of facilities, grouped by type, and the count of LGAs."""
-        lgas = set()
-        counts = Counter()
-        for row in Clinic.objects.values('lga', 'type').annotate(facilities=Count('id')):
-            lgas.add(row['lga'])
-            counts[row['type']] += row['facilities']
-        counts['lga'] = len(lgas)
-        return counts
-
     def get_progress_to_date(self):
         """Returns a dictionary used to populate the "Progress to Date" view on the home page."""
-        # Assumption: since patients are registered by clinic staff, the number of unique senders
-        #  in the Visit table, should be roughly equal to the number of staff. I'm doing this,
-        #  'cause presently there's no data in the ClinicStaff table.
-        staff = Visit.objects.values('sender').distinct()
-        sent = Visit.objects.values('mobile').distinct()
-        started = Visit.objects.filter(mobile__in=sent, survey_started=True)
-        facility_counts = self.get_facility_counts()
-        return {'staff_count': staff.count(),
-                'primary_facilities_count': facility_counts['primary'],
-                'general_hospitals_count': facility_counts['general'],
-                'lga_count': facility_counts['lga'],
-                'patient_count': Patient.objects.count(),
-                'survey_sent_count': sent.count(),
-                'survey_started_count': started.count()}
+        progress = ProgressToDate.objects.get_current()
+        return {'staff_count': progress.staff,
+                'primary_facilities_count': progress.primary_facilities,
+                'general_hospitals_count': progress.general_hospitals,
+                'lga_count': progress.lgas,
+                'patient_count': progress.patients,
+                'survey_sent_count': progress.mobiles,
+                'survey_started_count': progress.started}
+
+
+class ExportJobMixin(object):
+    """Export jobs can only be seen by the users who submitted them, and
+    by superusers."""
+
+    def get_queryset(self):
+        jobs = ExportJob.objects.all()
+        if not self.request.user.is_superuser:
+            jobs = jobs.filter(user=self.request.user)
+        return jobs
+
+
+class ExportJobView(ExportJobMixin, DetailView):
+    """The progress of an export job, with a link to its file once it is done."""
+    template_name = 'core/export_job.html'
+    context_object_name = 'job'
+
+
+class ExportJobDownload(ExportJobMixin, View):
+    """Downloads the file written by a finished export job."""
+
+    def get(self, request, pk):
+        job = get_object_or_404(self.get_queryset(), pk=pk, status=ExportJob.DONE)
+        job.file.open('rb')
+        response = StreamingHttpResponse(job.file.chunks(), content_type='application/x-gzip')
+        response['Content-Disposition'] = 'attachment; filename=%s' % (
+            os.path.basename(job.file.name))
+        return response
@@ -55,6 +55,11 @@ USE_TZ = True
 # Example: "/home/media/media.lawrence.com/media/"
 MEDIA_ROOT = os.path.join(PROJECT_ROOT, 'public', 'media')
 
+# Absolute filesystem path to the directory holding files which must only be
+# downloaded through views which check permissions, such as exports and
+# reports. It must not be served by the web server.
+PRIVATE_MEDIA_ROOT = os.path.join(PROJECT_ROOT, 'private', 'media')
+
 # URL that handles the media served from MEDIA_ROOT. Make sure to use a
 # trailing slash.
 # Examples: "http://media.lawrence.com/media/", "http://example.com/media/"
@@ -100,6 +105,7 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'myvoice.core.instrumentation.InstrumentationMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -251,15 +257,32 @@ CELERYBEAT_SCHEDULE = {
         'task': 'myvoice.survey.tasks.import_responses',
         'schedule': crontab(minute='0', hour='*'),
     },
+    'refresh-progress-to-date': {
+        'task': 'myvoice.statistics.tasks.refresh_progress_to_date',
+        'schedule': crontab(minute='*/10'),
+    },
+    'purge-export-jobs': {
+        'task': 'myvoice.core.tasks.purge_export_jobs',
+        'schedule': crontab(minute='0', hour='2'),
+    },
+    'purge-report-jobs': {
+        'task': 'myvoice.clinics.tasks.purge_report_jobs',
+        'schedule': crontab(minute='30', hour='2'),
+    },
 }
 CELERY_SEND_TASK_ERROR_EMAILS = True
 CELERY_ROUTES = {
     # process the time-sensitive tasks that send SMSes on their own queue
     'myvoice.survey.tasks.start_feedback_survey': {'queue': 'sendsms'},
+    'myvoice.survey.tasks.start_feedback_surveys': {'queue': 'sendsms'},
     'myvoice.survey.tasks.handle_new_visits': {'queue': 'sendsms'},
     # put import_responses on its own queue so it doesn't back up other tasks
     # if it gets delayed
     'myvoice.survey.tasks.import_responses': {'queue': 'importer'},
+    'myvoice.survey.tasks.import_survey_responses': {'queue': 'importer'},
+    # run admin exports one at a time on their own queue, since each can
+    # take a long time
+    'myvoice.core.tasks.export_csv': {'queue': 'exports'},
 }
 
 # Set PostGIS version so that Django can find it.
@@ -269,6 +292,17 @@ POSTGIS_VERSION = (2, 1)
 TEXTIT_API_TOKEN = os.environ.get('TEXTIT_API_TOKEN', '')
 TEXTIT_USERNAME = os.environ.get('TEXTIT_USERNAME', '')
 TEXTIT_PASSWORD = os.environ.get('TEXTIT_PASSWORD', '')
+TEXTIT_API_URL = 'https://api.textit.in/api/v1/'
+# (connect, read) timeouts, in seconds, for requests to the TextIt API.
+TEXTIT_API_TIMEOUT = (5, 30)
+# Number of connections to keep open to the TextIt API per worker process.
+TEXTIT_API_POOL_SIZE = 10
+# Failed requests are retried after TEXTIT_API_RETRY_BACKOFF seconds,
+# doubling after each attempt.
+TEXTIT_API_MAX_RETRIES = 3
+TEXTIT_API_RETRY_BACKOFF = 0.5
+# Longest wait, in seconds, honoured from a Retry-After header.
+TEXTIT_API_MAX_RETRY_AFTER = 60
 
 # Amount of time that should elapse between when we first process a visit
 # and when we send a survey to the patient.
@@ -277,3 +311,48 @@ DEFAULT_SURVEY_DELAY = datetime.timedelta(minutes=0)
 # Hours, in UTC, between which we can send surveys. Send dates outside of this
 # window will be sent the next day.
 SURVEY_TIME_WINDOW = (7, 20)  # 7am (8am WAT) to 8pm (9pm WAT)
+
+# Maximum number of phone numbers sent to TextIt in a single request to start
+# the feedback survey.
+SURVEY_BATCH_SIZE = 100
+
+# Number of seconds after which the lock held while importing responses for a
+# flow expires, should the import die without releasing it. The lock is kept
+# in the default cache, which must be shared between workers (e.g., memcached)
+# for the lock to prevent overlapping imports on different machines.
+SURVEY_IMPORT_LOCK_TIMEOUT = 60 * 60
+
+# Number of seconds for which clinics and services are cached in each process
+# for looking up the codes in incoming SMSes. Changes made in the same process
+# (e.g., through the admin) take effect immediately.
+CODE_CACHE_TIMEOUT = 5 * 60
+
+# Number of threads used to gather the data for each facility when building
+# the all-facilities PDF of an LGA. Each thread uses its own database
+# connection; set to 1 to build every facility in the request thread.
+PDF_REPORT_WORKERS = 4
+
+# Number of seconds for which the data of the weekly report filters is cached.
+# Cached data is not used once the data about the LGA changes, so this only
+# bounds how long unused data is kept.
+REPORT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Number of seconds after which a report job which is still pending or
+# running is assumed to have been lost, and is resubmitted on request.
+REPORT_JOB_TIMEOUT = 60 * 60
+
+# Number of seconds after which report jobs and their PDFs are deleted. Jobs
+# superseded by changes to the data of their LGA are deleted sooner.
+REPORT_JOB_EXPIRY = 7 * 24 * 60 * 60
+
+# Number of rows between the progress updates of a background export.
+EXPORT_PROGRESS_ROWS = 10000
+
+# Number of seconds after which export jobs and their files are deleted.
+EXPORT_JOB_EXPIRY = 7 * 24 * 60 * 60
+
+# Whether to record the number of SQL queries and the time spent in SQL,
+# Python and templates for each request, and for each block of code wrapped
+# with myvoice.core.instrumentation.instrument. The timings are logged and,
+# when DEBUG is True, added to the X-Instrumentation response header.
+INSTRUMENTATION = False
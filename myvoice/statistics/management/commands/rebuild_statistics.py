@@ -0,0 +1,26 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dateutil.parser import parse
+
+from ...models import DailyStatistic
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily statistics used by the reports from visits and responses."
+    option_list = BaseCommand.option_list + (
+        make_option('--start', dest='start', default=None,
+                    help="First day to recompute (YYYY-MM-DD). Defaults to the first visit."),
+        make_option('--end', dest='end', default=None,
+                    help="Last day to recompute (YYYY-MM-DD). Defaults to the last visit."),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            start_date = parse(options['start']).date() if options['start'] else None
+            end_date = parse(options['end']).date() if options['end'] else None
+        except ValueError as e:
+            raise CommandError(e)
+        days = DailyStatistic.objects.rebuild(start_date, end_date)
+        self.stdout.write("Recomputed statistics for {0} days.".format(days))
@@ -0,0 +1,440 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import datetime
+import json
+import sys
+import threading
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import six, timezone
+
+from myvoice.clinics.models import Clinic, ClinicScore, GenericFeedback, Patient, Visit
+from myvoice.core.aggregates import CountIf
+from myvoice.survey.models import SurveyQuestion, SurveyQuestionResponse
+
+
+def get_date(value):
+    """The UTC date of a datetime, which is the day its statistics are kept under."""
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = value.astimezone(timezone.utc)
+        return value.date()
+    return value
+
+
+# The (clinic_id, date) pairs to refresh at the end of the current
+# DailyStatisticManager.deferred() block of each thread, if any.
+_deferred = threading.local()
+
+
+class DailyStatisticManager(models.Manager):
+
+    def for_visits(self, start_date=None, end_date=None, **filters):
+        """Rows holding counts of visits, optionally between two dates (see _filter)."""
+        return self._filter(start_date, end_date, question=None, **filters)
+
+    def for_responses(self, start_date=None, end_date=None, **filters):
+        """Rows holding counts of responses, optionally between two dates (see _filter)."""
+        return self._filter(start_date, end_date, question__isnull=False, **filters)
+
+    def _filter(self, start_date, end_date, **filters):
+        """
+        Rows matching filters from the day of start_date to that of end_date.
+
+        An end_date which is a date is inclusive, while one which is a
+        datetime is exclusive, as it is for visit_time__lt in the reports: an
+        end at midnight does not include the day which starts then.
+        """
+        qs = self.filter(**filters)
+        if start_date:
+            qs = qs.filter(date__gte=get_date(start_date))
+        if end_date:
+            if isinstance(end_date, datetime.datetime):
+                end_date -= datetime.timedelta(microseconds=1)
+            qs = qs.filter(date__lte=get_date(end_date))
+        return qs
+
+    @contextmanager
+    def deferred(self):
+        """
+        Postpone the refreshes requested in the enclosed block, such as by
+        the signal handlers below, to its end, so that each clinic and date
+        is only recomputed once however many of its visits and responses are
+        saved. Nested blocks are refreshed at the end of the outermost one.
+        """
+        if getattr(_deferred, 'slices', None) is not None:
+            yield
+            return
+        slices = _deferred.slices = set()
+        try:
+            yield
+        except Exception:
+            exc_info = sys.exc_info()
+            _deferred.slices = None
+            # Changes committed before the error, such as the earlier pages
+            # of an import, are still counted, unless they are about to be
+            # rolled back.
+            if not connections[self.db].in_atomic_block:
+                self._refresh(slices)
+            six.reraise(*exc_info)
+        finally:
+            _deferred.slices = None
+        self._refresh(slices)
+
+    def refresh(self, slices):
+        """Recompute the statistics for each (clinic_id, date) in slices, or
+        at the end of the current deferred() block."""
+        slices = set((clinic_id, get_date(date)) for clinic_id, date in slices
+                     if clinic_id is not None and date is not None)
+        pending = getattr(_deferred, 'slices', None)
+        if pending is not None:
+            pending.update(slices)
+        else:
+            self._refresh(slices)
+
+    def _refresh(self, slices):
+        clinics_by_date = defaultdict(set)
+        for clinic_id, date in slices:
+            clinics_by_date[date].add(clinic_id)
+        for date, clinic_ids in sorted(clinics_by_date.items()):
+            self._recompute(date, clinic_ids)
+        if clinics_by_date:
+            DataVersion.objects.bump(set(clinic_id for clinic_id, _ in slices))
+
+    def refresh_visits(self, visit_pks):
+        """Recompute the statistics for the days and clinics of the given visits."""
+        visits = Visit.objects.filter(pk__in=visit_pks)
+        self.refresh(visits.values_list('patient__clinic', 'visit_time'))
+
+    def _lock(self, date, clinic_ids=None):
+        """
+        Wait for any other refresh of the statistics of the clinics on date
+        to commit, and hold off any new one until the current transaction
+        ends. Only PostgreSQL supports this; elsewhere it does nothing.
+        """
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            return
+        if clinic_ids is None:
+            clinic_ids = Clinic.objects.values_list('pk', flat=True)
+        cursor = connection.cursor()
+        # Locks are always taken in the same order, so they cannot deadlock.
+        for clinic_id in sorted(clinic_ids):
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [clinic_id, date.toordinal()])
+
+    def refresh_date(self, date, clinic_ids=None):
+        """
+        Recompute the statistics for all clinics, or the given clinics, on
+        the given date.
+
+        Refreshes of the same clinic and date are run one at a time, so that
+        two of them cannot each delete the old rows and both insert new ones.
+        """
+        self._recompute(date, clinic_ids)
+        DataVersion.objects.bump(clinic_ids)
+
+    def _recompute(self, date, clinic_ids=None):
+        with transaction.atomic(using=self.db):
+            self._lock(date, clinic_ids)
+            self._refresh_date(date, clinic_ids)
+
+    def _refresh_date(self, date, clinic_ids=None):
+        start = timezone.make_aware(datetime.datetime.combine(date, datetime.time()), timezone.utc)
+        end = start + datetime.timedelta(days=1)
+        visits = Visit.objects.filter(
+            visit_time__gte=start, visit_time__lt=end, patient__clinic__isnull=False)
+        responses = SurveyQuestionResponse.objects.filter(
+            visit_time__gte=start, visit_time__lt=end, clinic__isnull=False)
+        existing = self.filter(date=date)
+        if clinic_ids is not None:
+            visits = visits.filter(patient__clinic__in=clinic_ids)
+            responses = responses.filter(clinic__in=clinic_ids)
+            existing = existing.filter(clinic__in=clinic_ids)
+
+        statistics = []
+        # As in the reports, only visits which were sent the survey count as
+        # having started or completed it.
+        qn = connections[self.db].ops.quote_name
+        if_sent = '= TRUE AND {0}.{1} IS NOT NULL'.format(
+            qn(Visit._meta.db_table), qn(Visit._meta.get_field('survey_sent').column))
+        visit_counts = visits.order_by().values('patient__clinic', 'service').annotate(
+            registered=Count('id'),
+            sent=CountIf('survey_sent', condition='IS NOT NULL'),
+            started=CountIf('survey_started', condition=if_sent),
+            completed=CountIf('survey_completed', condition=if_sent))
+        for counts in visit_counts:
+            statistics.append(self.model(
+                date=date, clinic_id=counts['patient__clinic'], service_id=counts['service'],
+                registered=counts['registered'], sent=counts['sent'],
+                started=counts['started'], completed=counts['completed']))
+
+        by_question = {}
+        response_counts = responses.order_by().values(
+            'clinic', 'service', 'question', 'question__question_type', 'response').annotate(
+            total=Count('id'), positive=CountIf('positive_response', condition='= TRUE'))
+        for counts in response_counts:
+            key = (counts['clinic'], counts['service'], counts['question'])
+            if key not in by_question:
+                by_question[key] = self.model(
+                    date=date, clinic_id=key[0], service_id=key[1], question_id=key[2])
+                by_question[key].category_counts = {}
+            statistic = by_question[key]
+            statistic.total += counts['total']
+            statistic.positive += counts['positive']
+            # Only tally the answers to multiple choice questions, since the
+            # answers to open-ended questions are nearly all different.
+            if counts['question__question_type'] == SurveyQuestion.MULTIPLE_CHOICE:
+                statistic.category_counts[counts['response']] = counts['total']
+        for statistic in by_question.values():
+            statistic.categories = json.dumps(statistic.category_counts)
+            statistics.append(statistic)
+
+        existing.delete()
+        self.bulk_create(statistics)
+
+    def rebuild(self, start_date=None, end_date=None):
+        """
+        Recompute the statistics for every day between start_date and
+        end_date (inclusive), which default to the days of the first and
+        last visits. Returns the number of days recomputed.
+        """
+        if not (start_date and end_date):
+            first = Visit.objects.order_by('visit_time').values_list('visit_time', flat=True)
+            last = Visit.objects.order_by('-visit_time').values_list('visit_time', flat=True)
+            if not first:
+                self.all().delete()
+                return 0
+            if not start_date:
+                start_date = get_date(first[0])
+                # There are no visits before the first one.
+                self.filter(date__lt=start_date).delete()
+            if not end_date:
+                end_date = get_date(last[0])
+                self.filter(date__gt=end_date).delete()
+
+        days = 0
+        date = start_date
+        while date <= end_date:
+            self._recompute(date)
+            date += datetime.timedelta(days=1)
+            days += 1
+        DataVersion.objects.bump()
+        return days
+
+
+class DailyStatistic(models.Model):
+    """Counts of the visits to a clinic, and responses about them, on a day.
+
+    Rows without a question hold the counts of visits for a service. Rows
+    with a question hold the counts of responses to that question from
+    patients who visited for a service. Visits and responses are counted
+    under the UTC date of the visit.
+
+    The rows for a clinic and day are recomputed whenever a visit or
+    response for that clinic and day is changed (see the signal handlers
+    below and DailyStatisticManager.refresh for bulk changes), and can be
+    rebuilt with the rebuild_statistics management command.
+    """
+    date = models.DateField(db_index=True)
+    clinic = models.ForeignKey('clinics.Clinic')
+    service = models.ForeignKey('clinics.Service', null=True, blank=True)
+    question = models.ForeignKey('survey.SurveyQuestion', null=True, blank=True)
+
+    # Counts of visits.
+    registered = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(
+        default=0, help_text="Visits for which the survey was sent.")
+    started = models.PositiveIntegerField(
+        default=0, help_text="Visits for which the survey was started.")
+    completed = models.PositiveIntegerField(
+        default=0, help_text="Visits for which the survey was completed.")
+
+    # Counts of responses.
+    total = models.PositiveIntegerField(default=0)
+    positive = models.PositiveIntegerField(default=0)
+    categories = models.TextField(
+        blank=True, help_text="JSON object of the number of responses of each category.")
+
+    objects = DailyStatisticManager()
+
+    class Meta:
+        unique_together = [('date', 'clinic', 'service', 'question')]
+
+    def __unicode__(self):
+        return u'{0} on {1}'.format(self.clinic, self.date)
+
+    def get_categories(self):
+        return json.loads(self.categories) if self.categories else {}
+
+
+class DataVersionManager(models.Manager):
+
+    def bump(self, clinic_ids=None):
+        """Increment the versions of the LGAs of the given clinics, or of
+        every LGA."""
+        clinics = Clinic.objects.all()
+        if clinic_ids is not None:
+            clinics = clinics.filter(pk__in=clinic_ids)
+        lga_ids = set(clinics.values_list('lga', flat=True)) - set([None])
+        if not lga_ids:
+            return
+        with transaction.atomic():
+            versions = self.filter(lga__in=lga_ids)
+            versions.update(version=F('version') + 1)
+            missing = lga_ids - set(versions.values_list('lga', flat=True))
+            try:
+                with transaction.atomic():
+                    self.bulk_create([self.model(lga_id=lga_id, version=1) for lga_id in missing])
+            except IntegrityError:
+                # Another process created some of them first.
+                self.filter(lga__in=missing).update(version=F('version') + 1)
+
+    def get_version(self, lga):
+        """The current version of the data about the LGA's clinics."""
+        versions = self.filter(lga=lga).values_list('version', flat=True)
+        return versions[0] if versions else 0
+
+
+class DataVersion(models.Model):
+    """A number which is incremented whenever the data reported about the
+    clinics in an LGA changes, so that anything derived from it, such as
+    a stored report, can tell whether it is out of date."""
+    lga = models.OneToOneField('clinics.LGA')
+    version = models.PositiveIntegerField(default=0)
+
+    objects = DataVersionManager()
+
+    def __unicode__(self):
+        return u'{0} version {1}'.format(self.lga, self.version)
+
+
+class ProgressToDateManager(models.Manager):
+
+    def refresh(self):
+        """Recount the progress to date, returning the saved row."""
+        visits = Visit.objects.aggregate(
+            staff=Count('sender', distinct=True),
+            mobiles=Count('mobile', distinct=True),
+            started=CountIf('survey_started', condition='= TRUE'))
+        lgas = set()
+        facilities = Counter()
+        for row in Clinic.objects.values('lga', 'type').annotate(facilities=Count('id')):
+            lgas.add(row['lga'])
+            facilities[row['type']] += row['facilities']
+        # There is only ever one row.
+        progress = self.model(
+            pk=1, staff=visits['staff'], primary_facilities=facilities['primary'],
+            general_hospitals=facilities['general'], lgas=len(lgas),
+            patients=Patient.objects.count(), mobiles=visits['mobiles'],
+            started=visits['started'])
+        progress.save()
+        return progress
+
+    def get_current(self):
+        """The last counts of the progress to date, counting them if needed."""
+        return self.filter(pk=1).first() or self.refresh()
+
+
+class ProgressToDate(models.Model):
+    """The headline counts of the home page, which are too slow to count on
+    every request, so are recounted periodically by a Celery task.
+
+    Since patients are registered by clinic staff, the number of unique
+    senders of visits is used as the number of staff.
+    """
+    staff = models.PositiveIntegerField(default=0)
+    primary_facilities = models.PositiveIntegerField(default=0)
+    general_hospitals = models.PositiveIntegerField(default=0)
+    lgas = models.PositiveIntegerField(default=0)
+    patients = models.PositiveIntegerField(default=0)
+    mobiles = models.PositiveIntegerField(
+        default=0, help_text="Number of mobile numbers with a registered visit.")
+    started = models.PositiveIntegerField(
+        default=0, help_text="Visits for which the survey was started.")
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = ProgressToDateManager()
+
+    class Meta:
+        verbose_name_plural = 'progress to date'
+
+    def __unicode__(self):
+        return u'Progress to {0}'.format(self.updated)
+
+
+def _get_clinic_id(patient_id):
+    return Patient.objects.filter(pk=patient_id).values_list('clinic', flat=True).first()
+
+
+@receiver(post_init, sender=Visit)
+def remember_visit_statistics(sender, instance, **kwargs):
+    instance._statistics_origin = (instance.patient_id, instance.visit_time)
+
+
+@receiver(post_save, sender=Visit)
+@receiver(post_delete, sender=Visit)
+def refresh_visit_statistics(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    slices = set([(_get_clinic_id(instance.patient_id), get_date(instance.visit_time))])
+    origin = getattr(instance, '_statistics_origin', None)
+    if origin and origin[0] and origin != (instance.patient_id, instance.visit_time):
+        slices.add((_get_clinic_id(origin[0]), get_date(origin[1])))
+    DailyStatistic.objects.refresh(slices)
+    instance._statistics_origin = (instance.patient_id, instance.visit_time)
+
+
+@receiver(post_init, sender=SurveyQuestionResponse)
+def remember_response_statistics(sender, instance, **kwargs):
+    instance._statistics_origin = (instance.clinic_id, instance.visit_id)
+
+
+@receiver(post_save, sender=SurveyQuestionResponse)
+@receiver(post_delete, sender=SurveyQuestionResponse)
+def refresh_response_statistics(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    slices = set()
+    origin = getattr(instance, '_statistics_origin', None)
+    if origin and origin[1] and origin != (instance.clinic_id, instance.visit_id):
+        visit_times = Visit.objects.filter(pk=origin[1]).values_list('visit_time', flat=True)
+        slices.add((origin[0], get_date(visit_times.first())))
+    try:
+        visit = instance.visit
+    except ObjectDoesNotExist:
+        visit = None
+    if visit is not None:
+        slices.add((instance.clinic_id, get_date(visit.visit_time)))
+    DailyStatistic.objects.refresh(slices)
+    instance._statistics_origin = (instance.clinic_id, instance.visit_id)
+
+
+@receiver(post_save, sender=Clinic)
+@receiver(post_delete, sender=Clinic)
+def bump_clinic_version(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    # A clinic which has moved LGA changes the reports of both LGAs.
+    DataVersion.objects.bump()
+
+
+@receiver(post_save, sender=ClinicScore)
+@receiver(post_delete, sender=ClinicScore)
+@receiver(post_save, sender=GenericFeedback)
+@receiver(post_delete, sender=GenericFeedback)
+def bump_feedback_version(sender, instance, **kwargs):
+    if kwargs.get('raw') or instance.clinic_id is None:
+        return
+    DataVersion.objects.bump([instance.clinic_id])
+
+
+@receiver(post_save, sender=SurveyQuestion)
+@receiver(post_delete, sender=SurveyQuestion)
+def bump_question_version(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    DataVersion.objects.bump()
@@ -0,0 +1,9 @@
+from celery.task import task
+
+from .models import ProgressToDate
+
+
+@task
+def refresh_progress_to_date():
+    """Recount the progress to date shown on the home page."""
+    ProgressToDate.objects.refresh()
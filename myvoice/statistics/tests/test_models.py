@@ -0,0 +1,195 @@
+import datetime
+
+import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from myvoice.clinics.models import Visit
+from myvoice.core.tests import factories
+from myvoice.survey.models import SurveyQuestion
+
+from ..models import DailyStatistic, DataVersion, ProgressToDate
+
+
+class TestDailyStatistic(TestCase):
+
+    def aware(self, *args):
+        return timezone.make_aware(timezone.datetime(*args), timezone.utc)
+
+    def setUp(self):
+        self.clinic = factories.Clinic()
+        self.service = factories.Service()
+        self.patient = factories.Patient(clinic=self.clinic)
+        self.question = factories.SurveyQuestion(
+            question_type=SurveyQuestion.MULTIPLE_CHOICE, categories='Yes\nNo')
+
+    def make_visit(self, visit_time, **kwargs):
+        return factories.Visit(
+            patient=self.patient, service=self.service, visit_time=visit_time, **kwargs)
+
+    def test_visit_counts(self):
+        """Saving visits should update the counts for their clinic and day."""
+        self.make_visit(self.aware(2014, 7, 21, 9), survey_sent=self.aware(2014, 7, 21, 10))
+        self.make_visit(self.aware(2014, 7, 21, 11), survey_sent=self.aware(2014, 7, 21, 12),
+                        survey_started=True, survey_completed=True)
+        self.make_visit(self.aware(2014, 7, 22, 9))
+        statistic = DailyStatistic.objects.for_visits().get(date=datetime.date(2014, 7, 21))
+        self.assertEqual(statistic.clinic, self.clinic)
+        self.assertEqual(statistic.service, self.service)
+        self.assertEqual(
+            (statistic.registered, statistic.sent, statistic.started, statistic.completed),
+            (2, 2, 1, 1))
+        statistic = DailyStatistic.objects.for_visits().get(date=datetime.date(2014, 7, 22))
+        self.assertEqual((statistic.registered, statistic.sent), (1, 0))
+
+    def test_unsent_visit(self):
+        """A visit which was never sent the survey should not count as started."""
+        self.make_visit(self.aware(2014, 7, 21, 9), survey_started=True)
+        statistic = DailyStatistic.objects.for_visits().get()
+        self.assertEqual((statistic.registered, statistic.started), (1, 0))
+
+    def test_moved_visit(self):
+        """A visit moved to another day should be removed from the old day's counts."""
+        visit = self.make_visit(self.aware(2014, 7, 21, 9))
+        visit = Visit.objects.get(pk=visit.pk)
+        visit.visit_time = self.aware(2014, 7, 23, 9)
+        visit.save()
+        dates = DailyStatistic.objects.for_visits().values_list('date', flat=True)
+        self.assertEqual(list(dates), [datetime.date(2014, 7, 23)])
+
+    def test_deleted_visit(self):
+        """Deleting a visit should remove it from the counts."""
+        visit = self.make_visit(self.aware(2014, 7, 21, 9))
+        visit.delete()
+        self.assertFalse(DailyStatistic.objects.exists())
+
+    def test_response_counts(self):
+        """Saving responses should update the counts for their question."""
+        for response in ('Yes', 'Yes', 'No'):
+            visit = self.make_visit(self.aware(2014, 7, 21, 9))
+            factories.SurveyQuestionResponse(
+                question=self.question, response=response, visit=visit)
+        statistic = DailyStatistic.objects.for_responses().get()
+        self.assertEqual(statistic.question, self.question)
+        self.assertEqual(statistic.date, datetime.date(2014, 7, 21))
+        self.assertEqual((statistic.total, statistic.positive), (3, 2))
+        self.assertEqual(statistic.get_categories(), {'Yes': 2, 'No': 1})
+
+    def test_open_ended_categories(self):
+        """The answers to open-ended questions should not be tallied."""
+        question = factories.SurveyQuestion(question_type=SurveyQuestion.OPEN_ENDED)
+        visit = self.make_visit(self.aware(2014, 7, 21, 9))
+        factories.SurveyQuestionResponse(question=question, response='Fine', visit=visit)
+        statistic = DailyStatistic.objects.for_responses().get()
+        self.assertEqual(statistic.total, 1)
+        self.assertEqual(statistic.get_categories(), {})
+
+    def test_date_range(self):
+        """Statistics should be filtered by the UTC dates of the times given."""
+        for day in (20, 21, 22, 23):
+            self.make_visit(self.aware(2014, 7, day, 9))
+        stats = DailyStatistic.objects.for_visits(
+            self.aware(2014, 7, 21), self.aware(2014, 7, 22, 23, 59))
+        self.assertEqual(
+            sorted(stats.values_list('date', flat=True)),
+            [datetime.date(2014, 7, 21), datetime.date(2014, 7, 22)])
+
+    def test_exclusive_end(self):
+        """An end date at midnight should not include the day which starts then."""
+        for day in (27, 28):
+            self.make_visit(self.aware(2014, 7, day, 9))
+        stats = DailyStatistic.objects.for_visits(self.aware(2014, 7, 21), self.aware(2014, 7, 28))
+        self.assertEqual(list(stats.values_list('date', flat=True)), [datetime.date(2014, 7, 27)])
+        stats = DailyStatistic.objects.for_visits(
+            datetime.date(2014, 7, 21), datetime.date(2014, 7, 28))
+        self.assertEqual(stats.count(), 2)
+
+    def test_deferred(self):
+        """Each clinic and day should be recomputed once at the end of a deferred block."""
+        with mock.patch.object(DailyStatistic.objects, '_recompute') as recompute:
+            with DailyStatistic.objects.deferred():
+                self.make_visit(self.aware(2014, 7, 21, 9))
+                self.make_visit(self.aware(2014, 7, 21, 11))
+                self.make_visit(self.aware(2014, 7, 22, 9))
+                self.assertEqual(recompute.call_count, 0)
+        self.assertEqual(
+            sorted(recompute.call_args_list),
+            [mock.call(datetime.date(2014, 7, 21), set([self.clinic.pk])),
+             mock.call(datetime.date(2014, 7, 22), set([self.clinic.pk]))])
+
+    def test_response_refreshed_once(self):
+        """Saving a response should recompute its clinic and day once, not
+        once for the visit and again for the response."""
+        visit = self.make_visit(self.aware(2014, 7, 21, 9))
+        with mock.patch.object(DailyStatistic.objects, '_recompute') as recompute:
+            factories.SurveyQuestionResponse(question=self.question, response='Yes', visit=visit)
+        self.assertEqual(recompute.call_count, 1)
+
+    def test_rebuild(self):
+        """Rebuilding should recompute statistics missed by bulk updates."""
+        visit = self.make_visit(self.aware(2014, 7, 21, 9))
+        self.make_visit(self.aware(2014, 7, 23, 9))
+        Visit.objects.filter(pk=visit.pk).update(survey_sent=self.aware(2014, 7, 21, 10))
+        DailyStatistic.objects.create(date=datetime.date(2014, 7, 30), clinic=self.clinic)
+        self.assertEqual(DailyStatistic.objects.rebuild(), 3)
+        self.assertEqual(
+            list(DailyStatistic.objects.order_by('date').values_list('date', 'sent')),
+            [(datetime.date(2014, 7, 21), 1), (datetime.date(2014, 7, 23), 0)])
+
+
+class TestDataVersion(TestCase):
+
+    def setUp(self):
+        self.clinic = factories.Clinic()
+        self.other = factories.Clinic()
+
+    def test_bump(self):
+        """Versions should only be incremented for the LGAs of the given clinics."""
+        version = DataVersion.objects.get_version(self.clinic.lga)
+        other_version = DataVersion.objects.get_version(self.other.lga)
+        DataVersion.objects.bump([self.clinic.pk])
+        DataVersion.objects.bump([self.clinic.pk])
+        self.assertEqual(version + 2, DataVersion.objects.get_version(self.clinic.lga))
+        self.assertEqual(other_version, DataVersion.objects.get_version(self.other.lga))
+
+    def test_data_changes(self):
+        """Changes to the data reported about a clinic should bump its LGA's version."""
+        version = DataVersion.objects.get_version(self.clinic.lga)
+        factories.Visit(patient__clinic=self.clinic)
+        self.assertTrue(DataVersion.objects.get_version(self.clinic.lga) > version)
+        version = DataVersion.objects.get_version(self.clinic.lga)
+        factories.GenericFeedback(clinic=self.clinic)
+        self.assertTrue(DataVersion.objects.get_version(self.clinic.lga) > version)
+
+
+class TestProgressToDate(TestCase):
+
+    def setUp(self):
+        self.clinic = factories.Clinic(type='primary')
+        factories.Clinic(type='general', lga=self.clinic.lga)
+        factories.Visit(patient__clinic=self.clinic, sender='1', mobile='1',
+                        survey_started=True)
+        factories.Visit(patient__clinic=self.clinic, sender='1', mobile='2')
+        factories.Visit(patient__clinic=self.clinic, sender='2', mobile='2',
+                        survey_started=True)
+
+    def test_refresh(self):
+        """The progress to date should be counted from the visits and clinics."""
+        progress = ProgressToDate.objects.refresh()
+        self.assertEqual(
+            (2, 1, 1, 1, 3, 2, 2),
+            (progress.staff, progress.primary_facilities, progress.general_hospitals,
+             progress.lgas, progress.patients, progress.mobiles, progress.started))
+        factories.Visit(patient__clinic=self.clinic, sender='3', mobile='3')
+        progress = ProgressToDate.objects.refresh()
+        self.assertEqual((3, 4), (progress.staff, progress.patients))
+        self.assertEqual(1, ProgressToDate.objects.count())
+
+    def test_get_current(self):
+        """The last counts should be returned without counting again."""
+        ProgressToDate.objects.get_current()
+        factories.Visit(patient__clinic=self.clinic, sender='3', mobile='3')
+        with self.assertNumQueries(1):
+            progress = ProgressToDate.objects.get_current()
+        self.assertEqual(2, progress.staff)
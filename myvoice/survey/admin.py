@@ -1,12 +1,9 @@
-import csv
-
 from django.contrib import admin
-from django.http import HttpResponse
 
 from . import importer
 from . import models
 
-from myvoice.core.utils import extract_qset_data
+from myvoice.core.admin import CSVExportMixin
 
 
 class SurveyQuestionInline(admin.TabularInline):
@@ -45,7 +42,7 @@ class SurveyAdmin(admin.ModelAdmin):
             'fields': ['flow_id', 'role'],
         }),
     ]
-    fields = ['flow_id', 'name', 'role', 'active']
+    fields = ['flow_id', 'name', 'role', 'active', 'last_run_modified']
     list_display = ['name', 'flow_id', 'role', 'active']
     list_filter = ['active']
     save_on_top = True
@@ -57,7 +54,7 @@ class SurveyAdmin(admin.ModelAdmin):
 
     def change_view(self, *args, **kwargs):
         self.inlines = [SurveyQuestionInline]
-        self.readonly_fields = ['flow_id']
+        self.readonly_fields = ['flow_id', 'last_run_modified']
         return super(SurveyAdmin, self).change_view(*args, **kwargs)
 
     def get_fieldsets(self, request, obj=None):
@@ -86,7 +83,7 @@ class SurveyQuestionAdmin(admin.ModelAdmin):
                     'last_required', 'question']
 
 
-class SurveyQuestionResponseAdmin(admin.ModelAdmin):
+class SurveyQuestionResponseAdmin(CSVExportMixin, admin.ModelAdmin):
 
     fieldsets = [
         (None, {
@@ -105,7 +102,11 @@ class SurveyQuestionResponseAdmin(admin.ModelAdmin):
     list_select_related = True
     ordering = ['-visit', 'question']
     search_fields = ['visit__mobile', 'response', 'question__label']
-    actions = ['export_to_csv']
+    actions = ['export_to_csv', 'export_in_background']
+    export_name = 'response_data'
+    export_fields = ['visit.mobile', 'visit.visit_time', 'clinic', 'service',
+                     'question.survey', 'question', 'question.get_question_type_display',
+                     'response', 'datetime', 'visit.patient.serial']
 
     def change_view(self, request, *args, **kwargs):
         """
@@ -140,18 +141,6 @@ class SurveyQuestionResponseAdmin(admin.ModelAdmin):
     def mobile(self, obj):
         return obj.visit.mobile
 
-    def export_to_csv(self, request, queryset):
-        headers = ['visit.mobile', 'visit.visit_time', 'clinic', 'service',
-                   'question.survey', 'question', 'question.get_question_type_display',
-                   'response', 'datetime', 'visit.patient.serial']
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename=response_data.csv'
-        data = extract_qset_data(queryset, headers)
-        writer = csv.writer(response)
-        for line in data:
-            writer.writerow(line)
-        return response
-
 
 admin.site.register(models.Survey, SurveyAdmin)
 admin.site.register(models.DisplayLabel, DisplayLabelAdmin)
@@ -1,8 +1,17 @@
+from bisect import bisect_right
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+import datetime
 import logging
+import uuid
 
 import dateutil.parser
 
+from django.conf import settings
+from django.core.cache import cache
+
 from myvoice.clinics.models import Visit
+from myvoice.statistics.models import DailyStatistic
 
 from . import utils as survey_utils
 from .models import Survey, SurveyQuestion, SurveyQuestionResponse
@@ -11,6 +20,9 @@ from .textit import TextItApi
 
 logger = logging.getLogger(__file__)
 
+# Maximum number of values to use in a single IN query.
+QUERY_CHUNK_SIZE = 500
+
 
 def import_survey(flow_id, role=None):
     """
@@ -107,28 +119,79 @@ def import_survey(flow_id, role=None):
     return survey
 
 
-def import_responses(flow_id):
+def _chunks(items, size=QUERY_CHUNK_SIZE):
+    """Split items into lists of at most size items."""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class VisitMatcher(object):
     """
-    Retrieves all runs through the flow with the given ID, and stores each
-    value in the run as a SurveyQuestionResponse object.
+    Associates answers with the visit they are about: the most recent visit
+    registered for the answering phone number before the answer was received.
 
-    Existing responses will only be overwritten if there is a more recent
-    value.
+    Candidate visits for all phone numbers are loaded up front, and the
+    closest earlier visit for each answer is found in memory.
     """
-    try:
-        survey = Survey.objects.get(flow_id=flow_id)
-    except Survey.DoesNotExist:
-        raise Exception("There is no survey for flow_id {0}".format(flow_id))
 
-    questions = dict([(q.label, q) for q in survey.surveyquestion_set.all()])
+    def __init__(self, phones, latest):
+        self.visits = defaultdict(list)
+        for chunk in _chunks(phones):
+            visits = Visit.objects.filter(mobile__in=chunk, visit_time__lte=latest)
+            visits = visits.select_related('patient').order_by('visit_time')
+            for visit in visits:
+                self.visits[visit.mobile].append(visit)
+        self.visit_times = dict(
+            (phone, [v.visit_time for v in visits])
+            for phone, visits in self.visits.iteritems())
+
+    def match(self, phone, response_time):
+        """Return the visit closest in time before response_time, if any."""
+        visit_times = self.visit_times.get(phone)
+        if not visit_times:
+            return None
+        index = bisect_right(visit_times, response_time)
+        return self.visits[phone][index - 1] if index else None
+
+
+def _get_existing_responses(visits, questions):
+    """Map (visit id, question id) to the stored response for each pair."""
+    responses = {}
+    visit_ids = set(v.pk for v in visits)
+    for chunk in _chunks(visit_ids):
+        existing = SurveyQuestionResponse.objects.filter(
+            visit__in=chunk, question__in=questions)
+        for response in existing:
+            responses[(response.visit_id, response.question_id)] = response
+    return responses
 
-    runs = TextItApi().get_runs_for_flow(flow_id)
+
+def _import_runs(flow_id, questions, runs):
+    """
+    Stores the answers in the given runs as SurveyQuestionResponse objects.
+
+    Returns the most recent modification time of the runs, if any, the
+    number of responses saved, and the earliest modification time of the
+    runs with a response which could not be saved, if any.
+    """
+    last_run_modified = None
+    # Modification time of each run, by run identity.
+    run_times = {}
+    answers = []
     for rrun in runs:
+        if rrun.get('modified_on'):
+            run_modified = dateutil.parser.parse(rrun['modified_on'])
+            run_times[id(rrun)] = run_modified
+            if last_run_modified is None or run_modified > last_run_modified:
+                last_run_modified = run_modified
+
+        local_phone = survey_utils.convert_to_local_format(rrun['phone'])
+
         # A run through a flow can have anywhere from 0 to N answers, where N
         # is the number of questions associated with the survey.
         for answer in rrun['values']:
             label = answer['label']
-            local_phone = survey_utils.convert_to_local_format(rrun['phone'])
             response_time = dateutil.parser.parse(answer['time'])
 
             # Only process answers for questions we know about.
@@ -144,57 +207,168 @@ def import_responses(flow_id):
                              "the survey.")
                 continue
 
-            # Find visits we've registered for this phone number that
-            # were registered before this response was received.
-            visits = Visit.objects.filter(mobile=local_phone)
-            visits = visits.filter(visit_time__lte=response_time)
-            visits = visits.order_by('-visit_time')
-            try:
-                # Choose the visit closest in time to this response.
-                visit = visits[0]
-            except IndexError:
-                logger.debug("Discarding answer because we cannot determine "
-                             "which visit it should be associated with.")
+            answers.append((rrun, answer, local_phone, response_time))
+
+    if not answers:
+        return last_run_modified, 0, None
+
+    # Load every visit that an answer could belong to, then find the visit
+    # closest in time before each answer.
+    phones = set(local_phone for _, _, local_phone, _ in answers if local_phone)
+    latest = max(response_time for _, _, _, response_time in answers)
+    matcher = VisitMatcher(phones, latest)
+
+    matched = []
+    for rrun, answer, local_phone, response_time in answers:
+        visit = matcher.match(local_phone, response_time)
+        if visit is None:
+            logger.debug("Discarding answer because we cannot determine "
+                         "which visit it should be associated with.")
+            continue
+        matched.append((rrun, answer, local_phone, response_time, visit))
+
+    responses = _get_existing_responses(
+        [m[-1] for m in matched], questions.values())
+
+    # Responses to save, in order, with details for error messages.
+    pending = OrderedDict()
+
+    for rrun, answer, local_phone, response_time, visit in matched:
+        question = questions[answer['label']]
+
+        # Determine whether we've seen this response before (or another
+        # response to the same question).
+        response = responses.get((visit.pk, question.pk))
+        if response is None:
+            # Create a new object - this is the first answer we've seen to
+            # this question.
+            response = SurveyQuestionResponse(visit=visit, question=question)
+            responses[(visit.pk, question.pk)] = response
+        else:
+            # The user has already answered this question. Either we've
+            # imported this answer before, or the user has answered the
+            # question more than once (as would happen if the user gives
+            # an unintelligible answer and the question is re-asked).
+            # We'll keep the most recent answer.
+            if response_time <= response.datetime:
+                logger.debug("Discarding answer because we have a more "
+                             "recent answer to the same question already "
+                             "in the database.")
                 continue
+            response.visit = visit
 
-            # Determine whether we've seen this response before (or another
-            # response to the same question).
-            try:
-                response = SurveyQuestionResponse.objects.get(
-                    visit=visit, question=questions.get(label))
-            except SurveyQuestionResponse.DoesNotExist:
-                # Create a new object - this is the first answer we've seen to
-                # this question.
-                response = SurveyQuestionResponse(
-                    visit=visit, question=questions.get(label))
-            else:
-                # The user has already answered this question. Either we've
-                # imported this answer before, or the user has answered the
-                # question more than once (as would happen if the user gives
-                # an unintelligible answer and the question is re-asked).
-                # We'll keep the most recent answer.
-                if response_time <= response.datetime:
-                    logger.debug("Discarding answer because we have a more "
-                                 "recent answer to the same question already "
-                                 "in the database.")
-                    continue
-
-            if answer['category'].lower() in ('other', 'all responses'):
-                # 'category' is the normalized answer to this question.
-                # Most often 'other' and 'all responses' signify that this
-                # is an open-ended question, but it is used with multiple
-                # choice questions too. Either way, the raw answer will be
-                # much more useful than the normalized answer.
-                value = answer['value']
-            else:
-                value = answer['category']  # Normalized response.
-
-            response.response = value
-            response.datetime = response_time
+        if answer['category'].lower() in ('other', 'all responses'):
+            # 'category' is the normalized answer to this question.
+            # Most often 'other' and 'all responses' signify that this
+            # is an open-ended question, but it is used with multiple
+            # choice questions too. Either way, the raw answer will be
+            # much more useful than the normalized answer.
+            value = answer['value']
+        else:
+            value = answer['category']  # Normalized response.
+
+        response.response = value
+        response.datetime = response_time
+        # Unsaved model instances compare equal, so key them by identity.
+        if id(response) not in pending:
+            pending[id(response)] = (response, (local_phone, rrun, answer))
 
+    saved = len(pending)
+    failed_modified = None
+    try:
+        SurveyQuestionResponse.objects.bulk_upsert([r for r, _ in pending.values()])
+    except:  # Blanket exception in case anything goes wrong.
+        # Fall back to saving responses one by one, so that a single bad
+        # answer doesn't prevent the others from being saved.
+        logger.exception("Unable to save responses in bulk.")
+        for response, msg_args in pending.values():
             try:
                 response.save()
-            except:  # Blanket exception in case anything goes wrong.
-                msg_args = (local_phone, rrun['run'], answer)
+            except:
+                saved -= 1
+                local_phone, rrun, answer = msg_args
                 msg = "Unable to save response from {} in run {}: {}"
-                logger.exception(msg.format(*msg_args))
+                logger.exception(msg.format(local_phone, rrun['run'], answer))
+                run_modified = run_times.get(id(rrun))
+                if run_modified and (failed_modified is None or
+                                     run_modified < failed_modified):
+                    failed_modified = run_modified
+
+    # Saving in bulk bypasses the signals which keep the report statistics
+    # up to date.
+    DailyStatistic.objects.refresh(
+        (r.clinic_id, r.visit.visit_time) for r, _ in pending.values())
+
+    return last_run_modified, saved, failed_modified
+
+
+@contextmanager
+def import_lock(flow_id):
+    """
+    Holds a lock in the cache while responses for a flow are imported, and
+    yields whether it was acquired. Another import of the flow, by a task or
+    the import_responses command, should be skipped rather than importing
+    the same runs twice.
+    """
+    key = 'import-survey-responses-{0}'.format(flow_id)
+    token = uuid.uuid4().hex
+    acquired = cache.add(key, token, settings.SURVEY_IMPORT_LOCK_TIMEOUT)
+    try:
+        yield acquired
+    finally:
+        # If this import outlived the lock, it may now belong to another one.
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
+
+
+def import_responses(flow_id, full=False):
+    """
+    Retrieves runs through the flow with the given ID, and stores each
+    value in the run as a SurveyQuestionResponse object. Runs are saved a
+    page at a time, as they are retrieved from TextIt.
+
+    Only runs which were modified since the last import are retrieved,
+    unless full is True, in which case every run in the flow is
+    re-imported.
+
+    Existing responses will only be overwritten if there is a more recent
+    value.
+
+    Returns the number of responses which were saved.
+    """
+    try:
+        survey = Survey.objects.get(flow_id=flow_id)
+    except Survey.DoesNotExist:
+        raise Exception("There is no survey for flow_id {0}".format(flow_id))
+
+    questions = dict([(q.label, q) for q in survey.surveyquestion_set.all()])
+
+    # Runs are processed and saved one page at a time as they are retrieved.
+    after = None if full else survey.last_run_modified
+    last_run_modified = survey.last_run_modified
+    failed_modified = None
+    saved = 0
+    api = TextItApi()
+    # A clinic's statistics for a day are only recomputed once per import,
+    # however many pages have responses for it.
+    with DailyStatistic.objects.deferred():
+        for runs in api.iter_runs_for_flow(flow_id, after=after):
+            run_modified, page_saved, page_failed = _import_runs(flow_id, questions, runs)
+            saved += page_saved
+            if run_modified and (last_run_modified is None or
+                                 run_modified > last_run_modified):
+                last_run_modified = run_modified
+            if page_failed and (failed_modified is None or page_failed < failed_modified):
+                failed_modified = page_failed
+
+    api.client.log_latency()
+
+    # Stop the high-water mark just before the first run with a response
+    # which could not be saved, so that the next import retrieves it again.
+    if failed_modified is not None:
+        last_run_modified = failed_modified - datetime.timedelta(microseconds=1)
+    # Only move the high-water mark once every page has been processed, so
+    # that an interrupted import is picked up again by the next one.
+    if last_run_modified != survey.last_run_modified:
+        Survey.objects.filter(pk=survey.pk).update(last_run_modified=last_run_modified)
+    return saved
@@ -1,9 +1,23 @@
-from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
 
 from ... import importer
 
 
 class Command(BaseCommand):
+    args = '<flow_id>'
+    help = "Import new responses for a TextIt flow."
+    option_list = BaseCommand.option_list + (
+        make_option('--full', action='store_true', dest='full', default=False,
+                    help="Re-import every run in the flow, not only those "
+                         "modified since the last import."),
+    )
 
     def handle(self, flow_id, **options):
-        importer.import_responses(flow_id)
+        # Share the lock of the periodic import, so the two never overlap.
+        with importer.import_lock(flow_id) as acquired:
+            if not acquired:
+                raise CommandError(
+                    "Responses for flow {0} are already being imported.".format(flow_id))
+            importer.import_responses(flow_id, full=options['full'])
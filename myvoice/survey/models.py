@@ -1,6 +1,11 @@
+from collections import defaultdict
 import datetime
 
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from myvoice.clinics.models import Visit
 
 
 class SurveyQuerySet(models.query.QuerySet):
@@ -39,6 +44,10 @@ class Survey(models.Model):
     role = models.CharField(
         unique=True, max_length=32, null=True, blank=True,
         choices=SURVEY_ROLES, help_text="If given, must be unique.")
+    last_run_modified = models.DateTimeField(
+        null=True, blank=True,
+        help_text="Modification time of the most recent run imported from "
+        "TextIt. Only runs modified after this time are fetched on import.")
 
     objects = SurveyManager()
 
@@ -158,6 +167,89 @@ class SurveyQuestion(models.Model):
             return self.label
 
 
+class SurveyQuestionResponseManager(models.Manager):
+
+    def bulk_upsert(self, responses):
+        """Save a batch of responses without calling save() on each one.
+
+        The same de-normalised fields are set as by
+        SurveyQuestionResponse.save(), but new responses are inserted with a
+        single bulk_create, existing ones with a single UPDATE per batch, and
+        each affected Visit is only updated once.
+        Responses are processed in order, so the result is the same as saving
+        each of them in turn.
+
+        Note that, as with bulk_create, new responses do not get a primary key.
+        """
+        visits = {}
+        new_responses = []
+        old_responses = []
+        seen = set()
+        for response in responses:
+            if id(response) in seen:
+                continue
+            seen.add(id(response))
+            if response.visit_id is not None:
+                # Share one instance per visit so that changes accumulate.
+                response.visit = visits.setdefault(response.visit_id, response.visit)
+            response.set_denormalized_fields()
+            if response.visit:
+                response.update_visit()
+            if response.pk is None:
+                new_responses.append(response)
+            else:
+                old_responses.append(response)
+
+        # Visits which end up with the same values are updated together.
+        visit_updates = defaultdict(list)
+        for visit in visits.values():
+            values = (visit.satisfied, visit.survey_started, visit.survey_completed)
+            visit_updates[values].append(visit.pk)
+
+        with transaction.atomic(using=self.db):
+            self._bulk_update(old_responses)
+            self.bulk_create(new_responses)
+            for (satisfied, started, completed), pks in visit_updates.iteritems():
+                Visit.objects.filter(pk__in=pks).update(
+                    satisfied=satisfied, survey_started=started,
+                    survey_completed=completed)
+
+    def _bulk_update(self, responses, batch_size=500):
+        """Write all fields but created of saved responses, with one
+        UPDATE ... FROM (VALUES ...) statement per batch on PostgreSQL."""
+        fields = [f for f in self.model._meta.local_concrete_fields
+                  if not f.primary_key and f.name != 'created']
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            for response in responses:
+                values = dict((f.name, f.pre_save(response, False)) for f in fields)
+                self.filter(pk=response.pk).update(**values)
+            return
+
+        qn = connection.ops.quote_name
+        pk = self.model._meta.pk
+        table = qn(self.model._meta.db_table)
+        # Parameters are untyped, so each value is cast to its column's type
+        # (the id column is a serial, which is not a type that can be cast to).
+        types = [models.IntegerField().db_type(connection)]
+        types.extend(f.db_type(connection) for f in fields)
+        placeholder = '({0})'.format(', '.join('CAST(%s AS {0})'.format(t) for t in types))
+        sql = 'UPDATE {table} SET {set} FROM (VALUES {{values}}) AS v ({columns}) ' \
+              'WHERE {table}.{pk} = v.{pk}'.format(
+                  table=table, pk=qn(pk.column),
+                  set=', '.join('{0} = v.{0}'.format(qn(f.column)) for f in fields),
+                  columns=', '.join(qn(f.column) for f in [pk] + fields))
+        cursor = connection.cursor()
+        for start in range(0, len(responses), batch_size):
+            batch = responses[start:start + batch_size]
+            params = []
+            for response in batch:
+                params.append(response.pk)
+                params.extend(f.get_db_prep_save(f.pre_save(response, False), connection)
+                              for f in fields)
+            cursor.execute(sql.format(values=', '.join([placeholder] * len(batch))), params)
+
+
 class SurveyQuestionResponse(models.Model):
     """An answer to a survey question."""
 
@@ -180,6 +272,9 @@ class SurveyQuestionResponse(models.Model):
     service = models.ForeignKey(
         'clinics.Service', null=True, blank=True,
         help_text="The service this response is about, if any.")
+    visit_time = models.DateTimeField(
+        null=True, blank=True, db_index=True,
+        help_text="When the visit this response is about took place, if any.")
 
     display_on_dashboard = models.BooleanField(
         default=True,
@@ -194,20 +289,23 @@ class SurveyQuestionResponse(models.Model):
     class Meta:
         verbose_name = 'Response'
         unique_together = [('visit', 'question')]
+        index_together = [('clinic', 'question', 'datetime'), ('clinic', 'visit_time')]
         permissions = [
             ('change_response_text', 'Can change response text'),
         ]
 
+    objects = SurveyQuestionResponseManager()
+
     def __unicode__(self):
         return self.response
 
-    def save(self, *args, **kwargs):
-        """Set the associated clinic and service.
-        Also set various de-normalising variables on Visit
-        and SurveyQuestionResponse."""
-        self.clinic_id = self.service_id = None
+    def set_denormalized_fields(self):
+        """Set the associated clinic, service and visit time, and whether
+        the response is positive."""
+        self.clinic_id = self.service_id = self.visit_time = None
         if self.visit:
             self.service_id = self.visit.service_id
+            self.visit_time = self.visit.visit_time
             if self.visit.patient:
                 self.clinic_id = self.visit.patient.clinic_id
 
@@ -221,32 +319,56 @@ class SurveyQuestionResponse(models.Model):
                 if self.response == categories[0]:
                     self.positive_response = True
 
+    def update_visit(self):
+        """Set the de-normalising variables on the associated Visit.
+
+        The Visit is not saved."""
         # Find patient satisfaction for the visit
 
         # Visit.satisfied can be changed from True to False
         # But if False, cannot be changed again.
-        if self.visit:
-            # Find patient satisfaction for the visit
-
-            # Visit.satisfied can be changed from True to False
-            # But if False, cannot be changed again.
-            if self.visit.satisfied is False:
-                pass  # Already calculated, ignore.
-            else:
-                if self.question.for_satisfaction:
-                    if self.positive_response:
-                        self.visit.satisfied = True
-                    else:
-                        self.visit.satisfied = False
-
-            # Save survey participation
-            self.visit.survey_started = True
+        if self.visit.satisfied is False:
+            pass  # Already calculated, ignore.
+        else:
+            if self.question.for_satisfaction:
+                if self.positive_response:
+                    self.visit.satisfied = True
+                else:
+                    self.visit.satisfied = False
 
-            # If question is the last required question,
-            # then survey is completed.
-            if self.question.last_required:
-                self.visit.survey_completed = True
+        # Save survey participation
+        self.visit.survey_started = True
 
-            self.visit.save()
+        # If question is the last required question,
+        # then survey is completed.
+        if self.question.last_required:
+            self.visit.survey_completed = True
 
-        super(SurveyQuestionResponse, self).save(*args, **kwargs)
+    def save(self, *args, **kwargs):
+        """Set the associated clinic and service.
+        Also set various de-normalising variables on Visit
+        and SurveyQuestionResponse."""
+        # The statistics are computed from this model, so are imported here.
+        from myvoice.statistics.models import DailyStatistic
+
+        # The visit and the response are counted on the same clinic and day,
+        # which is only refreshed once both are saved.
+        with DailyStatistic.objects.deferred():
+            self.set_denormalized_fields()
+            if self.visit:
+                self.update_visit()
+                self.visit.save()
+
+            super(SurveyQuestionResponse, self).save(*args, **kwargs)
+
+
+@receiver(post_save, sender=Visit)
+def update_response_visit_time(sender, instance, **kwargs):
+    """Keep the visit time of the visit's responses up to date.
+
+    This is connected before the statistics receivers, which count the
+    responses by their visit time."""
+    if kwargs.get('raw') or kwargs.get('created'):
+        return
+    SurveyQuestionResponse.objects.filter(visit=instance).exclude(
+        visit_time=instance.visit_time).update(visit_time=instance.visit_time)
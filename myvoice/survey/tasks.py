@@ -1,15 +1,17 @@
 import logging
+import time
 
 from celery.task import task
 
 from django.conf import settings
 from django.utils import timezone
 
-from myvoice.clinics.models import Visit
+from myvoice.clinics.models import BlockedSender, Visit
+from myvoice.statistics.models import DailyStatistic
 
 from . import importer, utils as survey_utils
 from .models import Survey
-from .textit import TextItApi, TextItException
+from .textit import TextItApi, TextItApiBadRequest, TextItException
 
 
 logger = logging.getLogger(__name__)
@@ -29,12 +31,129 @@ def _get_survey_start_time(tm):
 
 @task
 def import_responses():
-    """Periodically check for new responses for each survey."""
+    """
+    Periodically check for new responses for each survey. Each survey is
+    imported by its own task, so that a slow flow does not hold up the others.
+    """
     logger.debug('Importing responses from active surveys.')
     for survey in Survey.objects.active():
-        logger.debug('Starting to import responses for flow {0}.'.format(survey.flow_id))
-        importer.import_responses(survey.flow_id)
-        logger.debug('Finished importing responses for flow {0}.'.format(survey.flow_id))
+        import_survey_responses.delay(survey.flow_id)
+
+
+@task
+def import_survey_responses(flow_id):
+    """
+    Import new responses for a single flow.
+
+    A lock is held in the cache for the duration of the import, so that if
+    the previous import of this flow is still running, this one is skipped
+    rather than importing the same runs twice.
+    """
+    with importer.import_lock(flow_id) as acquired:
+        if not acquired:
+            logger.info('Responses for flow {0} are already being imported.'.format(flow_id))
+            return
+        logger.debug('Starting to import responses for flow {0}.'.format(flow_id))
+        start = time.time()
+        saved = importer.import_responses(flow_id)
+        logger.info('Imported {0} responses for flow {1} in {2:.1f}s.'.format(
+            saved, flow_id, time.time() - start))
+
+
+def _chunk_visits(visits, size):
+    """
+    Split visits into chunks of at most size visits, in which no phone number
+    appears twice. Visits sharing a phone number are placed in later chunks,
+    so each gets its own run just as it would if sent individually.
+    """
+    chunks = []
+    for visit in visits:
+        for pks, phones in chunks:
+            if len(pks) < size and visit.mobile not in phones:
+                break
+        else:
+            pks, phones = [], set()
+            chunks.append((pks, phones))
+        pks.append(visit.pk)
+        phones.add(visit.mobile)
+    return [chunk[0] for chunk in chunks]
+
+
+def _get_started_phones(runs):
+    """
+    Returns the international-format phone numbers for which TextIt reports
+    having started a run, or None if the response does not identify them.
+    """
+    if not isinstance(runs, list) or not all('phone' in run for run in runs):
+        return None
+    phones = (survey_utils.convert_to_international_format(run['phone'] or '')
+              for run in runs)
+    return set(phone for phone in phones if phone)
+
+
+@task
+def start_feedback_surveys(visit_pks):
+    """
+    Initiate the patient feedback survey for a batch of Visits with a single
+    request to TextIt. Visits which TextIt did not start a run for are retried
+    individually with start_feedback_survey.
+    """
+    try:
+        survey = Survey.objects.get(role=Survey.PATIENT_FEEDBACK)
+    except Survey.DoesNotExist:
+        logger.exception("No patient feedback survey is registered.")
+        raise
+
+    visits = list(Visit.objects.filter(pk__in=visit_pks, survey_sent__isnull=True))
+    if len(visits) < len(visit_pks):
+        skipped = set(visit_pks) - set(v.pk for v in visits)
+        logger.warning("Survey has already been sent, or visit does not exist, for "
+                       "visits {}.".format(', '.join(str(pk) for pk in sorted(skipped))))
+    if not visits:
+        return
+
+    phones = []
+    for visit in visits:
+        if visit.mobile not in phones:
+            phones.append(visit.mobile)
+
+    api = TextItApi()
+    try:
+        runs = api.start_flow(survey.flow_id, phones)
+    except TextItApiBadRequest:
+        if len(visits) == 1:
+            logger.exception("Error sending survey for visit {}.".format(visits[0].pk))
+            raise
+        # A single bad phone number causes TextIt to reject the whole batch,
+        # so try each visit on its own to find it.
+        logger.warning("TextIt rejected survey batch of {} visits; sending "
+                       "individually.".format(len(visits)))
+        sent, failed = [], visits
+    except TextItException:
+        logger.exception("Error sending survey for visits "
+                         "{}.".format(', '.join(str(v.pk) for v in visits)))
+        raise
+    else:
+        started = _get_started_phones(runs)
+        if started is None:
+            sent, failed = visits, []
+        else:
+            sent, failed = [], []
+            for visit in visits:
+                phone = survey_utils.convert_to_international_format(visit.mobile)
+                (sent if phone in started else failed).append(visit)
+    finally:
+        api.client.log_latency()
+
+    if sent:
+        survey_sent = timezone.now()
+        Visit.objects.filter(pk__in=[v.pk for v in sent]).update(survey_sent=survey_sent)
+        DailyStatistic.objects.refresh_visits([v.pk for v in sent])
+        logger.debug("Initiated survey for {} visits at {}.".format(len(sent), survey_sent))
+    for visit in failed:
+        logger.warning("No run was started for visit {}; retrying on its "
+                       "own.".format(visit.pk))
+        start_feedback_survey.apply_async(args=[visit.pk])
 
 
 @task
@@ -74,7 +193,7 @@ def handle_new_visits():
     Schedule when feedback survey should start for all new visitors.
     Except for blocked visitors.
     """
-    blocked = Visit.objects.exclude(sender='').values_list('sender', flat=True).distinct()
+    blocked = BlockedSender.objects.values('sender')
     try:
         # Look for visits for which we haven't sent surveys.
         # We use welcome_sent to show that we have not scheduled surveys
@@ -102,15 +221,20 @@ def handle_new_visits():
             return
 
         # Schedule when to initiate the flow.
+        # All of these visits share the same start time, so they are sent to
+        # TextIt in batches rather than one request per visit.
         eta = _get_survey_start_time(timezone.now())
+        unsent = []
         for visit in new_visits:
             if visit.survey_sent is not None:
                 logger.debug("Somehow a survey has already been sent for "
                              "visit {}.".format(visit.pk))
                 continue
-            start_feedback_survey.apply_async(args=[visit.pk], eta=eta)
-            logger.debug("Scheduled survey to start for visit "
-                         "{} at {}.".format(visit.pk, eta))
+            unsent.append(visit)
+        for visit_pks in _chunk_visits(unsent, settings.SURVEY_BATCH_SIZE):
+            start_feedback_surveys.apply_async(args=[visit_pks], eta=eta)
+            logger.debug("Scheduled survey to start for {} visits "
+                         "at {}.".format(len(visit_pks), eta))
 
         # update visits at the end, since adding a value for welcome_sent prevents
         # us from finding the values we were originally interested in
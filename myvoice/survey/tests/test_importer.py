@@ -0,0 +1,137 @@
+import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from myvoice.core.tests import factories
+
+from .. import importer
+from .. import models
+
+
+@mock.patch.object(importer.TextItApi, 'iter_runs_for_flow')
+class TestImportResponses(TestCase):
+
+    def setUp(self):
+        self.survey = factories.Survey(role=models.Survey.PATIENT_FEEDBACK)
+        self.question = factories.SurveyQuestion(
+            survey=self.survey, label='Open Facility', categories='Yes\nNo')
+        self.visit = factories.Visit(
+            mobile='08122233301',
+            visit_time=timezone.make_aware(timezone.datetime(2014, 7, 21, 9), timezone.utc))
+
+    def make_run(self, modified_on, category='Yes', time='2014-07-21T10:00:00.000Z'):
+        return {
+            'run': 1,
+            'phone': '+2348122233301',
+            'modified_on': modified_on,
+            'values': [{
+                'label': 'Open Facility',
+                'category': category,
+                'value': category,
+                'time': time,
+            }],
+        }
+
+    def test_first_import(self, iter_runs_for_flow):
+        """The first import should retrieve every run in the flow."""
+        iter_runs_for_flow.return_value = [[self.make_run('2014-07-21T10:00:00.000Z')]]
+        self.assertEqual(importer.import_responses(self.survey.flow_id), 1)
+        self.assertEqual(iter_runs_for_flow.call_args, ((self.survey.flow_id,), {'after': None}))
+        response = models.SurveyQuestionResponse.objects.get()
+        self.assertEqual(response.visit, self.visit)
+        self.assertEqual(response.response, 'Yes')
+
+    def test_high_water_mark(self, iter_runs_for_flow):
+        """The most recent run modification time should be stored."""
+        iter_runs_for_flow.return_value = [
+            [self.make_run('2014-07-21T10:00:00.000Z'),
+             self.make_run('2014-07-21T12:00:00.000Z')],
+            [self.make_run('2014-07-21T11:00:00.000Z')],
+        ]
+        importer.import_responses(self.survey.flow_id)
+        survey = models.Survey.objects.get(pk=self.survey.pk)
+        expected = timezone.make_aware(timezone.datetime(2014, 7, 21, 12), timezone.utc)
+        self.assertEqual(survey.last_run_modified, expected)
+
+    def test_pages(self, iter_runs_for_flow):
+        """Answers in later pages should update responses saved from earlier ones."""
+        iter_runs_for_flow.return_value = [
+            [self.make_run('2014-07-21T10:00:00.000Z', 'Yes', '2014-07-21T10:00:00.000Z')],
+            [self.make_run('2014-07-21T11:00:00.000Z', 'No', '2014-07-21T11:00:00.000Z')],
+        ]
+        self.assertEqual(importer.import_responses(self.survey.flow_id), 2)
+        response = models.SurveyQuestionResponse.objects.get()
+        self.assertEqual(response.response, 'No')
+
+    def test_incremental_import(self, iter_runs_for_flow):
+        """Later imports should only ask for runs modified since the last one."""
+        last_run_modified = timezone.make_aware(
+            timezone.datetime(2014, 7, 21, 12), timezone.utc)
+        models.Survey.objects.filter(pk=self.survey.pk).update(
+            last_run_modified=last_run_modified)
+        iter_runs_for_flow.return_value = []
+        importer.import_responses(self.survey.flow_id)
+        self.assertEqual(iter_runs_for_flow.call_args,
+                         ((self.survey.flow_id,), {'after': last_run_modified}))
+        survey = models.Survey.objects.get(pk=self.survey.pk)
+        self.assertEqual(survey.last_run_modified, last_run_modified)
+
+    def test_full_import(self, iter_runs_for_flow):
+        """A full import should retrieve every run regardless of the last import."""
+        last_run_modified = timezone.make_aware(
+            timezone.datetime(2014, 7, 21, 12), timezone.utc)
+        models.Survey.objects.filter(pk=self.survey.pk).update(
+            last_run_modified=last_run_modified)
+        iter_runs_for_flow.return_value = []
+        importer.import_responses(self.survey.flow_id, full=True)
+        self.assertEqual(iter_runs_for_flow.call_args, ((self.survey.flow_id,), {'after': None}))
+
+    @mock.patch.object(models.SurveyQuestionResponse, 'save')
+    @mock.patch.object(models.SurveyQuestionResponseManager, 'bulk_upsert')
+    def test_failed_run_not_skipped(self, bulk_upsert, save, iter_runs_for_flow):
+        """The high-water mark should stop before a run which could not be saved."""
+        bulk_upsert.side_effect = Exception
+        save.side_effect = Exception
+        iter_runs_for_flow.return_value = [
+            [self.make_run('2014-07-21T11:00:00.000Z')],
+            [dict(self.make_run('2014-07-21T12:00:00.000Z'), values=[])],
+        ]
+        self.assertEqual(importer.import_responses(self.survey.flow_id), 0)
+        survey = models.Survey.objects.get(pk=self.survey.pk)
+        failed = timezone.make_aware(timezone.datetime(2014, 7, 21, 11), timezone.utc)
+        self.assertTrue(survey.last_run_modified < failed)
+        self.assertTrue(survey.last_run_modified > failed - timezone.timedelta(seconds=1))
+
+
+class TestVisitMatcher(TestCase):
+
+    def aware(self, *args):
+        return timezone.make_aware(timezone.datetime(*args), timezone.utc)
+
+    def setUp(self):
+        self.visit1 = factories.Visit(mobile='08122233301', visit_time=self.aware(2014, 7, 21, 9))
+        self.visit2 = factories.Visit(mobile='08122233301', visit_time=self.aware(2014, 7, 22, 9))
+        self.other = factories.Visit(mobile='08122233302', visit_time=self.aware(2014, 7, 21, 8))
+
+    def test_closest_earlier_visit(self):
+        """Answers should be matched to the latest visit before they were received."""
+        matcher = importer.VisitMatcher(['08122233301', '08122233302'], self.aware(2014, 7, 23))
+        self.assertEqual(matcher.match('08122233301', self.aware(2014, 7, 21, 10)), self.visit1)
+        self.assertEqual(matcher.match('08122233301', self.aware(2014, 7, 22, 9)), self.visit2)
+        self.assertEqual(matcher.match('08122233301', self.aware(2014, 7, 23)), self.visit2)
+        self.assertEqual(matcher.match('08122233302', self.aware(2014, 7, 23)), self.other)
+
+    def test_no_earlier_visit(self):
+        """Answers received before any visit for the phone should not be matched."""
+        matcher = importer.VisitMatcher(['08122233301'], self.aware(2014, 7, 23))
+        self.assertIsNone(matcher.match('08122233301', self.aware(2014, 7, 20)))
+        self.assertIsNone(matcher.match('08122233309', self.aware(2014, 7, 23)))
+
+    def test_single_query(self):
+        """Visits for all phone numbers should be loaded in one query."""
+        with self.assertNumQueries(1):
+            matcher = importer.VisitMatcher(
+                ['08122233301', '08122233302'], self.aware(2014, 7, 23))
+            matcher.match('08122233301', self.aware(2014, 7, 21, 10))
+            matcher.match('08122233302', self.aware(2014, 7, 21, 10))
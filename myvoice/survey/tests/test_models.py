@@ -1,5 +1,9 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from myvoice.clinics.models import Visit
 from myvoice.core.tests import factories
 
 from .. import models
@@ -149,3 +153,118 @@ class TestSurveyResponseVisit(TestCase):
 
         self.assertFalse(visit1.survey_completed)
         self.assertTrue(visit2.survey_completed)
+
+    def test_visit_time(self):
+        """Responses should keep the time of their visit."""
+        visit = factories.Visit.create()
+        question = factories.SurveyQuestion.create(survey=self.survey, label='Test')
+        response = factories.SurveyQuestionResponse.create(
+            question=question, response='no', visit=visit)
+        self.assertEqual(visit.visit_time, response.visit_time)
+
+        visit.visit_time -= timezone.timedelta(days=2)
+        visit.save()
+        response = models.SurveyQuestionResponse.objects.get(pk=response.pk)
+        self.assertEqual(visit.visit_time, response.visit_time)
+
+
+class TestBulkUpsert(TestCase):
+    """Test that bulk saving responses gives the same results as save()."""
+
+    def setUp(self):
+        self.survey = factories.Survey(role=models.Survey.PATIENT_FEEDBACK)
+        self.satisfaction = factories.SurveyQuestion.create(
+            survey=self.survey, for_satisfaction=True, label='Satisfaction',
+            categories="Yes\nNo")
+        self.wait_time = factories.SurveyQuestion.create(
+            survey=self.survey, for_satisfaction=True, last_negative=True,
+            label='Wait Time', categories="<1 hour\n1-2 hours\n>4 hours")
+        self.last = factories.SurveyQuestion.create(
+            survey=self.survey, last_required=True, label='Last', categories="Yes\nNo")
+        # The (question, response) pairs answered on each visit.
+        self.answers = [
+            [(self.satisfaction, 'Yes'), (self.wait_time, '1-2 hours'), (self.last, 'No')],
+            [(self.satisfaction, 'Yes'), (self.wait_time, '>4 hours')],
+            [(self.satisfaction, 'No'), (self.wait_time, '<1 hour'), (self.last, 'Yes')],
+            [(self.last, 'Yes')],
+        ]
+
+    def make_responses(self, answers):
+        """Create a visit for each list of answers, and unsaved responses."""
+        responses = []
+        for visit_answers in answers:
+            visit = factories.Visit.create()
+            for question, answer in visit_answers:
+                responses.append(models.SurveyQuestionResponse(
+                    visit=visit, question=question, response=answer))
+        return responses
+
+    def get_results(self, responses):
+        """Return the saved state of the responses and their visits."""
+        visits = Visit.objects.filter(
+            pk__in=set(r.visit_id for r in responses)).order_by('pk')
+        saved = models.SurveyQuestionResponse.objects.filter(
+            visit__in=visits).order_by('visit', 'question')
+        self.assertEqual(len(responses), len(saved))
+        for response in saved:
+            self.assertEqual(response.clinic_id, response.visit.patient.clinic_id)
+            self.assertEqual(response.service_id, response.visit.service_id)
+            self.assertEqual(response.visit_time, response.visit.visit_time)
+        return ([(r.question_id, r.response, r.positive_response) for r in saved],
+                [(v.satisfied, v.survey_started, v.survey_completed) for v in visits])
+
+    def test_new_responses(self):
+        """New responses and their visits should match those saved one by one."""
+        responses = self.make_responses(self.answers)
+        for response in responses:
+            response.save()
+        expected = self.get_results(responses)
+
+        responses = self.make_responses(self.answers)
+        models.SurveyQuestionResponse.objects.bulk_upsert(responses)
+        self.assertEqual(expected, self.get_results(responses))
+
+    def test_existing_visit_state(self):
+        """Visits which are already dis-satisfied should stay that way."""
+        answers = [[(self.satisfaction, 'Yes')]]
+        responses = self.make_responses(answers)
+        Visit.objects.filter(pk=responses[0].visit_id).update(satisfied=False)
+        responses[0].visit = Visit.objects.get(pk=responses[0].visit_id)
+        models.SurveyQuestionResponse.objects.bulk_upsert(responses)
+        self.assertEqual([(False, True, False)], self.get_results(responses)[1])
+
+    def test_updated_responses(self):
+        """Updating saved responses should match saving them one by one."""
+        responses = self.make_responses(self.answers)
+        for response in responses:
+            response.save()
+        saved = list(models.SurveyQuestionResponse.objects.filter(
+            pk__in=[r.pk for r in responses]).select_related('visit'))
+        for response in saved:
+            response.response = 'No'
+            response.save()
+        expected = self.get_results(saved)
+
+        responses = self.make_responses(self.answers)
+        models.SurveyQuestionResponse.objects.bulk_upsert(responses)
+        saved = list(models.SurveyQuestionResponse.objects.filter(
+            visit__in=[r.visit_id for r in responses]).select_related('visit'))
+        for response in saved:
+            response.response = 'No'
+        models.SurveyQuestionResponse.objects.bulk_upsert(saved)
+        self.assertEqual(expected, self.get_results(saved))
+
+    def test_updates_batched(self):
+        """Saved responses should be updated with a single query."""
+        responses = self.make_responses(self.answers)
+        models.SurveyQuestionResponse.objects.bulk_upsert(responses)
+        saved = list(models.SurveyQuestionResponse.objects.filter(
+            visit__in=[r.visit_id for r in responses]).select_related('visit'))
+        for response in saved:
+            response.response = 'No'
+        with CaptureQueriesContext(connection) as queries:
+            models.SurveyQuestionResponse.objects.bulk_upsert(saved)
+        table = models.SurveyQuestionResponse._meta.db_table
+        updates = [q for q in queries.captured_queries
+                   if q['sql'].startswith('UPDATE "{0}"'.format(table))]
+        self.assertEqual(1, len(updates))
@@ -1,5 +1,8 @@
 import mock
 
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
 from django.utils import timezone
 
@@ -8,25 +11,75 @@ from myvoice.core.tests import factories
 
 from .. import tasks
 from .. import models
-from ..textit import TextItException
+from ..textit import TextItApiBadRequest, TextItException
 
 
-@mock.patch('myvoice.survey.tasks.importer.import_responses')
+@mock.patch('myvoice.survey.tasks.import_survey_responses.delay')
 class TestImportResponses(TestCase):
 
-    def test_active_survey(self, import_responses):
-        """We should call the import_responses utility for active surveys."""
+    def test_active_survey(self, import_survey_responses):
+        """We should start an import task for active surveys."""
         self.survey = factories.Survey(active=True)
         tasks.import_responses()
-        self.assertEqual(import_responses.call_count, 1)
-        self.assertEqual(import_responses.call_args, ((self.survey.flow_id,),))
+        self.assertEqual(import_survey_responses.call_count, 1)
+        self.assertEqual(import_survey_responses.call_args, ((self.survey.flow_id,),))
 
-    def test_inactive_survey(self, import_responses):
+    def test_inactive_survey(self, import_survey_responses):
         """We should not try to import responses for inactive surveys."""
         self.survey = factories.Survey(active=False)
         tasks.import_responses()
+        self.assertEqual(import_survey_responses.call_count, 0)
+
+
+@mock.patch('myvoice.survey.tasks.importer.import_responses')
+class TestImportSurveyResponses(TestCase):
+
+    def setUp(self):
+        super(TestImportSurveyResponses, self).setUp()
+        self.survey = factories.Survey(active=True)
+        self.lock_key = 'import-survey-responses-{0}'.format(self.survey.flow_id)
+        self.addCleanup(cache.delete, self.lock_key)
+
+    def test_import(self, import_responses):
+        """We should call the import_responses utility for the flow."""
+        import_responses.return_value = 0
+        tasks.import_survey_responses(self.survey.flow_id)
+        self.assertEqual(import_responses.call_count, 1)
+        self.assertEqual(import_responses.call_args, ((self.survey.flow_id,),))
+        # The lock should be released afterwards.
+        self.assertIsNone(cache.get(self.lock_key))
+
+    def test_locked(self, import_responses):
+        """We should not import a flow which is already being imported."""
+        cache.add(self.lock_key, True)
+        tasks.import_survey_responses(self.survey.flow_id)
         self.assertEqual(import_responses.call_count, 0)
 
+    def test_error(self, import_responses):
+        """The lock should be released even if the import fails."""
+        import_responses.side_effect = Exception
+        self.assertRaises(Exception, tasks.import_survey_responses, self.survey.flow_id)
+        self.assertIsNone(cache.get(self.lock_key))
+
+    def test_expired_lock(self, import_responses):
+        """A lock taken by another import after ours expired should be kept."""
+        def take_over(flow_id):
+            cache.set(self.lock_key, 'other')
+            return 0
+        import_responses.side_effect = take_over
+        tasks.import_survey_responses(self.survey.flow_id)
+        self.assertEqual(cache.get(self.lock_key), 'other')
+
+    def test_command_locked(self, import_responses):
+        """The import_responses command should share the lock of the task."""
+        cache.add(self.lock_key, True)
+        self.assertRaises(CommandError, call_command, 'import_responses', self.survey.flow_id)
+        self.assertEqual(import_responses.call_count, 0)
+        cache.delete(self.lock_key)
+        call_command('import_responses', self.survey.flow_id)
+        self.assertEqual(import_responses.call_count, 1)
+        self.assertIsNone(cache.get(self.lock_key))
+
 
 @mock.patch.object(tasks.TextItApi, 'start_flow')
 class TestStartFeedbackSurvey(TestCase):
@@ -78,7 +131,7 @@ class TestStartFeedbackSurvey(TestCase):
 
 
 @mock.patch.object(tasks.TextItApi, 'send_message')
-@mock.patch('myvoice.survey.tasks.start_feedback_survey.apply_async')
+@mock.patch('myvoice.survey.tasks.start_feedback_surveys.apply_async')
 class TestHandleNewVisits(TestCase):
 
     def setUp(self):
@@ -154,6 +207,87 @@ class TestHandleNewVisits(TestCase):
         self.assertIsNone(visit2.welcome_sent)
         self.assertEqual(start_feedback_survey.call_count, 1)
 
+    def test_batches(self, start_feedback_survey, send_message):
+        """Visits should be scheduled in batches sharing the same start time."""
+        visits = [factories.Visit(welcome_sent=None, mobile='0123456789{}'.format(i))
+                  for i in range(3)]
+        with self.settings(SURVEY_BATCH_SIZE=2):
+            tasks.handle_new_visits()
+        self.assertEqual(send_message.call_count, 0)
+        self.assertEqual(start_feedback_survey.call_count, 2)
+        batches = [kwargs['args'][0] for args, kwargs in start_feedback_survey.call_args_list]
+        self.assertEqual(sorted(sum(batches, [])), sorted(v.pk for v in visits))
+        etas = set(kwargs['eta'] for args, kwargs in start_feedback_survey.call_args_list)
+        self.assertEqual(len(etas), 1)
+
+
+@mock.patch('myvoice.survey.tasks.start_feedback_survey.apply_async')
+@mock.patch.object(tasks.TextItApi, 'start_flow')
+class TestStartFeedbackSurveys(TestCase):
+
+    def setUp(self):
+        super(TestStartFeedbackSurveys, self).setUp()
+        self.survey = factories.Survey(role=models.Survey.PATIENT_FEEDBACK)
+        self.visit1 = factories.Visit(mobile='01234567890')
+        self.visit2 = factories.Visit(mobile='01234567891')
+        self.visit_pks = [self.visit1.pk, self.visit2.pk]
+
+    def get_survey_sent(self):
+        visits = Visit.objects.filter(pk__in=self.visit_pks).order_by('pk')
+        return [v.survey_sent for v in visits]
+
+    def test_start_flow(self, start_flow, start_feedback_survey):
+        """One request should start the flow for every visit in the batch."""
+        start_flow.return_value = []
+        tasks.start_feedback_surveys(self.visit_pks)
+        self.assertEqual(start_flow.call_count, 1)
+        expected = ((self.survey.flow_id, ['01234567890', '01234567891']),)
+        self.assertEqual(start_flow.call_args, expected)
+        survey_sent = self.get_survey_sent()
+        self.assertIsNotNone(survey_sent[0])
+        self.assertEqual(survey_sent[0], survey_sent[1])
+        self.assertEqual(start_feedback_survey.call_count, 0)
+
+    def test_already_sent(self, start_flow, start_feedback_survey):
+        """Visits which have already been sent a survey should be skipped."""
+        Visit.objects.filter(pk=self.visit1.pk).update(survey_sent=timezone.now())
+        start_flow.return_value = []
+        tasks.start_feedback_surveys(self.visit_pks)
+        expected = ((self.survey.flow_id, ['01234567891']),)
+        self.assertEqual(start_flow.call_args, expected)
+
+    def test_missing_phone(self, start_flow, start_feedback_survey):
+        """Visits without a run in the response should be retried on their own."""
+        start_flow.return_value = [{'run': 1, 'phone': '+2341234567890'}]
+        tasks.start_feedback_surveys(self.visit_pks)
+        survey_sent = self.get_survey_sent()
+        self.assertIsNotNone(survey_sent[0])
+        self.assertIsNone(survey_sent[1])
+        self.assertEqual(start_feedback_survey.call_args, ((), {'args': [self.visit2.pk]}))
+
+    def test_bad_request(self, start_flow, start_feedback_survey):
+        """If TextIt rejects the batch, each visit should be retried on its own."""
+        start_flow.side_effect = TextItApiBadRequest
+        tasks.start_feedback_surveys(self.visit_pks)
+        self.assertEqual(self.get_survey_sent(), [None, None])
+        self.assertEqual(start_feedback_survey.call_count, 2)
+
+    def test_error(self, start_flow, start_feedback_survey):
+        """If an error occurs during start_flow, survey_sent should be null."""
+        start_flow.side_effect = TextItException
+        self.assertRaises(TextItException, tasks.start_feedback_surveys, self.visit_pks)
+        self.assertEqual(self.get_survey_sent(), [None, None])
+        self.assertEqual(start_feedback_survey.call_count, 0)
+
+
+class TestChunkVisits(TestCase):
+
+    def test_chunk_visits(self):
+        """Chunks should be limited in size and never repeat a phone number."""
+        visits = [mock.Mock(pk=1, mobile='1'), mock.Mock(pk=2, mobile='1'),
+                  mock.Mock(pk=3, mobile='2'), mock.Mock(pk=4, mobile='3')]
+        self.assertEqual(tasks._chunk_visits(visits, 2), [[1, 3], [2, 4]])
+
 
 @mock.patch('myvoice.survey.tasks.settings')
 class TestGetSurveyStartTime(TestCase):
@@ -0,0 +1,172 @@
+import BaseHTTPServer
+import json
+import threading
+import time
+
+import mock
+import requests
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..textit import TextItApi, TextItApiClient, TextItApiNotFound, TextItException
+
+
+class TestTextItApi(TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.get.return_value = {'results': [1, 2], 'next': 'page2'}
+        self.client.request.side_effect = [
+            {'results': [3, 4], 'next': 'page3'},
+            {'results': [5], 'next': None},
+        ]
+        self.api = TextItApi(client=self.client)
+
+    def test_iter_runs_for_flow(self):
+        """Runs should be yielded one page at a time."""
+        pages = self.api.iter_runs_for_flow(1)
+        self.assertEqual(next(pages), [1, 2])
+        # The next page isn't requested until it is needed.
+        self.assertEqual(self.client.request.call_count, 0)
+        self.assertEqual(list(pages), [[3, 4], [5]])
+        self.assertEqual(self.client.request.call_args_list,
+                         [(('get', 'page2'),), (('get', 'page3'),)])
+
+    def test_get_runs_for_flow(self):
+        """All runs should be returned in a single list."""
+        self.assertEqual(self.api.get_runs_for_flow(1), [1, 2, 3, 4, 5])
+        self.assertEqual(self.client.get.call_args, (('runs',), {'params': {'flow': 1}}))
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Replies to each request with the next queued (status, body, delay)."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def handle_request(self):
+        server = self.server
+        server.requests.append((self.command, self.path, self.client_address))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        status, body, delay = server.replies.pop(0) if server.replies else (200, {}, 0)
+        time.sleep(delay)
+        content = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_DELETE = handle_request
+
+
+@override_settings(TEXTIT_API_RETRY_BACKOFF=0, TEXTIT_API_MAX_RETRIES=2,
+                   TEXTIT_API_TIMEOUT=(1, 0.5))
+class TestTextItApiClient(TestCase):
+    """Exercise the client against a local stub of the TextIt API."""
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.server.replies = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        base_url = 'http://127.0.0.1:{0}/api/v1/'.format(self.server.server_port)
+        self.client = TextItApiClient(token='token', base_url=base_url)
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reuse(self):
+        """Consecutive requests should reuse the same connection."""
+        self.client.get('runs')
+        self.client.get('runs')
+        self.assertEqual(len(self.server.requests), 2)
+        ports = set(address for _, _, address in self.server.requests)
+        self.assertEqual(len(ports), 1)
+
+    def test_retry(self):
+        """GET requests should be retried when TextIt is unavailable."""
+        self.server.replies = [(503, {}, 0), (200, {'results': [1]}, 0)]
+        self.assertEqual(self.client.get('runs'), {'results': [1]})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_retries_exhausted(self):
+        """An exception should be raised once the retries are used up."""
+        self.server.replies = [(502, {}, 0)] * 3
+        self.assertRaises(TextItException, self.client.get, 'runs')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_no_post_retry(self):
+        """POST requests should not be retried if TextIt may have handled them."""
+        self.server.replies = [(500, {}, 0), (200, {}, 0)]
+        self.assertRaises(TextItException, self.client.post, 'runs', data={})
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_not_found(self):
+        """Client errors should not be retried."""
+        self.server.replies = [(404, {}, 0)]
+        self.assertRaises(TextItApiNotFound, self.client.get, 'runs')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_timeout(self):
+        """Slow responses should raise an exception rather than hang."""
+        self.server.replies = [(200, {}, 1)]
+        self.assertRaises(TextItException, self.client.post, 'runs', data={})
+        # TextIt may have handled the request, so it should not be sent again.
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_post_connect_retry(self):
+        """POST requests should be retried if the connection could not be made."""
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {}
+        with mock.patch.object(self.client.session, 'post') as post:
+            post.side_effect = [requests.exceptions.ConnectTimeout(), response]
+            self.assertEqual(self.client.post('runs', data={}), {})
+        self.assertEqual(post.call_count, 2)
+
+    @override_settings(TEXTIT_API_MAX_RETRY_AFTER=5)
+    def test_retry_after_cap(self):
+        """Long Retry-After delays should be capped."""
+        client = TextItApiClient(token='token')
+        response = mock.Mock(headers={'Retry-After': '3600'})
+        self.assertEqual(client.get_retry_delay(0, response), 5)
+        response.headers['Retry-After'] = '2'
+        self.assertEqual(client.get_retry_delay(0, response), 2)
+
+    def test_latency(self):
+        """The time taken by each request should be recorded per endpoint."""
+        self.client.get('runs')
+        self.client.get('runs')
+        self.client.post('runs', data={})
+        stats = self.client.latency['GET /api/v1/runs.json']
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(stats.errors, 0)
+        self.assertTrue(stats.max >= stats.mean > 0)
+        self.assertEqual(self.client.latency['POST /api/v1/runs.json'].count, 1)
+
+    def test_log_latency(self):
+        """Logging the latency should start new totals."""
+        self.client.get('runs')
+        with mock.patch('myvoice.survey.textit.logger') as logger:
+            self.client.log_latency()
+        self.assertEqual(logger.info.call_count, 1)
+        self.assertIn('GET /api/v1/runs.json', logger.info.call_args[0][0])
+        self.assertEqual(dict(self.client.latency), {})
+
+
+class TestDefaultClient(TestCase):
+
+    @override_settings(TEXTIT_API_TOKEN='token')
+    @mock.patch.object(TextItApi, '_default_client', None)
+    def test_shared_client(self):
+        """API instances should share one client, and so one connection pool."""
+        self.assertIs(TextItApi().client, TextItApi().client)
@@ -1,6 +1,15 @@
+from collections import defaultdict
+import logging
+import time
+import urlparse
+
 import requests
 
 from django.conf import settings
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
 
 
 class TextItException(Exception):
@@ -22,78 +31,221 @@ class TextItApiBadRequest(TextItException):
     pass
 
 
+class LatencyStats(object):
+    """Running totals of the time taken by requests to an endpoint."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return '<LatencyStats count={0} errors={1} mean={2:.3f}s max={3:.3f}s>'.format(
+            self.count, self.errors, self.mean, self.max)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def add(self, seconds, error=False):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if error:
+            self.errors += 1
+
+
 class TextItApiClient(object):
 
-    def __init__(self, token=None):
+    # Responses with these status codes are retried, with backoff.
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # POST requests are not idempotent (e.g., starting a flow), so they are
+    # only retried when the server tells us it did not handle the request.
+    RETRY_POST_STATUSES = (429, 503)
+
+    def __init__(self, token=None, base_url=None):
         super(TextItApiClient, self).__init__()
         self.token = token or settings.TEXTIT_API_TOKEN
         assert bool(self.token)
+        self.base_url = base_url or settings.TEXTIT_API_URL
+        self.timeout = settings.TEXTIT_API_TIMEOUT
+        self.max_retries = settings.TEXTIT_API_MAX_RETRIES
+        self.backoff = settings.TEXTIT_API_RETRY_BACKOFF
+        self.max_retry_after = settings.TEXTIT_API_MAX_RETRY_AFTER
+        self.pool_size = settings.TEXTIT_API_POOL_SIZE
+        self.latency = defaultdict(LatencyStats)
+        self._session = None
 
     @property
     def session(self):
-        session = requests.Session()
-        session.headers['Authorization'] = 'Token {0}'.format(self.token)
-        return session
+        """
+        A session which is created on first use and then reused, so that
+        connections to TextIt are kept open between requests.
+        """
+        if self._session is None:
+            session = requests.Session()
+            session.headers['Authorization'] = 'Token {0}'.format(self.token)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
 
     def delete(self, endpoint, **kwargs):
         """Send a DELETE request to a standard TextIt endpoint."""
-        url = TextItApiClient.get_api_url(endpoint)
+        url = self.get_api_url(endpoint)
         return self.request('delete', url, **kwargs)
 
     def get(self, endpoint, **kwargs):
         """Send a GET request to a standard TextIt endpoint."""
-        url = TextItApiClient.get_api_url(endpoint)
+        url = self.get_api_url(endpoint)
         return self.request('get', url, **kwargs)
 
-    @classmethod
-    def get_api_url(cls, endpoint):
+    def get_api_url(self, endpoint):
         """Build the full API url from a standard endpoint."""
-        return 'https://api.textit.in/api/v1/{0}.json'.format(endpoint)
+        return '{0}{1}.json'.format(self.base_url, endpoint)
 
     def post(self, endpoint, **kwargs):
         """Send a POST request to a standard TextIt endpoint."""
-        url = TextItApiClient.get_api_url(endpoint)
+        url = self.get_api_url(endpoint)
         return self.request('post', url, **kwargs)
 
+    def get_retry_delay(self, attempt, response=None):
+        """
+        Seconds to wait before retrying, honouring any Retry-After header up
+        to max_retry_after seconds.
+        """
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(int(response.headers['Retry-After']), self.max_retry_after)
+        return self.backoff * (2 ** attempt)
+
+    def log_latency(self):
+        """Log the latency of each endpoint since the last call, and reset it."""
+        for endpoint, stats in sorted(self.latency.items()):
+            logger.info("{0}: {1} requests, {2} errors, mean {3:.3f}s, max {4:.3f}s".format(
+                endpoint, stats.count, stats.errors, stats.mean, stats.max))
+        self.latency.clear()
+
     def request(self, method, url, **kwargs):
         """
         Send a get, post, or delete request to a URL using TextIt
         authorization details.
+
+        Connection errors and responses with a RETRY_STATUSES status are
+        retried up to max_retries times, waiting longer after each attempt.
+        POST requests, which may not be safe to send twice, are only retried
+        if the connection could not be made or the response has a
+        RETRY_POST_STATUSES status, which means TextIt did not handle them.
         """
         if method not in ('get', 'post', 'delete'):
             raise Exception("Unsupported method: {0}".format(method))
         method_func = getattr(self.session, method)
-        try:
-            response = method_func(url, **kwargs)
-        except Exception as e:
-            raise TextItException(e)
+        kwargs.setdefault('timeout', self.timeout)
+        if method == 'post':
+            retry_statuses = self.RETRY_POST_STATUSES
+            # Other connection errors may happen once the request was sent.
+            retry_errors = requests.exceptions.ConnectTimeout
+        else:
+            retry_statuses = self.RETRY_STATUSES
+            retry_errors = requests.ConnectionError
+        endpoint = '{0} {1}'.format(method.upper(), urlparse.urlparse(url).path)
+
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                response = method_func(url, **kwargs)
+            except retry_errors as e:
+                self.latency[endpoint].add(time.time() - start, error=True)
+                if attempt >= self.max_retries:
+                    raise TextItException(e)
+                response = None
+            except Exception as e:
+                self.latency[endpoint].add(time.time() - start, error=True)
+                raise TextItException(e)
+            else:
+                elapsed = time.time() - start
+                self.latency[endpoint].add(elapsed, error=response.status_code >= 400)
+                logger.debug("{0} returned {1} in {2:.3f}s".format(
+                    endpoint, response.status_code, elapsed))
+                if response.status_code not in retry_statuses or attempt >= self.max_retries:
+                    break
+            delay = self.get_retry_delay(attempt, response)
+            logger.warning("Retrying {0} in {1}s (attempt {2} of {3}).".format(
+                endpoint, delay, attempt + 1, self.max_retries))
+            time.sleep(delay)
+            attempt += 1
+
         if response.status_code == 403:
             raise TextItApiPermissionDenied()
         elif response.status_code == 404:
             raise TextItApiNotFound()
         elif response.status_code == 400:
             raise TextItApiBadRequest()
+        elif response.status_code in self.RETRY_STATUSES:
+            raise TextItException("TextIt returned {0} for {1}.".format(
+                response.status_code, endpoint))
         else:
             return response.json()
 
 
 class TextItApi(object):
 
+    # Client shared by all instances in this process, so that its pooled
+    # connections are reused across tasks.
+    _default_client = None
+
     def __init__(self, client=None):
         super(TextItApi, self).__init__()
-        self.client = client or TextItApiClient()
+        self.client = client or TextItApi.get_default_client()
+
+    @classmethod
+    def get_default_client(cls):
+        if cls._default_client is None:
+            cls._default_client = TextItApiClient()
+        return cls._default_client
+
+    @classmethod
+    def format_datetime(cls, dt):
+        """Format a datetime the way the TextIt API expects in filters."""
+        if timezone.is_aware(dt):
+            dt = timezone.make_naive(dt, timezone.utc)
+        return dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
 
-    def get_runs_for_flow(self, flow_id):
+    def iter_runs_for_flow(self, flow_id, after=None):
+        """Yields the runs for a flow with a given id, one page at a time.
+
+        If after is given, only runs which were modified after that time
+        are returned.
+
+        TextIt paginates results in groups of 10. Each page is requested
+        only when the previous one has been consumed, so callers can
+        process runs as they arrive without holding the whole flow history
+        in memory.
+        """
+        params = {'flow': flow_id}
+        if after is not None:
+            params['after'] = TextItApi.format_datetime(after)
+        run_data = self.client.get('runs', params=params)
+        yield run_data['results']
+        while run_data['next']:
+            run_data = self.client.request('get', run_data['next'])
+            yield run_data['results']
+
+    def get_runs_for_flow(self, flow_id, after=None):
         """Returns all runs for a flow with a given id.
 
+        If after is given, only runs which were modified after that time
+        are returned.
+
         TextIt paginates results in groups of 10. This method will make
         multiple requests to retrieve all of the paginated results.
         """
-        run_data = self.client.get('runs', params={'flow': flow_id})
-        runs = run_data['results']
-        while run_data['next']:
-            run_data = self.client.request('get', run_data['next'])
-            runs = runs + run_data['results']
+        runs = []
+        for page in self.iter_runs_for_flow(flow_id, after=after):
+            runs.extend(page)
         return runs
 
     def start_flow(self, flow_id, phones):
@@ -89,11 +89,11 @@ def filter_sqr_query(responses, clinic=None, service=None, start_date=None, end_
 
     if isinstance(start_date, basestring):
         start_date = timezone.make_aware(parse(start_date), timezone.utc)
-        params.update({'visit__visit_time__gte': start_date})
+        params.update({'visit_time__gte': start_date})
 
     if isinstance(end_date, basestring):
         end_date = timezone.make_aware(parse(end_date), timezone.utc)
-        params.update({'visit__visit_time__lte': end_date})
+        params.update({'visit_time__lte': end_date})
     responses = responses.filter(**params)
 
     return responses